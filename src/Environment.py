@@ -1,45 +1,89 @@
 from runtime_error import RuntimeError_
 
+# Marks a global slot that has been handed out but not defined yet.
+_undefined = object()
+
+# At most this many Environments are kept for reuse.
+FREE_ENVIRONMENTS_MAX = 256
+
 
 class Environment:
-    def __init__(self, enclosing=None):
-        self.values = {}
-        self.enclosing = enclosing
+    # One function call: `values` is its frame, holding the receiver (for
+    # methods), the arguments and then every local of every block in the
+    # function, in the slots the Resolver gave them. Blocks drop their
+    # locals off the end when they finish. `upvalues` is what the function's
+    # closure captured.
+    #
+    # Closures capture upvalues, never an Environment, so nothing uses a
+    # call's Environment once the call has returned. It then goes on
+    # free_environments, for the next call to take instead of making one.
+    __slots__ = ("values", "upvalues")
 
-    def define(self, name, value):
-        self.values[name] = value
+    def __init__(self, values, upvalues):
+        self.values = values
+        self.upvalues = upvalues
 
-    def get(self, name):
-        if name.lexeme in self.values.keys():
-            return self.values[name.lexeme]
 
-        if self.enclosing is not None:
-            return self.enclosing.get(name)
+free_environments = []
 
-        raise RuntimeError_(name, "Undefined variable '" + name.lexeme + "'.")
 
-    def assign(self, name, value):
-        if name.lexeme in self.values.keys():
-            self.values[name.lexeme] = value
-            return
+def acquire_environment(values, upvalues):
+    if free_environments:
+        environment = free_environments.pop()
+        environment.values = values
+        environment.upvalues = upvalues
+        return environment
+    return Environment(values, upvalues)
 
-        if self.enclosing is not None:
-            self.enclosing.assign(name, value)
-            return
 
-        raise RuntimeError_(name, "Undefined variable '" + name.lexeme + "'.")
+def release_environment(environment):
+    environment.values = None
+    environment.upvalues = None
+    if len(free_environments) < FREE_ENVIRONMENTS_MAX:
+        free_environments.append(environment)
 
-    def get_at(self, distance, name):
-        return self.ancestor(distance).values[name]
 
-    def ancestor(self, distance):
-        environment = self 
-        
-        for _ in range(distance):
-            environment = environment.enclosing
-        
-        return environment
+class Cell:
+    # A captured variable that may change after it was captured, shared by
+    # the frame that declared it and every closure that captured it.
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class GlobalEnvironment:
+    # Globals live in a list. slot() hands out a stable index per name the
+    # first time the name is seen, defined or not, so references can cache
+    # it; an unset slot holds _undefined until a definition fills it in.
+
+    def __init__(self):
+        self.slots = {}
+        self.values = []
+
+    def slot(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.values)
+            self.values.append(_undefined)
+        return slot
+
+    def define(self, name, value):
+        self.values[self.slot(name)] = value
+
+    def get(self, name):
+        return self.get_slot(self.slot(name.lexeme), name)
+
+    def assign(self, name, value):
+        self.assign_slot(self.slot(name.lexeme), name, value)
 
-    def assign_at(self, distance, name, value):
-        self.ancestor(distance).values[name.lexeme] = value
+    def get_slot(self, slot, name):
+        value = self.values[slot]
+        if value is _undefined:
+            raise RuntimeError_(name, "Undefined variable '" + name.lexeme + "'.")
+        return value
 
+    def assign_slot(self, slot, name, value):
+        if self.values[slot] is _undefined:
+            raise RuntimeError_(name, "Undefined variable '" + name.lexeme + "'.")
+        self.values[slot] = value
@@ -2,17 +2,23 @@ from abc import ABC, abstractmethod
 from token import *
 
 class Expr:
-    pass
+    __slots__ = ()
 
 class Assign(Expr):
+    __slots__ = ("name", "value", "resolved", "global_slot")
+
     def __init__(self, name, value):
         self.name = name
         self.value = value
+        self.resolved = None
+        self.global_slot = None
 
     def accept(self, visitor):
         return visitor.visit_assign_expr(self)
 
 class Binary(Expr):
+    __slots__ = ("left", "operator", "right")
+
     def __init__(self, left, operator, right):
         self.left = left
         self.operator = operator
@@ -22,6 +28,8 @@ class Binary(Expr):
         return visitor.visit_binary_expr(self)
 
 class Grouping(Expr):
+    __slots__ = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -29,6 +37,8 @@ class Grouping(Expr):
         return visitor.visit_grouping_expr(self)
 
 class Literal(Expr):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = value
 
@@ -36,6 +46,8 @@ class Literal(Expr):
         return visitor.visit_literal_expr(self)
 
 class Logical(Expr):
+    __slots__ = ("left", "operator", "right")
+
     def __init__(self, left, operator, right):
         self.left = left
         self.operator = operator
@@ -45,6 +57,8 @@ class Logical(Expr):
         return visitor.visit_logical_expr(self)
 
 class Unary(Expr):
+    __slots__ = ("operator", "right")
+
     def __init__(self, operator, right):
         self.operator = operator
         self.right = right
@@ -53,13 +67,19 @@ class Unary(Expr):
         return visitor.visit_unary_expr(self)
 
 class Variable(Expr):
+    __slots__ = ("name", "resolved", "global_slot")
+
     def __init__(self, name):
         self.name = name
+        self.resolved = None
+        self.global_slot = None
 
     def accept(self, visitor):
         return visitor.visit_variable_expr(self)
 
 class Call(Expr):
+    __slots__ = ("callee", "paren_loc", "arguments")
+
     def __init__(self, callee, paren_loc, arguments):
         self.callee = callee
         self.paren_loc = paren_loc
@@ -69,6 +89,8 @@ class Call(Expr):
         return visitor.visit_call_expr(self)
 
 class Grouping(Expr):
+    __slots__ = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -76,33 +98,47 @@ class Grouping(Expr):
         return visitor.visit_grouping_expr(self)
 
 class Get(Expr):
+    __slots__ = ("object", "name", "cache")
+
     def __init__(self, object, name):
         self.object = object
         self.name = name
+        self.cache = None
 
     def accept(self, visitor):
         return visitor.visit_get_expr(self)
 
 class Set(Expr):
+    __slots__ = ("object", "name", "value", "cache")
+
     def __init__(self, object, name, value):
         self.object = object
         self.name = name
         self.value = value
+        self.cache = None
 
     def accept(self, visitor):
         return visitor.visit_set_expr(self)
 
 class Self(Expr):
+    __slots__ = ("keyword", "resolved")
+
     def __init__(self, keyword):
         self.keyword = keyword
+        self.resolved = None
 
     def accept(self, visitor):
         return visitor.visit_self_expr(self)
 
 class Super(Expr):
+    __slots__ = ("keyword", "method", "resolved", "receiver", "cache")
+
     def __init__(self, keyword, method):
         self.keyword = keyword
         self.method = method
+        self.resolved = None
+        self.receiver = None
+        self.cache = None
 
     def accept(self, visitor):
         return visitor.visit_super_expr(self)
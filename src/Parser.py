@@ -3,17 +3,90 @@ from tokentype import TokenType
 from Expr import *
 from error_handler import ErrorHandler
 from Stmt import *
+from lazy_body import LazyBody
+
+# What the pre-parse of a lazy body watches for. For each token, the tokens
+# that can never follow it: an operator with no operand after it, an operand
+# followed by another or by the end of a statement that has no ';', and so
+# on. It cannot see everything the parser and resolver would, but it finds
+# the usual slips.
+OPERANDS = frozenset((
+    TokenType.IDENTIFIER, TokenType.NUMBER, TokenType.STRING,
+    TokenType.TRUE, TokenType.FALSE, TokenType.NIL, TokenType.SELF,
+))
+EXPRESSION_STARTS = OPERANDS | {TokenType.SUPER, TokenType.LEFT_PAREN, TokenType.MINUS, TokenType.BANG}
+OPERATORS = (
+    TokenType.MINUS, TokenType.PLUS, TokenType.SLASH, TokenType.STAR,
+    TokenType.BANG, TokenType.BANG_EQUAL, TokenType.EQUAL, TokenType.EQUAL_EQUAL,
+    TokenType.GREATER, TokenType.GREATER_EQUAL, TokenType.LESS, TokenType.LESS_EQUAL,
+    TokenType.AND, TokenType.OR,
+)
+STATEMENT_ENDS = (
+    TokenType.RIGHT_BRACE, TokenType.VAR, TokenType.PRINT, TokenType.RETURN,
+    TokenType.IF, TokenType.WHILE, TokenType.FOR, TokenType.FUN, TokenType.CLASS,
+)
+NOT_AFTER = {
+    **dict.fromkeys(TokenType, frozenset()),
+    **dict.fromkeys(OPERATORS, frozenset(TokenType) - EXPRESSION_STARTS),
+    **dict.fromkeys(OPERANDS, OPERANDS.union(STATEMENT_ENDS)),
+    TokenType.DOT: frozenset(TokenType) - {TokenType.IDENTIFIER},
+    TokenType.RIGHT_PAREN: frozenset((TokenType.RIGHT_BRACE,)),
+}
+
+# What can come just before the name an '=' assigns to.
+BEFORE_TARGET = frozenset((
+    TokenType.VAR, TokenType.DOT, TokenType.SEMICOLON, TokenType.COMMA,
+    TokenType.LEFT_BRACE, TokenType.RIGHT_BRACE, TokenType.LEFT_PAREN, TokenType.RIGHT_PAREN,
+    TokenType.EQUAL, TokenType.ELSE, TokenType.RETURN, TokenType.PRINT,
+))
+
+class TreeBuilder:
+    # What the Parser builds nodes with unless it is given something else,
+    # such as a FlatBuilder: the node classes themselves.
+    Assign = Assign
+    Binary = Binary
+    Grouping = Grouping
+    Literal = Literal
+    Logical = Logical
+    Unary = Unary
+    Variable = Variable
+    Call = Call
+    Get = Get
+    Set = Set
+    Self = Self
+    Super = Super
+    Block = Block
+    Expression = Expression
+    Print = Print
+    Var = Var
+    If = If
+    While = While
+    For = For
+    Function = Function
+    Return = Return
+    Class = Class
+
 
 class Parser:
     class ParseError(RuntimeError):
         def __init__(self, message):
             super().__init__(message)
 
-    def __init__(self, tokens, error_handler):
+    def __init__(self, tokens, error_handler, lazy=False, nodes=TreeBuilder):
         self.error_handler = error_handler
+        self.nodes = nodes
+
+        # With `lazy`, the bodies of top-level functions and methods are
+        # only pre-parsed; see LazyBody.
+        self.lazy = lazy
+        self.depth = 0
 
-        self.tokens = tokens
-        self._current = 0
+        # Tokens are pulled one at a time from any iterable, such as
+        # Scanner.stream(). Only the next token and the one just consumed
+        # are kept.
+        self.tokens = iter(tokens)
+        self._next = next(self.tokens)
+        self._previous = None
 
     def expression(self):
         return self.assignment()
@@ -23,7 +96,7 @@ class Parser:
             if self.match([TokenType.VAR]):
                 return self.var_declaration()
             if self.match([TokenType.FUN]):
-                return self.function("function")
+                return self.function("function", self.lazy and self.depth == 0)
             if self.match([TokenType.CLASS]):
                 return self.class_declaration()
 
@@ -38,19 +111,23 @@ class Parser:
         superclass = None
         if self.match([TokenType.LESS]):
             self.consume(TokenType.IDENTIFIER, "Expect superclass name.")
-            superclass = Variable(self.previous())
+            superclass = self.nodes.Variable(self.previous())
 
         self.consume(TokenType.LEFT_BRACE, "Expect '{' before class body.")
 
+        # A subclass's methods capture `super` when the class is made, so
+        # what they refer to has to be known up front.
+        lazy = self.lazy and self.depth == 0 and superclass is None
+
         methods = []
         while not self.check(TokenType.RIGHT_BRACE) and not self._isAtEnd():
-            methods.append(self.function("method"))
+            methods.append(self.function("method", lazy))
 
         self.consume(TokenType.RIGHT_BRACE, "Expect '}' after class body.")
 
-        return Class(name, superclass, methods)
+        return self.nodes.Class(name, superclass, methods)
 
-    def function(self, kind):
+    def function(self, kind, lazy=False):
         name = self.consume(TokenType.IDENTIFIER, "Expect " + kind + " name.")
         self.consume(TokenType.LEFT_PAREN, f"Expected '(' after {kind} name.")
 
@@ -58,15 +135,131 @@ class Parser:
         if not self.check(TokenType.RIGHT_PAREN):
             while True:
                 if len(parameters) >= 255:
-                    self.error(self.peek(), "Parse Error", "Can't have more than 255 parameters in {kind} {name.lexeme}")
+                    self.error(self.peek(), f"Can't have more than 255 parameters in {kind} {name.lexeme}")
                 parameters.append(self.consume(TokenType.IDENTIFIER, "Expected parameter name."))
                 if not self.match([TokenType.COMMA]):
                     break 
 
         self.consume(TokenType.RIGHT_PAREN, "Expected ')' after parameters.")
         self.consume(TokenType.LEFT_BRACE, f"Expected '{{' before {kind} body.")
-        body = self.block()
-        return Function(name, parameters, body)
+        body = self.pre_parse_body(kind, name, parameters) if lazy else self.block()
+        return self.nodes.Function(name, parameters, body)
+
+    def pre_parse_body(self, kind, name, parameters):
+        # Skips to the matching closing brace and keeps where the body is in
+        # the source, up to and including that brace. This is the bulk of
+        # what a lazy parse does, so it pulls tokens straight from the input
+        # rather than through advance().
+        #
+        # On the way it looks for signs of a static error (see NOT_AFTER),
+        # and parses a body that shows one right away, so that its errors
+        # are reported before the program runs, as they are without `lazy`.
+        brace = self._previous
+        source = brace.source
+        start = brace.end
+        pieces = []
+        tokens = []
+
+        initializer = kind == "method" and name.lexeme == "init"
+        names = {param.lexeme for param in parameters}
+        suspect = len(names) < len(parameters)
+        scopes = [names]
+        parens = 0
+        declaring = None
+
+        # Looked up once rather than on every token.
+        EOF, LEFT_BRACE, RIGHT_BRACE = TokenType.EOF, TokenType.LEFT_BRACE, TokenType.RIGHT_BRACE
+        LEFT_PAREN, RIGHT_PAREN = TokenType.LEFT_PAREN, TokenType.RIGHT_PAREN
+        SEMICOLON, IDENTIFIER, EQUAL, DOT = TokenType.SEMICOLON, TokenType.IDENTIFIER, TokenType.EQUAL, TokenType.DOT
+        VAR, SUPER, SELF, RETURN = TokenType.VAR, TokenType.SUPER, TokenType.SELF, TokenType.RETURN
+        DECLARATIONS = (VAR, TokenType.FUN, TokenType.CLASS)
+        not_after = NOT_AFTER
+        append = tokens.append
+
+        depth = 1
+        previous = brace
+        last = LEFT_BRACE
+        before = None
+        token = self._next
+        tokentype = token.tokentype
+        while tokentype is not EOF:
+            append(token)
+            if tokentype in not_after[last]:
+                suspect = True
+            elif initializer and last is RETURN and tokentype is not SEMICOLON:
+                suspect = True
+
+            if token.source is not source:
+                # A streamed source whose body runs on into the next chunk:
+                # the body gets a copy of its text, with the lines kept.
+                pieces.append(source[start:previous.end])
+                gap = token.line - token.lexeme.count("\n") - previous.line
+                pieces.append("\n" * gap if gap > 0 else " ")
+                source = token.source
+                start = token.start
+
+            if tokentype is IDENTIFIER:
+                if last in DECLARATIONS:
+                    # A variable declared twice in one scope, though not
+                    # the one a for loop declares in its own.
+                    if before is not LEFT_PAREN:
+                        suspect = suspect or token.lexeme in scopes[-1]
+                        scopes[-1].add(token.lexeme)
+                    if last is VAR:
+                        declaring = token.lexeme
+                elif declaring is not None and last is not DOT and token.lexeme == declaring:
+                    # Read in its own initializer.
+                    suspect = True
+            elif tokentype is SEMICOLON:
+                declaring = None
+            elif tokentype is LEFT_PAREN:
+                parens += 1
+            elif tokentype is RIGHT_PAREN:
+                parens -= 1
+                suspect = suspect or parens < 0
+            elif tokentype is LEFT_BRACE:
+                depth += 1
+                scopes.append(set())
+                suspect = suspect or parens > 0
+            elif tokentype is RIGHT_BRACE:
+                depth -= 1
+                scopes.pop()
+                suspect = suspect or parens > 0
+                if depth == 0:
+                    self._previous = token
+                    self._next = next(self.tokens)
+                    if suspect:
+                        append(Token(EOF, "", 0, 0, None, token.line))
+                        return Parser(tokens, self.error_handler, nodes=self.nodes).lazy_body()
+                    if pieces:
+                        pieces.append(source[start:token.end])
+                        text = "".join(pieces)
+                        return LazyBody(text, 0, len(text), brace.line, kind)
+                    return LazyBody(source, start, token.end, brace.line, kind)
+            elif tokentype is EQUAL:
+                suspect = suspect or last is not IDENTIFIER or before not in BEFORE_TARGET
+            elif tokentype is SUPER:
+                # Only classes with no superclass have lazy methods.
+                suspect = True
+            elif tokentype is SELF:
+                suspect = suspect or kind == "function"
+
+            before = last
+            last = tokentype
+            previous = token
+            token = next(self.tokens)
+            tokentype = token.tokentype
+
+        self._next = token
+        raise self.error(token, "Expect '}' after block.")
+
+    def lazy_body(self):
+        # The statements of a pre-parsed body, scanned again from the source
+        # of a LazyBody.
+        try:
+            return self.block()
+        except Parser.ParseError:
+            return []
 
     def statement(self):
         if self.match([TokenType.PRINT]):
@@ -80,7 +273,7 @@ class Parser:
         if self.match([TokenType.RETURN]):
             return self.return_statement()
         if self.match([TokenType.LEFT_BRACE]):
-            return Block(self.block())
+            return self.nodes.Block(self.block())
 
         return self.expression_statement()
 
@@ -91,9 +284,10 @@ class Parser:
             value = self.expression()
 
         self.consume(TokenType.SEMICOLON, "Expect ';' after return value.")
-        return Return(keyword, value)
+        return self.nodes.Return(keyword, value)
 
     def if_statement(self):
+        keyword = self.previous()
         self.consume(TokenType.LEFT_PAREN, "Expect '(' after 'if'.")
         condition = self.expression()
         self.consume(TokenType.RIGHT_PAREN, "Expect ')' after if confition.")
@@ -104,17 +298,17 @@ class Parser:
         if self.match([TokenType.ELSE]):
             else_branch = self.statement()
 
-        return If(condition, then_branch, else_branch)
+        return self.nodes.If(keyword, condition, then_branch, else_branch)
 
     def print_statement(self):
         value = self.expression()
         self.consume(TokenType.SEMICOLON, "Expect ';' after value.")
-        return Print(value)
+        return self.nodes.Print(value)
 
     def expression_statement(self):
         expr = self.expression()
         self.consume(TokenType.SEMICOLON, "Expect ';' after expression.")
-        return Expression(expr)
+        return self.nodes.Expression(expr)
 
     def assignment(self):
         expr = self.or_()
@@ -124,11 +318,11 @@ class Parser:
             value = self.assignment()
 
             if isinstance(expr, Variable):
-                return Assign(expr.name, value)
+                return self.nodes.Assign(expr.name, value)
             elif isinstance(expr, Get):
-                return Set(expr.object, expr.name, value)
+                return self.nodes.Set(expr.object, expr.name, value)
             else:
-                self.error(equals.token, "Invalid assignment target.")
+                self.error(equals, "Invalid assignment target.")
 
         return expr
 
@@ -138,7 +332,7 @@ class Parser:
         while self.match([TokenType.OR]):
             operator = self.previous()
             right = self.and_()
-            expr = Logical(expr, operator, right)
+            expr = self.nodes.Logical(expr, operator, right)
 
         return expr
 
@@ -148,15 +342,19 @@ class Parser:
         while self.match([TokenType.AND]):
             operator = self.previous()
             right = self.equality()
-            expr = Logical(expr, operator, right)
+            expr = self.nodes.Logical(expr, operator, right)
 
         return expr
 
     def block(self):
         statements = []
 
-        while not self.check(TokenType.RIGHT_BRACE) and not self._isAtEnd():
-            statements.append(self.declaration())
+        self.depth += 1
+        try:
+            while not self.check(TokenType.RIGHT_BRACE) and not self._isAtEnd():
+                statements.append(self.declaration())
+        finally:
+            self.depth -= 1
 
         self.consume(TokenType.RIGHT_BRACE, "Expect '}' after block.")
         return statements
@@ -169,17 +367,19 @@ class Parser:
             initializer = self.expression()
 
         self.consume(TokenType.SEMICOLON, "Expect ';' after variable declaration.")
-        return Var(name, initializer)
+        return self.nodes.Var(name, initializer)
 
     def while_statement(self):
+        keyword = self.previous()
         self.consume(TokenType.LEFT_PAREN, "Expect '(' after 'while'.")
         condition = self.expression()
         self.consume(TokenType.RIGHT_PAREN, "Expect ')' after condition.")
         body = self.statement()
 
-        return While(condition, body)
+        return self.nodes.While(keyword, condition, body)
 
     def for_statement(self):
+        keyword = self.previous()
         self.consume(TokenType.LEFT_PAREN, "Expect '(' after 'for'.")
 
         if self.match([TokenType.SEMICOLON]):
@@ -203,16 +403,7 @@ class Parser:
 
         body = self.statement()
 
-        if increment is not None:
-            body = Block([body, Expression(increment)])
-
-        if condition is not None:
-            body = While(condition, body)
-
-        if initializer is not None:
-            body = Block([initializer, body])
-
-        return body
+        return self.nodes.For(keyword, initializer, condition, increment, body)
 
     def equality(self):
         expr = self.comparison()
@@ -220,7 +411,7 @@ class Parser:
         while self.match([TokenType.BANG_EQUAL, TokenType.EQUAL_EQUAL]):
             operator = self.previous()
             right = self.comparison()
-            expr = Binary(expr, operator, right)
+            expr = self.nodes.Binary(expr, operator, right)
 
         return expr
 
@@ -235,7 +426,7 @@ class Parser:
             ]):
             operator = self.previous()
             right = self.term()
-            expr = Binary(expr, operator, right)
+            expr = self.nodes.Binary(expr, operator, right)
 
         return expr
 
@@ -245,7 +436,7 @@ class Parser:
         while self.match([TokenType.MINUS, TokenType.PLUS]):
             operator = self.previous()
             right = self.factor()
-            expr = Binary(expr, operator, right)
+            expr = self.nodes.Binary(expr, operator, right)
         return expr
 
     def factor(self):
@@ -254,7 +445,7 @@ class Parser:
         while self.match([TokenType.SLASH, TokenType.STAR]):
             operator = self.previous()
             right = self.unary()
-            expr = Binary(expr, operator, right)
+            expr = self.nodes.Binary(expr, operator, right)
 
         return expr
 
@@ -262,7 +453,7 @@ class Parser:
         if self.match([TokenType.BANG, TokenType.MINUS]):
             operator = self.previous()
             right = self.unary()
-            return Unary(operator, right)
+            return self.nodes.Unary(operator, right)
 
         return self.call()
 
@@ -274,7 +465,7 @@ class Parser:
                 expr = self.finish_call(expr)
             elif self.match([TokenType.DOT]):
                 name = self.consume(TokenType.IDENTIFIER, "Expect property name after '.'.")
-                expr = Get(expr, name)
+                expr = self.nodes.Get(expr, name)
             else:
                 break 
 
@@ -295,36 +486,38 @@ class Parser:
         
         paren = self.consume(TokenType.RIGHT_PAREN, "Expect ')' after arguments.")
 
-        return Call(callee, paren, arguments)
+        return self.nodes.Call(callee, paren, arguments)
 
 
     def primary(self):
         if self.match([TokenType.FALSE]):
-            return Literal(False)
+            return self.nodes.Literal(False)
         if self.match([TokenType.TRUE]):
-            return Literal(True)
+            return self.nodes.Literal(True)
         if self.match([TokenType.NIL]):
-            return Literal(None)
+            return self.nodes.Literal(None)
 
         if self.match([TokenType.NUMBER, TokenType.STRING]):
-            return Literal(self.previous().literal)
+            return self.nodes.Literal(self.previous().literal)
 
         if self.match([TokenType.SUPER]):
             keyword = self.previous()
             self.consume(TokenType.DOT, "Expect '.' after 'super'.")
             method = self.consume(TokenType.IDENTIFIER, "Expect superclass method name.")
-            return Super(keyword, method)
+            return self.nodes.Super(keyword, method)
 
         if self.match([TokenType.SELF]):
-            return Self.previous()
+            return self.nodes.Self(self.previous())
 
         if self.match([TokenType.IDENTIFIER]):
-            return Variable(self.previous())
+            return self.nodes.Variable(self.previous())
 
         if self.match([TokenType.LEFT_PAREN]):
             expr = self.expression()
             self.consume(TokenType.RIGHT_PAREN, "Expect ')' after expression.")
-            return Grouping(expr)
+            return self.nodes.Grouping(expr)
+
+        raise self.error(self.peek(), "Expect expression.")
 
     def match(self, types):
         for _type in types:
@@ -362,6 +555,12 @@ class Parser:
             statements.append(self.declaration())
         return statements
 
+    def declarations(self):
+        # Like parse(), but hands over each top-level declaration as soon as
+        # it is parsed.
+        while not self._isAtEnd():
+            yield self.declaration()
+
     def consume(self, _type, message):
         if self.check(_type):
             return self.advance()
@@ -374,17 +573,18 @@ class Parser:
 
     def advance(self):
         if not self._isAtEnd():
-            self._current += 1
-        return self.previous()
+            self._previous = self._next
+            self._next = next(self.tokens)
+        return self._previous
 
     def _isAtEnd(self):
-        return self.peek().tokentype == TokenType.EOF
+        return self._next.tokentype == TokenType.EOF
 
     def peek(self):
-        return self.tokens[self._current]
+        return self._next
 
     def previous(self):
-        return self.tokens[self._current - 1]
+        return self._previous
 
     def error(self, token, message):
         self.error_handler.error(token, message)
@@ -1,6 +1,10 @@
 
 
-class Return_(RuntimeError):
-    def __init__(self, value, message=None):
-        super().__init__(message)
+class Return_:
+    # Completion of an executed `return`. Statements evaluate to None, or to
+    # one of these, which every enclosing statement hands back up until
+    # LoxFunction unwraps it.
+    __slots__ = ("value",)
+
+    def __init__(self, value):
         self.value = value
@@ -2,9 +2,11 @@ from abc import ABC, abstractmethod
 from token import *
 
 class Stmt:
-    pass
+    __slots__ = ()
 
 class Block(Stmt):
+    __slots__ = ("statements",)
+
     def __init__(self, statements):
         self.statements = statements
 
@@ -12,6 +14,8 @@ class Block(Stmt):
         return visitor.visit_block_stmt(self)
 
 class Expression(Stmt):
+    __slots__ = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -19,6 +23,8 @@ class Expression(Stmt):
         return visitor.visit_expression_stmt(self)
 
 class Print(Stmt):
+    __slots__ = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -26,15 +32,21 @@ class Print(Stmt):
         return visitor.visit_print_stmt(self)
 
 class Var(Stmt):
+    __slots__ = ("name", "initializer", "storage")
+
     def __init__(self, name, initializer):
         self.name = name
         self.initializer = initializer
+        self.storage = None
 
     def accept(self, visitor):
         return visitor.visit_var_stmt(self)
 
 class If(Stmt):
-    def __init__(self, condition, then_branch, else_branch):
+    __slots__ = ("keyword", "condition", "then_branch", "else_branch")
+
+    def __init__(self, keyword, condition, then_branch, else_branch):
+        self.keyword = keyword
         self.condition = condition
         self.then_branch = then_branch
         self.else_branch = else_branch
@@ -43,23 +55,46 @@ class If(Stmt):
         return visitor.visit_if_stmt(self)
 
 class While(Stmt):
-    def __init__(self, condition, body):
+    __slots__ = ("keyword", "condition", "body")
+
+    def __init__(self, keyword, condition, body):
+        self.keyword = keyword
         self.condition = condition
         self.body = body
 
     def accept(self, visitor):
         return visitor.visit_while_stmt(self)
 
+class For(Stmt):
+    __slots__ = ("keyword", "initializer", "condition", "increment", "body")
+
+    def __init__(self, keyword, initializer, condition, increment, body):
+        self.keyword = keyword
+        self.initializer = initializer
+        self.condition = condition
+        self.increment = increment
+        self.body = body
+
+    def accept(self, visitor):
+        return visitor.visit_for_stmt(self)
+
 class Function(Stmt):
+    __slots__ = ("name", "params", "body", "storage", "upvalues", "cells")
+
     def __init__(self, name, params, body):
         self.name = name
         self.params = params
         self.body = body
+        self.storage = None
+        self.upvalues = None
+        self.cells = None
 
     def accept(self, visitor):
         return visitor.visit_function_stmt(self)
 
 class Return(Stmt):
+    __slots__ = ("keyword", "value")
+
     def __init__(self, keyword, value):
         self.keyword = keyword
         self.value = value
@@ -68,10 +103,13 @@ class Return(Stmt):
         return visitor.visit_return_stmt(self)
 
 class Class(Stmt):
+    __slots__ = ("name", "superclass", "methods", "storage")
+
     def __init__(self, name, superclass, methods):
         self.name = name
         self.superclass = superclass
         self.methods = methods
+        self.storage = None
 
     def accept(self, visitor):
         return visitor.visit_class_stmt(self)
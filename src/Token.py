@@ -1,12 +1,37 @@
+import sys
+
 from tokentype import TokenType
 
 
 class Token:
-    def __init__(self, tokentype, lexeme, literal, line):
+    # A token does not keep its own copy of its text: it points into the
+    # string it was scanned from, which all tokens of a source share, and
+    # the lexeme is only sliced out of it the first time it is asked for.
+    # Most tokens (keywords, punctuation, numbers) never are. The token's
+    # length is kept rather than its end, as it nearly always fits in one
+    # of the small ints Python shares. Lexemes are interned, so every use of
+    # a name is the same string and compares and hashes as a key by identity.
+    __slots__ = ("tokentype", "source", "start", "length", "literal", "line", "_lexeme")
+
+    def __init__(self, tokentype, source, start, length, literal, line):
         self.tokentype = tokentype
-        self.lexeme = lexeme
+        self.source = source
+        self.start = start
+        self.length = length
         self.literal = literal
         self.line = line
+        self._lexeme = None
+
+    @property
+    def lexeme(self):
+        lexeme = self._lexeme
+        if lexeme is None:
+            lexeme = self._lexeme = sys.intern(self.source[self.start:self.start + self.length])
+        return lexeme
+
+    @property
+    def end(self):
+        return self.start + self.length
 
     def to_string(self):
         return (
@@ -41,8 +41,8 @@ class AstPrinter(Visitor):
 
 if __name__ == "__main__":
     expression = Binary(
-        Unary(Token(TokenType.MINUS, "-", None, 1), Literal(123)),
-        Token(TokenType.STAR, "*", None, 1),
+        Unary(Token(TokenType.MINUS, "-", 0, 1, None, 1), Literal(123)),
+        Token(TokenType.STAR, "*", 0, 1, None, 1),
         Grouping(Literal(45.67)),
     )
     printer = AstPrinter()
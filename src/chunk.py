@@ -0,0 +1,55 @@
+from enum import IntEnum
+
+OpCode = IntEnum(
+    "OpCode",
+    "CONSTANT, NIL, TRUE, FALSE, POP, POPN, \
+        GET_LOCAL, SET_LOCAL, GET_GLOBAL, DEFINE_GLOBAL, SET_GLOBAL, \
+        GET_UPVALUE, SET_UPVALUE, GET_PROPERTY, SET_PROPERTY, GET_SUPER, \
+        EQUAL, NOT_EQUAL, GREATER, GREATER_EQUAL, LESS, LESS_EQUAL, \
+        ADD, SUBTRACT, MULTIPLY, DIVIDE, NOT, NEGATE, PRINT, \
+        JUMP, POP_JUMP_IF_FALSE, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP, \
+        CALL, TAIL_CALL, INVOKE, TAIL_INVOKE, SUPER_INVOKE, CLOSURE, CLOSE_UPVALUE, RETURN, \
+        CLASS, INHERIT, METHOD, CHECK_CALLABLE, CHECK_INVOKE, CHECK_INSTANCE",
+)
+
+
+class Chunk:
+    def __init__(self):
+        self.code = []
+        self.lines = []
+        self.constants = []
+        self._constant_index = {}
+
+    def write(self, byte, line):
+        self.code.append(int(byte))
+        self.lines.append(line)
+
+    def add_constant(self, value):
+        # Names and numbers repeat a lot, share one pool entry per value.
+        # Functions are unhashable by value and always get a fresh slot.
+        key = None
+        if isinstance(value, str):
+            key = (str, value)
+        elif isinstance(value, float):
+            key = (float, repr(value))
+        if key is not None and key in self._constant_index:
+            return self._constant_index[key]
+
+        self.constants.append(value)
+        index = len(self.constants) - 1
+        if key is not None:
+            self._constant_index[key] = index
+        return index
+
+
+class FunctionProto:
+    def __init__(self, name, arity):
+        self.name = name
+        self.arity = arity
+        self.upvalue_count = 0
+        self.chunk = Chunk()
+
+    def __str__(self):
+        if self.name is None:
+            return "<script>"
+        return f"<Function '{self.name}'>"
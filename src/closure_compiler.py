@@ -0,0 +1,802 @@
+from visitor import *
+from Expr import *
+from Stmt import *
+from tokentype import TokenType
+from runtime_error import RuntimeError_
+from Environment import (
+    Environment, GlobalEnvironment, Cell, _undefined, acquire_environment, release_environment
+)
+from resolver import LOCAL, LOCAL_CELL, FREE
+from interpreter import Clock
+from lox_callable import LoxCallable
+from lox_function import LoxFunction
+from lox_class import LoxClass
+from lox_instance import LoxInstance
+from shape import InlineCache
+
+
+class CompiledFunction(LoxFunction):
+    __slots__ = ("body",)
+
+    def __init__(self, declaration, upvalues, is_initializer, body, receiver=None):
+        self.declaration = declaration
+        self.upvalues = upvalues
+        self.is_initializer = is_initializer
+        self.body = body
+        self.receiver = receiver
+
+    def call(self, interpreter, arguments):
+        frame = arguments
+        if self.receiver is not None:
+            frame = [self.receiver, *arguments]
+        for slot in self.declaration.cells:
+            frame[slot] = Cell(frame[slot])
+
+        environment = acquire_environment(frame, self.upvalues)
+        completion = self.body(environment)
+        release_environment(environment)
+
+        if self.is_initializer:
+            return frame[0]
+        if completion is not None:
+            return completion[0]
+        return None
+
+    def invoke(self, interpreter, instance, arguments):
+        frame = [instance, *arguments]
+        for slot in self.declaration.cells:
+            frame[slot] = Cell(frame[slot])
+
+        environment = acquire_environment(frame, self.upvalues)
+        completion = self.body(environment)
+        release_environment(environment)
+
+        if self.is_initializer:
+            return instance
+        if completion is not None:
+            return completion[0]
+        return None
+
+    def bind(self, instance):
+        return CompiledFunction(self.declaration, self.upvalues, self.is_initializer, self.body, instance)
+
+
+class ClosureCompiler(Visitor):
+    # Every node is turned into a Python closure taking the current
+    # Environment. Expression closures return the value; statement closures
+    # return None, or a 1-tuple holding the value of an executed `return`.
+
+    def __init__(self, error_handler):
+        self.error_handler = error_handler
+        self.globals = GlobalEnvironment()
+
+        self.globals.define("clock", Clock())
+
+    def interpret(self, statements):
+        program = self.compile_block(statements)
+
+        try:
+            program(Environment([], ()))
+        except RuntimeError_ as e:
+            self.error_handler.runtime_error(e)
+
+    def compile_stmt(self, stmt):
+        return stmt.accept(self)
+
+    def compile_expr(self, expr):
+        return expr.accept(self)
+
+    def compile_block(self, statements):
+        compiled = tuple(self.compile_stmt(statement) for statement in statements)
+
+        if len(compiled) == 1:
+            return compiled[0]
+
+        def block(env):
+            for statement in compiled:
+                completion = statement(env)
+                if completion is not None:
+                    return completion
+
+        return block
+
+    def stringify(self, value):
+        if value is None:
+            return "nil"
+        return str(value)
+
+    # ------------------------------------------------------------------
+    # Statements
+
+    def visit_expression_stmt(self, stmt):
+        expression = self.compile_expr(stmt.expression)
+
+        def expression_stmt(env):
+            expression(env)
+
+        return expression_stmt
+
+    def visit_print_stmt(self, stmt):
+        expression = self.compile_expr(stmt.expression)
+        stringify = self.stringify
+
+        def print_stmt(env):
+            print(stringify(expression(env)))
+
+        return print_stmt
+
+    def define(self, stmt, value):
+        # Globals are defined by name; locals go in the next frame slot.
+        if stmt.storage is None:
+            values = self.globals.values
+            slot = self.globals.slot(stmt.name.lexeme)
+
+            def define_global(env):
+                values[slot] = value(env)
+
+            return define_global
+
+        if stmt.storage == LOCAL:
+            def define_local(env):
+                env.values.append(value(env))
+
+            return define_local
+
+        def define_cell(env):
+            env.values.append(Cell(value(env)))
+
+        return define_cell
+
+    def capture(self, declaration):
+        sources = declaration.upvalues
+
+        def capture(env):
+            values = env.values
+            upvalues = env.upvalues
+            return tuple(values[index] if is_local else upvalues[index] for is_local, index in sources)
+
+        return capture
+
+    def visit_var_stmt(self, stmt):
+        if stmt.initializer is None:
+            def nil(env):
+                return None
+
+            return self.define(stmt, nil)
+
+        return self.define(stmt, self.compile_expr(stmt.initializer))
+
+    def visit_block_stmt(self, stmt):
+        # The block's locals go at the end of the frame and are dropped
+        # again when it is done.
+        body = self.compile_block(stmt.statements)
+
+        def block_stmt(env):
+            values = env.values
+            base = len(values)
+            completion = body(env)
+            del values[base:]
+            return completion
+
+        return block_stmt
+
+    def visit_if_stmt(self, stmt):
+        condition = self.compile_expr(stmt.condition)
+        then_branch = self.compile_stmt(stmt.then_branch)
+
+        if stmt.else_branch is None:
+            def if_stmt(env):
+                value = condition(env)
+                if value is not None and value is not False:
+                    return then_branch(env)
+
+            return if_stmt
+
+        else_branch = self.compile_stmt(stmt.else_branch)
+
+        def if_else_stmt(env):
+            value = condition(env)
+            if value is not None and value is not False:
+                return then_branch(env)
+            return else_branch(env)
+
+        return if_else_stmt
+
+    def visit_while_stmt(self, stmt):
+        condition = self.compile_expr(stmt.condition)
+        body = self.compile_stmt(stmt.body)
+
+        def while_stmt(env):
+            while True:
+                value = condition(env)
+                if value is None or value is False:
+                    return None
+                completion = body(env)
+                if completion is not None:
+                    return completion
+
+        return while_stmt
+
+    def visit_for_stmt(self, stmt):
+        initializer = None if stmt.initializer is None else self.compile_stmt(stmt.initializer)
+        increment = None if stmt.increment is None else self.compile_expr(stmt.increment)
+        body = self.compile_stmt(stmt.body)
+
+        if stmt.condition is None:
+            def condition(env):
+                return True
+        else:
+            condition = self.compile_expr(stmt.condition)
+
+        def loop(env):
+            if initializer is not None:
+                initializer(env)
+            while True:
+                value = condition(env)
+                if value is None or value is False:
+                    return None
+                completion = body(env)
+                if completion is not None:
+                    return completion
+                if increment is not None:
+                    increment(env)
+
+        def for_stmt(env):
+            values = env.values
+            base = len(values)
+            completion = loop(env)
+            del values[base:]
+            return completion
+
+        return for_stmt
+
+    def compile_function(self, declaration):
+        return self.compile_block(declaration.body)
+
+    def visit_function_stmt(self, stmt):
+        body = self.compile_function(stmt)
+        capture = self.capture(stmt)
+
+        if stmt.storage == LOCAL_CELL:
+            # The function captures its own Cell, which has to be in the
+            # frame before the closure is made.
+            def recursive_function_stmt(env):
+                cell = Cell(None)
+                env.values.append(cell)
+                cell.value = CompiledFunction(stmt, capture(env), False, body)
+
+            return recursive_function_stmt
+
+        def function(env):
+            return CompiledFunction(stmt, capture(env), False, body)
+
+        return self.define(stmt, function)
+
+    def visit_return_stmt(self, stmt):
+        if stmt.value is None:
+            def return_stmt(env):
+                return (None,)
+
+            return return_stmt
+
+        value = self.compile_expr(stmt.value)
+
+        def return_value_stmt(env):
+            return (value(env),)
+
+        return return_value_stmt
+
+    def visit_class_stmt(self, stmt):
+        name = stmt.name.lexeme
+        methods = [
+            (method, method.name.lexeme, self.compile_function(method), self.capture(method))
+            for method in stmt.methods
+        ]
+        storage = stmt.storage
+        if storage is None:
+            globals_ = self.globals.values
+            global_slot = self.globals.slot(name)
+        superclass_expr = None
+        if stmt.superclass is not None:
+            superclass_expr = self.compile_expr(stmt.superclass)
+        superclass_name = stmt.superclass.name if stmt.superclass is not None else None
+
+        def class_stmt(env):
+            superclass = None
+            if superclass_expr is not None:
+                superclass = superclass_expr(env)
+                if not isinstance(superclass, LoxClass):
+                    raise RuntimeError_(superclass_name, "Superclass must be a class.")
+
+            # The class's own slot comes first, then `super` for the
+            # methods to capture while they are made.
+            values = env.values
+            slot = len(values)
+            if storage == LOCAL_CELL:
+                values.append(Cell(None))
+            elif storage == LOCAL:
+                values.append(None)
+
+            if superclass is not None:
+                values.append(superclass)
+
+            functions = {}
+            for declaration, method_name, body, capture in methods:
+                functions[method_name] = CompiledFunction(
+                    declaration, capture(env), method_name == "init", body
+                )
+
+            klass = LoxClass(name, superclass, functions)
+
+            if superclass is not None:
+                values.pop()
+
+            if storage is None:
+                globals_[global_slot] = klass
+            elif storage == LOCAL:
+                values[slot] = klass
+            else:
+                values[slot].value = klass
+
+        return class_stmt
+
+    # ------------------------------------------------------------------
+    # Expressions
+
+    def visit_literal_expr(self, expr):
+        value = expr.value
+
+        def literal(env):
+            return value
+
+        return literal
+
+    def visit_grouping_expr(self, expr):
+        return self.compile_expr(expr.expression)
+
+    def visit_unary_expr(self, expr):
+        right = self.compile_expr(expr.right)
+        operator = expr.operator
+
+        if operator.tokentype == TokenType.BANG:
+            def not_(env):
+                value = right(env)
+                return value is None or value is False
+
+            return not_
+
+        def negate(env):
+            value = right(env)
+            if type(value) is float:
+                return -value
+            raise RuntimeError_(operator, "Operand must be a number.")
+
+        return negate
+
+    def visit_binary_expr(self, expr):
+        left = self.compile_expr(expr.left)
+        operator = expr.operator
+        _type = operator.tokentype
+
+        if _type == TokenType.EQUAL_EQUAL or _type == TokenType.BANG_EQUAL:
+            right = self.compile_expr(expr.right)
+            if _type == TokenType.EQUAL_EQUAL:
+                def equal(env):
+                    return left(env) == right(env)
+
+                return equal
+
+            def not_equal(env):
+                return not (left(env) == right(env))
+
+            return not_equal
+
+        if _type == TokenType.PLUS:
+            right = self.compile_expr(expr.right)
+
+            def add(env):
+                a = left(env)
+                b = right(env)
+                kind = type(a)
+                if kind is type(b) and (kind is float or kind is str):
+                    return a + b
+                raise RuntimeError_(operator, "Operands must be two numbers or two strings.")
+
+            return add
+
+        if isinstance(expr.right, Literal) and type(expr.right.value) is float:
+            return self.numeric_constant_operator(left, operator, expr.right.value)
+        return self.numeric_operator(left, operator, self.compile_expr(expr.right))
+
+    def numeric_operator(self, left, operator, right):
+        _type = operator.tokentype
+
+        if _type == TokenType.MINUS:
+            def subtract(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is float and type(b) is float:
+                    return a - b
+                raise RuntimeError_(operator, "Operand must be a number.")
+
+            return subtract
+
+        if _type == TokenType.STAR:
+            def multiply(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is float and type(b) is float:
+                    return a * b
+                raise RuntimeError_(operator, "Operand must be a number.")
+
+            return multiply
+
+        if _type == TokenType.SLASH:
+            def divide(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is float and type(b) is float:
+                    try:
+                        return a / b
+                    except ZeroDivisionError:
+                        raise RuntimeError_(operator, "Division by zero.")
+                raise RuntimeError_(operator, "Operand must be a number.")
+
+            return divide
+
+        if _type == TokenType.LESS:
+            def less(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is float and type(b) is float:
+                    return a < b
+                raise RuntimeError_(operator, "Operand must be a number.")
+
+            return less
+
+        if _type == TokenType.LESS_EQUAL:
+            def less_equal(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is float and type(b) is float:
+                    return a <= b
+                raise RuntimeError_(operator, "Operand must be a number.")
+
+            return less_equal
+
+        if _type == TokenType.GREATER:
+            def greater(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is float and type(b) is float:
+                    return a > b
+                raise RuntimeError_(operator, "Operand must be a number.")
+
+            return greater
+
+        def greater_equal(env):
+            a = left(env)
+            b = right(env)
+            if type(a) is float and type(b) is float:
+                return a >= b
+            raise RuntimeError_(operator, "Operand must be a number.")
+
+        return greater_equal
+
+    def numeric_constant_operator(self, left, operator, b):
+        # Same handlers as numeric_operator, with the right operand known to
+        # be a number at compile time.
+        _type = operator.tokentype
+
+        if _type == TokenType.MINUS:
+            def subtract_constant(env):
+                a = left(env)
+                if type(a) is float:
+                    return a - b
+                raise RuntimeError_(operator, "Operand must be a number.")
+
+            return subtract_constant
+
+        if _type == TokenType.STAR:
+            def multiply_constant(env):
+                a = left(env)
+                if type(a) is float:
+                    return a * b
+                raise RuntimeError_(operator, "Operand must be a number.")
+
+            return multiply_constant
+
+        if _type == TokenType.SLASH:
+            def divide_constant(env):
+                a = left(env)
+                if type(a) is float:
+                    try:
+                        return a / b
+                    except ZeroDivisionError:
+                        raise RuntimeError_(operator, "Division by zero.")
+                raise RuntimeError_(operator, "Operand must be a number.")
+
+            return divide_constant
+
+        if _type == TokenType.LESS:
+            def less_constant(env):
+                a = left(env)
+                if type(a) is float:
+                    return a < b
+                raise RuntimeError_(operator, "Operand must be a number.")
+
+            return less_constant
+
+        if _type == TokenType.LESS_EQUAL:
+            def less_equal_constant(env):
+                a = left(env)
+                if type(a) is float:
+                    return a <= b
+                raise RuntimeError_(operator, "Operand must be a number.")
+
+            return less_equal_constant
+
+        if _type == TokenType.GREATER:
+            def greater_constant(env):
+                a = left(env)
+                if type(a) is float:
+                    return a > b
+                raise RuntimeError_(operator, "Operand must be a number.")
+
+            return greater_constant
+
+        def greater_equal_constant(env):
+            a = left(env)
+            if type(a) is float:
+                return a >= b
+            raise RuntimeError_(operator, "Operand must be a number.")
+
+        return greater_equal_constant
+
+    def visit_logical_expr(self, expr):
+        left = self.compile_expr(expr.left)
+        right = self.compile_expr(expr.right)
+
+        if expr.operator.tokentype == TokenType.OR:
+            def or_(env):
+                value = left(env)
+                if value is not None and value is not False:
+                    return value
+                return right(env)
+
+            return or_
+
+        def and_(env):
+            value = left(env)
+            if value is None or value is False:
+                return value
+            return right(env)
+
+        return and_
+
+    def lookup(self, name, expr):
+        lexeme = name.lexeme
+        resolved = expr.resolved
+
+        if resolved is None:
+            values = self.globals.values
+            slot = self.globals.slot(lexeme)
+
+            def global_variable(env):
+                value = values[slot]
+                if value is _undefined:
+                    raise RuntimeError_(name, "Undefined variable '" + lexeme + "'.")
+                return value
+
+            return global_variable
+
+        return self.load(resolved)
+
+    def load(self, resolved):
+        kind, index = resolved
+
+        if kind == LOCAL:
+            def local_variable(env):
+                return env.values[index]
+
+            return local_variable
+
+        if kind == FREE:
+            def free_variable(env):
+                return env.upvalues[index]
+
+            return free_variable
+
+        if kind == LOCAL_CELL:
+            def local_cell(env):
+                return env.values[index].value
+
+            return local_cell
+
+        def free_cell(env):
+            return env.upvalues[index].value
+
+        return free_cell
+
+    def visit_variable_expr(self, expr):
+        return self.lookup(expr.name, expr)
+
+    def visit_assign_expr(self, expr):
+        value = self.compile_expr(expr.value)
+        name = expr.name
+        lexeme = name.lexeme
+        resolved = expr.resolved
+
+        if resolved is None:
+            values = self.globals.values
+            slot = self.globals.slot(lexeme)
+
+            def assign_global(env):
+                result = value(env)
+                if values[slot] is _undefined:
+                    raise RuntimeError_(name, "Undefined variable '" + lexeme + "'.")
+                values[slot] = result
+                return result
+
+            return assign_global
+
+        kind, index = resolved
+
+        if kind == LOCAL:
+            def assign_local(env):
+                result = value(env)
+                env.values[index] = result
+                return result
+
+            return assign_local
+
+        if kind == LOCAL_CELL:
+            def assign_local_cell(env):
+                result = value(env)
+                env.values[index].value = result
+                return result
+
+            return assign_local_cell
+
+        def assign_free_cell(env):
+            result = value(env)
+            env.upvalues[index].value = result
+            return result
+
+        return assign_free_cell
+
+    def visit_call_expr(self, expr):
+        arguments = tuple(self.compile_expr(argument) for argument in expr.arguments)
+        paren = expr.paren_loc
+        argc = len(arguments)
+        interpreter = self
+
+        def check(function):
+            if not isinstance(function, LoxCallable):
+                raise RuntimeError_(paren, "Can only call functions and classes.")
+
+        def arity_error(function):
+            return RuntimeError_(paren, f"Expected {function.arity()} arguments but got {argc}")
+
+        if isinstance(expr.callee, Get):
+            return self.compile_invoke(expr.callee, arguments, check, arity_error)
+
+        callee = self.compile_expr(expr.callee)
+
+        if argc == 0:
+            def call0(env):
+                function = callee(env)
+                check(function)
+                if function.arity() != 0:
+                    raise arity_error(function)
+                return function.call(interpreter, [])
+
+            return call0
+
+        if argc == 1:
+            argument = arguments[0]
+
+            def call1(env):
+                function = callee(env)
+                check(function)
+                values = [argument(env)]
+                if function.arity() != 1:
+                    raise arity_error(function)
+                return function.call(interpreter, values)
+
+            return call1
+
+        def call(env):
+            function = callee(env)
+            check(function)
+            values = [argument(env) for argument in arguments]
+            if function.arity() != argc:
+                raise arity_error(function)
+            return function.call(interpreter, values)
+
+        return call
+
+    def compile_invoke(self, get, arguments, check, arity_error):
+        # obj.method(args) calls the method with the receiver directly; a
+        # bound method is only made when the property is a field.
+        object_ = self.compile_expr(get.object)
+        name = get.name
+        cache = InlineCache()
+        argc = len(arguments)
+        interpreter = self
+
+        def invoke(env):
+            instance = object_(env)
+            if not isinstance(instance, LoxInstance):
+                raise RuntimeError_(name, "Only instances have properties.")
+
+            method = instance.find_method(name, cache)
+            if method is None:
+                function = instance.get(name, cache)
+                check(function)
+                values = [argument(env) for argument in arguments]
+                if function.arity() != argc:
+                    raise arity_error(function)
+                return function.call(interpreter, values)
+
+            values = [argument(env) for argument in arguments]
+            if method.arity() != argc:
+                raise arity_error(method)
+            return method.invoke(interpreter, instance, values)
+
+        return invoke
+
+    def visit_get_expr(self, expr):
+        object_ = self.compile_expr(expr.object)
+        name = expr.name
+        cache = InlineCache()
+
+        def get(env):
+            instance = object_(env)
+            if isinstance(instance, LoxInstance):
+                return instance.get(name, cache)
+            raise RuntimeError_(name, "Only instances have properties.")
+
+        return get
+
+    def visit_set_expr(self, expr):
+        object_ = self.compile_expr(expr.object)
+        value = self.compile_expr(expr.value)
+        name = expr.name
+        cache = InlineCache()
+
+        def set_(env):
+            instance = object_(env)
+            if not isinstance(instance, LoxInstance):
+                raise RuntimeError_(name, "Only instances have fields.")
+            result = value(env)
+            instance.set(name, result, cache)
+            return result
+
+        return set_
+
+    def visit_self_expr(self, expr):
+        return self.lookup(expr.keyword, expr)
+
+    def visit_super_expr(self, expr):
+        load_superclass = self.load(expr.resolved)
+        load_instance = self.load(expr.receiver)
+        method_name = expr.method
+
+        def super_(env):
+            superclass = load_superclass(env)
+            instance = load_instance(env)
+
+            cache = expr.cache
+            if cache is not None and cache[0] is superclass:
+                method = cache[1]
+            else:
+                method = superclass.find_method(method_name.lexeme)
+                expr.cache = (superclass, method)
+
+            if method is None:
+                raise RuntimeError_(method_name, f"Undefined property '{method_name.lexeme}' .")
+
+            return method.bind(instance)
+
+        return super_
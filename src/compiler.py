@@ -0,0 +1,464 @@
+from visitor import *
+from Expr import *
+from Stmt import *
+from tokentype import TokenType
+from chunk import OpCode, FunctionProto
+from resolver import FunctionType
+
+
+class Local:
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.is_captured = False
+
+
+class FunctionState:
+    def __init__(self, enclosing, function, type_):
+        self.enclosing = enclosing
+        self.function = function
+        self.type = type_
+        self.upvalues = []
+        self.scope_depth = 0
+
+        # Slot 0 holds the callee itself, or the receiver inside methods.
+        if type_ in (FunctionType.METHOD, FunctionType.INITIALIZER):
+            self.locals = [Local("self", 0)]
+        else:
+            self.locals = [Local("", 0)]
+
+
+class Compiler(Visitor):
+    def __init__(self, error_handler):
+        self.error_handler = error_handler
+        self.current = None
+        self.line = 0
+
+    def compile(self, statements):
+        self.current = FunctionState(None, FunctionProto(None, 0), FunctionType.NONE)
+
+        for statement in statements:
+            self.compile_stmt(statement)
+
+        self.emit(OpCode.NIL)
+        self.emit(OpCode.RETURN)
+
+        function = self.current.function
+        self.current = None
+        return function
+
+    def compile_stmt(self, stmt):
+        stmt.accept(self)
+
+    def compile_expr(self, expr):
+        expr.accept(self)
+
+    # ------------------------------------------------------------------
+    # Emission helpers
+
+    def chunk(self):
+        return self.current.function.chunk
+
+    def emit(self, *bytes_):
+        chunk = self.chunk()
+        for byte in bytes_:
+            chunk.write(byte, self.line)
+
+    def emit_constant(self, value):
+        self.emit(OpCode.CONSTANT, self.chunk().add_constant(value))
+
+    def name_constant(self, name):
+        return self.chunk().add_constant(name.lexeme)
+
+    def emit_jump(self, op):
+        self.emit(op, 0)
+        return len(self.chunk().code) - 1
+
+    def patch_jump(self, offset):
+        self.chunk().code[offset] = len(self.chunk().code)
+
+    def emit_return(self):
+        if self.current.type == FunctionType.INITIALIZER:
+            self.emit(OpCode.GET_LOCAL, 0)
+        else:
+            self.emit(OpCode.NIL)
+        self.emit(OpCode.RETURN)
+
+    # ------------------------------------------------------------------
+    # Scopes and variables
+
+    def begin_scope(self):
+        self.current.scope_depth += 1
+
+    def end_scope(self):
+        current = self.current
+        current.scope_depth -= 1
+
+        pending_pops = 0
+        while current.locals and current.locals[-1].depth > current.scope_depth:
+            if current.locals[-1].is_captured:
+                if pending_pops:
+                    self.emit(OpCode.POPN, pending_pops)
+                    pending_pops = 0
+                self.emit(OpCode.CLOSE_UPVALUE)
+            else:
+                pending_pops += 1
+            current.locals.pop()
+
+        if pending_pops == 1:
+            self.emit(OpCode.POP)
+        elif pending_pops:
+            self.emit(OpCode.POPN, pending_pops)
+
+    def add_local(self, name):
+        self.current.locals.append(Local(name.lexeme, self.current.scope_depth))
+
+    def resolve_local(self, state, name):
+        for i in range(len(state.locals) - 1, -1, -1):
+            if state.locals[i].name == name:
+                return i
+        return -1
+
+    def add_upvalue(self, state, index, is_local):
+        for i, upvalue in enumerate(state.upvalues):
+            if upvalue == (index, is_local):
+                return i
+
+        state.upvalues.append((index, is_local))
+        state.function.upvalue_count = len(state.upvalues)
+        return len(state.upvalues) - 1
+
+    def resolve_upvalue(self, state, name):
+        if state.enclosing is None:
+            return -1
+
+        local = self.resolve_local(state.enclosing, name)
+        if local != -1:
+            state.enclosing.locals[local].is_captured = True
+            return self.add_upvalue(state, local, True)
+
+        upvalue = self.resolve_upvalue(state.enclosing, name)
+        if upvalue != -1:
+            return self.add_upvalue(state, upvalue, False)
+
+        return -1
+
+    def variable_ops(self, name, expr=None):
+        # The resolver already knows which names are globals; only locals
+        # need the slot and upvalue search.
+        if expr is None or expr.resolved is not None:
+            slot = self.resolve_local(self.current, name)
+            if slot != -1:
+                return OpCode.GET_LOCAL, OpCode.SET_LOCAL, slot
+
+            upvalue = self.resolve_upvalue(self.current, name)
+            if upvalue != -1:
+                return OpCode.GET_UPVALUE, OpCode.SET_UPVALUE, upvalue
+
+        index = self.chunk().add_constant(name)
+        return OpCode.GET_GLOBAL, OpCode.SET_GLOBAL, index
+
+    def named_variable(self, name, expr=None):
+        get_op, _, operand = self.variable_ops(name, expr)
+        self.emit(get_op, operand)
+
+    def define_variable(self, name):
+        if self.current.scope_depth > 0:
+            self.add_local(name)
+            return
+        self.emit(OpCode.DEFINE_GLOBAL, self.name_constant(name))
+
+    # ------------------------------------------------------------------
+    # Statements
+
+    def visit_expression_stmt(self, stmt):
+        self.compile_expr(stmt.expression)
+        self.emit(OpCode.POP)
+
+    def visit_print_stmt(self, stmt):
+        self.compile_expr(stmt.expression)
+        self.emit(OpCode.PRINT)
+
+    def visit_var_stmt(self, stmt):
+        if stmt.initializer is not None:
+            self.compile_expr(stmt.initializer)
+        else:
+            self.emit(OpCode.NIL)
+
+        self.line = stmt.name.line
+        self.define_variable(stmt.name)
+
+    def visit_block_stmt(self, stmt):
+        self.begin_scope()
+        for statement in stmt.statements:
+            self.compile_stmt(statement)
+        self.end_scope()
+
+    def visit_if_stmt(self, stmt):
+        self.compile_expr(stmt.condition)
+        else_jump = self.emit_jump(OpCode.POP_JUMP_IF_FALSE)
+
+        self.compile_stmt(stmt.then_branch)
+
+        if stmt.else_branch is None:
+            self.patch_jump(else_jump)
+            return
+
+        end_jump = self.emit_jump(OpCode.JUMP)
+        self.patch_jump(else_jump)
+        self.compile_stmt(stmt.else_branch)
+        self.patch_jump(end_jump)
+
+    def visit_while_stmt(self, stmt):
+        loop_start = len(self.chunk().code)
+        self.compile_expr(stmt.condition)
+        exit_jump = self.emit_jump(OpCode.POP_JUMP_IF_FALSE)
+
+        self.compile_stmt(stmt.body)
+        self.emit(OpCode.JUMP, loop_start)
+
+        self.patch_jump(exit_jump)
+
+    def visit_for_stmt(self, stmt):
+        # Locals already live in stack slots here, so the loop only needs
+        # the scope for its initializer.
+        self.begin_scope()
+        if stmt.initializer is not None:
+            self.compile_stmt(stmt.initializer)
+
+        loop_start = len(self.chunk().code)
+        exit_jump = None
+        if stmt.condition is not None:
+            self.compile_expr(stmt.condition)
+            exit_jump = self.emit_jump(OpCode.POP_JUMP_IF_FALSE)
+
+        self.compile_stmt(stmt.body)
+        if stmt.increment is not None:
+            self.compile_expr(stmt.increment)
+            self.emit(OpCode.POP)
+        self.emit(OpCode.JUMP, loop_start)
+
+        if exit_jump is not None:
+            self.patch_jump(exit_jump)
+        self.end_scope()
+
+    def visit_function_stmt(self, stmt):
+        self.line = stmt.name.line
+        if self.current.scope_depth > 0:
+            # Declared before the body so the function can call itself.
+            self.add_local(stmt.name)
+            self.function(stmt, FunctionType.FUNCTION)
+        else:
+            self.function(stmt, FunctionType.FUNCTION)
+            self.emit(OpCode.DEFINE_GLOBAL, self.name_constant(stmt.name))
+
+    def function(self, stmt, type_):
+        function = FunctionProto(stmt.name.lexeme, len(stmt.params))
+        self.current = FunctionState(self.current, function, type_)
+        self.begin_scope()
+
+        for param in stmt.params:
+            self.add_local(param)
+
+        for statement in stmt.body:
+            self.compile_stmt(statement)
+        self.emit_return()
+
+        state = self.current
+        self.current = state.enclosing
+
+        self.line = stmt.name.line
+        self.emit(OpCode.CLOSURE, self.chunk().add_constant(function))
+        for index, is_local in state.upvalues:
+            self.emit(1 if is_local else 0, index)
+
+    def visit_return_stmt(self, stmt):
+        self.line = stmt.keyword.line
+        if stmt.value is None:
+            self.emit_return()
+            return
+
+        # `return f(...)` reuses the returning function's frame. The RETURN
+        # after it only runs when the callee was not a Lox function.
+        if isinstance(stmt.value, Call) and self.current.type != FunctionType.INITIALIZER:
+            self.call(stmt.value, True)
+        else:
+            self.compile_expr(stmt.value)
+        self.emit(OpCode.RETURN)
+
+    def visit_class_stmt(self, stmt):
+        self.line = stmt.name.line
+        name_constant = self.name_constant(stmt.name)
+        self.emit(OpCode.CLASS, name_constant)
+        self.define_variable(stmt.name)
+
+        if stmt.superclass is not None:
+            self.compile_expr(stmt.superclass)
+
+            self.begin_scope()
+            self.current.locals.append(Local("super", self.current.scope_depth))
+
+            self.named_variable(stmt.name.lexeme)
+            self.line = stmt.superclass.name.line
+            self.emit(OpCode.INHERIT)
+
+        self.named_variable(stmt.name.lexeme)
+        for method in stmt.methods:
+            type_ = FunctionType.METHOD
+            if method.name.lexeme == "init":
+                type_ = FunctionType.INITIALIZER
+
+            self.function(method, type_)
+            self.emit(OpCode.METHOD, self.name_constant(method.name))
+        self.emit(OpCode.POP)
+
+        if stmt.superclass is not None:
+            self.end_scope()
+
+    # ------------------------------------------------------------------
+    # Expressions
+
+    def visit_literal_expr(self, expr):
+        if expr.value is None:
+            self.emit(OpCode.NIL)
+        elif expr.value is True:
+            self.emit(OpCode.TRUE)
+        elif expr.value is False:
+            self.emit(OpCode.FALSE)
+        else:
+            self.emit_constant(expr.value)
+
+    def visit_grouping_expr(self, expr):
+        self.compile_expr(expr.expression)
+
+    def visit_unary_expr(self, expr):
+        self.compile_expr(expr.right)
+
+        self.line = expr.operator.line
+        if expr.operator.tokentype == TokenType.MINUS:
+            self.emit(OpCode.NEGATE)
+        else:
+            self.emit(OpCode.NOT)
+
+    binary_ops = {
+        TokenType.PLUS: OpCode.ADD,
+        TokenType.MINUS: OpCode.SUBTRACT,
+        TokenType.STAR: OpCode.MULTIPLY,
+        TokenType.SLASH: OpCode.DIVIDE,
+        TokenType.GREATER: OpCode.GREATER,
+        TokenType.GREATER_EQUAL: OpCode.GREATER_EQUAL,
+        TokenType.LESS: OpCode.LESS,
+        TokenType.LESS_EQUAL: OpCode.LESS_EQUAL,
+        TokenType.EQUAL_EQUAL: OpCode.EQUAL,
+        TokenType.BANG_EQUAL: OpCode.NOT_EQUAL,
+    }
+
+    def visit_binary_expr(self, expr):
+        self.compile_expr(expr.left)
+        self.compile_expr(expr.right)
+
+        self.line = expr.operator.line
+        self.emit(self.binary_ops[expr.operator.tokentype])
+
+    def visit_logical_expr(self, expr):
+        self.compile_expr(expr.left)
+
+        if expr.operator.tokentype == TokenType.OR:
+            end_jump = self.emit_jump(OpCode.JUMP_IF_TRUE_OR_POP)
+        else:
+            end_jump = self.emit_jump(OpCode.JUMP_IF_FALSE_OR_POP)
+
+        self.compile_expr(expr.right)
+        self.patch_jump(end_jump)
+
+    def visit_variable_expr(self, expr):
+        self.line = expr.name.line
+        self.named_variable(expr.name.lexeme, expr)
+
+    def visit_assign_expr(self, expr):
+        self.compile_expr(expr.value)
+
+        self.line = expr.name.line
+        _, set_op, operand = self.variable_ops(expr.name.lexeme, expr)
+        self.emit(set_op, operand)
+
+    def visit_call_expr(self, expr):
+        self.call(expr, False)
+
+    def is_plain(self, expr):
+        # Whether evaluating `expr` can neither fail nor be seen to happen.
+        if isinstance(expr, Literal):
+            return True
+        if isinstance(expr, (Variable, Self)):
+            return expr.resolved is not None
+        return False
+
+    def call(self, expr, tail):
+        # The callee is checked before any argument runs, like the
+        # tree-walker does. CALL and INVOKE make the same checks, so the
+        # separate one is left out when running the arguments first cannot
+        # be told apart.
+        callee = expr.callee
+        checked = not all(self.is_plain(argument) for argument in expr.arguments)
+
+        if isinstance(callee, Get):
+            self.compile_expr(callee.object)
+            if checked:
+                self.line = callee.name.line
+                self.emit(OpCode.CHECK_INVOKE, self.name_constant(callee.name))
+            for argument in expr.arguments:
+                self.compile_expr(argument)
+            self.line = expr.paren_loc.line
+            op = OpCode.TAIL_INVOKE if tail else OpCode.INVOKE
+            self.emit(op, self.name_constant(callee.name), len(expr.arguments))
+            return
+
+        if isinstance(callee, Super) and not checked:
+            self.line = callee.keyword.line
+            self.named_variable("self", callee)
+            for argument in expr.arguments:
+                self.compile_expr(argument)
+            self.line = callee.keyword.line
+            self.named_variable("super", callee)
+            self.line = expr.paren_loc.line
+            self.emit(OpCode.SUPER_INVOKE, self.name_constant(callee.method), len(expr.arguments))
+            return
+
+        # A checked super call looks its method up and binds it first.
+        self.compile_expr(callee)
+        if checked and not isinstance(callee, Super):
+            self.line = expr.paren_loc.line
+            self.emit(OpCode.CHECK_CALLABLE)
+        for argument in expr.arguments:
+            self.compile_expr(argument)
+
+        self.line = expr.paren_loc.line
+        self.emit(OpCode.TAIL_CALL if tail else OpCode.CALL, len(expr.arguments))
+
+    def visit_get_expr(self, expr):
+        self.compile_expr(expr.object)
+
+        self.line = expr.name.line
+        self.emit(OpCode.GET_PROPERTY, self.name_constant(expr.name))
+
+    def visit_set_expr(self, expr):
+        self.compile_expr(expr.object)
+        if not self.is_plain(expr.value):
+            self.line = expr.name.line
+            self.emit(OpCode.CHECK_INSTANCE)
+        self.compile_expr(expr.value)
+
+        self.line = expr.name.line
+        self.emit(OpCode.SET_PROPERTY, self.name_constant(expr.name))
+
+    def visit_self_expr(self, expr):
+        self.line = expr.keyword.line
+        self.named_variable("self", expr)
+
+    def visit_super_expr(self, expr):
+        self.line = expr.keyword.line
+        self.named_variable("self", expr)
+        self.named_variable("super", expr)
+
+        self.line = expr.method.line
+        self.emit(OpCode.GET_SUPER, self.name_constant(expr.method))
@@ -21,7 +21,6 @@ class ErrorHandler:
 
     def runtime_error(self, error):
         print(f"[Line {error.token.line}] --> {error.message}")
-        self.had_error = True
         self.had_runtime_error = True
 
     def report(self, line, where, message):
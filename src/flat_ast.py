@@ -0,0 +1,537 @@
+import zlib
+from array import array
+from sys import intern
+
+from Token import Token
+from tokentype import TokenType
+from Expr import *
+from Stmt import *
+
+# A syntax tree kept as a table instead of as objects: row `i` of the node
+# columns is one node, with its kind and up to three fields, and a resolution
+# slot. A field holds a child's row, a row of the token table, or the start
+# of a list in `items`, which holds its length followed by its elements. -1
+# is None everywhere.
+#
+# Nothing but the columns is kept. The Resolver and the bytecode Compiler
+# still walk the program as Expr and Stmt nodes: FlatNode subclasses that
+# read their fields out of the columns, and are thrown away after use.
+
+TOKEN_TYPES = tuple(TokenType)
+TOKEN_CODES = {tokentype: code for code, tokentype in enumerate(TOKEN_TYPES)}
+
+# Literal values, in the first field of a Literal; numbers and strings have
+# their index in `numbers` or the string table in the second.
+NIL = 0
+TRUE = 1
+FALSE = 2
+NUMBER = 3
+STRING = 4
+
+MAGIC = b"LOXF"
+
+# The serialized columns, in order, with their array type codes.
+COLUMNS = (
+    ("kinds", "B"),
+    ("a", "i"),
+    ("b", "i"),
+    ("c", "i"),
+    ("resolved", "i"),
+    ("token_types", "B"),
+    ("token_lines", "i"),
+    ("token_texts", "i"),
+    ("items", "i"),
+    ("statements", "i"),
+    ("numbers", "d"),
+    ("string_offsets", "i"),
+    ("string_data", "B"),
+)
+
+
+class FlatProgram:
+    # The columns are arrays while a program is built, and memoryviews of
+    # the same types into the cache file once it is loaded from one, so
+    # that processes running the same script share its pages.
+
+    def __init__(self):
+        for name, code in COLUMNS:
+            setattr(self, name, array(code))
+        self.strings = []
+        self.string_index = {}
+
+    def node(self, index):
+        if index < 0:
+            return None
+        return NODES[self.kinds[index]](self, index)
+
+    def nodes(self, start):
+        items = self.items
+        return [self.node(items[i]) for i in range(start + 1, start + 1 + items[start])]
+
+    def top_level(self):
+        # The top-level statements, one at a time, so that never all of
+        # them are nodes at once.
+        for index in self.statements:
+            yield self.node(index)
+
+    def token(self, index):
+        text = self.string(self.token_texts[index])
+        return Token(TOKEN_TYPES[self.token_types[index]], text, 0, len(text), None, self.token_lines[index])
+
+    def tokens(self, start):
+        items = self.items
+        return [self.token(items[i]) for i in range(start + 1, start + 1 + items[start])]
+
+    def string(self, index):
+        string = self.strings[index]
+        if string is None:
+            offsets = self.string_offsets
+            string = self.strings[index] = intern(bytes(
+                self.string_data[offsets[index]:offsets[index + 1]]
+            ).decode())
+        return string
+
+    def literal(self, index):
+        tag = self.a[index]
+        if tag == NUMBER:
+            return self.numbers[self.b[index]]
+        if tag == STRING:
+            return self.string(self.b[index])
+        return (None, True, False)[tag]
+
+    def to_bytes(self):
+        # One block: a CRC-32 of the rest, the length of every column, then
+        # the columns.
+        data = bytearray()
+        offsets = array("i", [0])
+        for string in self.strings:
+            data += string.encode()
+            offsets.append(len(data))
+        self.string_offsets = offsets
+        self.string_data = array("B", data)
+
+        columns = [getattr(self, name) for name, _ in COLUMNS]
+        lengths = array("q", [len(column) for column in columns])
+        data = lengths.tobytes() + b"".join(column.tobytes() for column in columns)
+        return MAGIC + array("q", [zlib.crc32(data)]).tobytes() + data
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        # A program reading straight out of `buffer`, a memoryview of bytes
+        # written by to_bytes(). Raises ValueError if it is not one. Rows
+        # point at each other unchecked, so a block that does not match its
+        # checksum is turned away before anything reads it.
+        position = len(MAGIC) + 8 + 8 * len(COLUMNS)
+        if len(buffer) < position or bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError("not a flat program")
+        position = len(MAGIC)
+        checksum = buffer[position:position + 8].cast("q")[0]
+        position += 8
+        if zlib.crc32(buffer[position:]) != checksum:
+            raise ValueError("corrupted flat program")
+        lengths = buffer[position:position + 8 * len(COLUMNS)].cast("q")
+        position += 8 * len(COLUMNS)
+
+        program = cls.__new__(cls)
+        for (name, code), length in zip(COLUMNS, lengths):
+            size = length * array(code).itemsize
+            if position + size > len(buffer):
+                raise ValueError("truncated flat program")
+            setattr(program, name, buffer[position:position + size].cast(code))
+            position += size
+
+        program.strings = [None] * (len(program.string_offsets) - 1)
+        program.string_index = None
+        return program
+
+
+class FlatBuilder:
+    # What the Parser builds with to make a FlatProgram: every method
+    # appends a row and hands back its node. The parser only looks into
+    # what it built for an assignment target, which is then left behind as
+    # an unused row.
+
+    def __init__(self):
+        self.program = FlatProgram()
+
+    def add_statement(self, statement):
+        self.program.statements.append(-1 if statement is None else statement.index)
+
+    def add(self, node, a=-1, b=-1, c=-1):
+        program = self.program
+        index = len(program.kinds)
+        program.kinds.append(node.kind)
+        program.a.append(a)
+        program.b.append(b)
+        program.c.append(c)
+        program.resolved.append(-1)
+        return node(program, index)
+
+    def string(self, string):
+        program = self.program
+        index = program.string_index.get(string)
+        if index is None:
+            index = program.string_index[string] = len(program.strings)
+            program.strings.append(string)
+        return index
+
+    def token(self, token):
+        program = self.program
+        program.token_types.append(TOKEN_CODES[token.tokentype])
+        program.token_lines.append(token.line)
+        program.token_texts.append(self.string(token.lexeme))
+        return len(program.token_lines) - 1
+
+    def list(self, indices):
+        items = self.program.items
+        start = len(items)
+        items.append(len(indices))
+        items.extend(indices)
+        return start
+
+    def nodes(self, nodes):
+        return self.list([-1 if node is None else node.index for node in nodes])
+
+    def tokens(self, tokens):
+        return self.list([self.token(token) for token in tokens])
+
+    # Expressions
+
+    def Assign(self, name, value):
+        return self.add(FlatAssign, self.token(name), value.index)
+
+    def Binary(self, left, operator, right):
+        return self.add(FlatBinary, left.index, self.token(operator), right.index)
+
+    def Grouping(self, expression):
+        return self.add(FlatGrouping, expression.index)
+
+    def Literal(self, value):
+        if value is None:
+            return self.add(FlatLiteral, NIL)
+        if value is True:
+            return self.add(FlatLiteral, TRUE)
+        if value is False:
+            return self.add(FlatLiteral, FALSE)
+        if isinstance(value, str):
+            return self.add(FlatLiteral, STRING, self.string(value))
+
+        numbers = self.program.numbers
+        numbers.append(value)
+        return self.add(FlatLiteral, NUMBER, len(numbers) - 1)
+
+    def Logical(self, left, operator, right):
+        return self.add(FlatLogical, left.index, self.token(operator), right.index)
+
+    def Unary(self, operator, right):
+        return self.add(FlatUnary, self.token(operator), right.index)
+
+    def Variable(self, name):
+        return self.add(FlatVariable, self.token(name))
+
+    def Call(self, callee, paren_loc, arguments):
+        return self.add(FlatCall, callee.index, self.token(paren_loc), self.nodes(arguments))
+
+    def Get(self, object, name):
+        return self.add(FlatGet, object.index, self.token(name))
+
+    def Set(self, object, name, value):
+        return self.add(FlatSet, object.index, self.token(name), value.index)
+
+    def Self(self, keyword):
+        return self.add(FlatSelf, self.token(keyword))
+
+    def Super(self, keyword, method):
+        return self.add(FlatSuper, self.token(keyword), self.token(method))
+
+    # Statements
+
+    def Block(self, statements):
+        return self.add(FlatBlock, self.nodes(statements))
+
+    def Expression(self, expression):
+        return self.add(FlatExpression, expression.index)
+
+    def Print(self, expression):
+        return self.add(FlatPrint, expression.index)
+
+    def Var(self, name, initializer):
+        return self.add(FlatVar, self.token(name), index_of(initializer))
+
+    def If(self, keyword, condition, then_branch, else_branch):
+        return self.add(FlatIf, condition.index, index_of(then_branch), index_of(else_branch))
+
+    def While(self, keyword, condition, body):
+        return self.add(FlatWhile, condition.index, index_of(body))
+
+    def For(self, keyword, initializer, condition, increment, body):
+        # Four fields: they go in a list.
+        return self.add(FlatFor, self.nodes([initializer, condition, increment, body]))
+
+    def Function(self, name, params, body):
+        return self.add(FlatFunction, self.token(name), self.tokens(params), self.nodes(body))
+
+    def Return(self, keyword, value):
+        return self.add(FlatReturn, self.token(keyword), index_of(value))
+
+    def Class(self, name, superclass, methods):
+        return self.add(FlatClass, self.token(name), index_of(superclass), self.nodes(methods))
+
+
+def index_of(node):
+    return -1 if node is None else node.index
+
+
+# Fields of the node classes, read from and written to the columns.
+
+def node_field(column):
+    def get(self):
+        program = self.program
+        return program.node(getattr(program, column)[self.index])
+    return property(get)
+
+
+def token_field(column):
+    def get(self):
+        program = self.program
+        return program.token(getattr(program, column)[self.index])
+    return property(get)
+
+
+def nodes_field(column):
+    def get(self):
+        program = self.program
+        return program.nodes(getattr(program, column)[self.index])
+    return property(get)
+
+
+def list_field(position):
+    # One of the fields of a For.
+    def get(self):
+        program = self.program
+        return program.node(program.items[program.a[self.index] + 1 + position])
+    return property(get)
+
+
+def resolution_field(column):
+    # A (kind, index) pair from the Resolver, as index * 4 + kind.
+    def get(self):
+        value = getattr(self.program, column)[self.index]
+        if value < 0:
+            return None
+        return value & 3, value >> 2
+
+    def set(self, resolved):
+        kind, index = resolved
+        getattr(self.program, column)[self.index] = index << 2 | kind
+
+    return property(get, set)
+
+
+def storage_field():
+    def get(self):
+        value = self.program.resolved[self.index]
+        return None if value < 0 else value
+
+    def set(self, storage):
+        self.program.resolved[self.index] = storage
+
+    return property(get, set)
+
+
+def dropped_field():
+    # Something only the tree-walking backends or the optimizer use; the
+    # bytecode Compiler works it out again or does without, so it is not
+    # kept.
+    return property(lambda self: None, lambda self, value: None)
+
+
+class FlatNode:
+    __slots__ = ()
+
+    def __init__(self, program, index):
+        self.program = program
+        self.index = index
+
+
+class FlatAssign(FlatNode, Assign):
+    __slots__ = ("program", "index")
+    name = token_field("a")
+    value = node_field("b")
+    resolved = resolution_field("resolved")
+
+
+class FlatBinary(FlatNode, Binary):
+    __slots__ = ("program", "index")
+    left = node_field("a")
+    operator = token_field("b")
+    right = node_field("c")
+
+
+class FlatGrouping(FlatNode, Grouping):
+    __slots__ = ("program", "index")
+    expression = node_field("a")
+
+
+class FlatLiteral(FlatNode, Literal):
+    __slots__ = ("program", "index")
+
+    @property
+    def value(self):
+        return self.program.literal(self.index)
+
+
+class FlatLogical(FlatNode, Logical):
+    __slots__ = ("program", "index")
+    left = node_field("a")
+    operator = token_field("b")
+    right = node_field("c")
+
+
+class FlatUnary(FlatNode, Unary):
+    __slots__ = ("program", "index")
+    operator = token_field("a")
+    right = node_field("b")
+
+
+class FlatVariable(FlatNode, Variable):
+    __slots__ = ("program", "index")
+    name = token_field("a")
+    resolved = resolution_field("resolved")
+
+
+class FlatCall(FlatNode, Call):
+    __slots__ = ("program", "index")
+    callee = node_field("a")
+    paren_loc = token_field("b")
+    arguments = nodes_field("c")
+
+
+class FlatGet(FlatNode, Get):
+    __slots__ = ("program", "index")
+    object = node_field("a")
+    name = token_field("b")
+
+
+class FlatSet(FlatNode, Set):
+    __slots__ = ("program", "index")
+    object = node_field("a")
+    name = token_field("b")
+    value = node_field("c")
+
+
+class FlatSelf(FlatNode, Self):
+    __slots__ = ("program", "index")
+    keyword = token_field("a")
+    resolved = resolution_field("resolved")
+
+
+class FlatSuper(FlatNode, Super):
+    __slots__ = ("program", "index")
+    keyword = token_field("a")
+    method = token_field("b")
+    receiver = resolution_field("c")
+    resolved = resolution_field("resolved")
+
+
+class FlatBlock(FlatNode, Block):
+    __slots__ = ("program", "index")
+    statements = nodes_field("a")
+
+
+class FlatExpression(FlatNode, Expression):
+    __slots__ = ("program", "index")
+    expression = node_field("a")
+
+
+class FlatPrint(FlatNode, Print):
+    __slots__ = ("program", "index")
+    expression = node_field("a")
+
+
+class FlatVar(FlatNode, Var):
+    __slots__ = ("program", "index")
+    name = token_field("a")
+    initializer = node_field("b")
+    storage = storage_field()
+
+
+class FlatIf(FlatNode, If):
+    __slots__ = ("program", "index")
+    keyword = dropped_field()
+    condition = node_field("a")
+    then_branch = node_field("b")
+    else_branch = node_field("c")
+
+
+class FlatWhile(FlatNode, While):
+    __slots__ = ("program", "index")
+    keyword = dropped_field()
+    condition = node_field("a")
+    body = node_field("b")
+
+
+class FlatFor(FlatNode, For):
+    __slots__ = ("program", "index")
+    keyword = dropped_field()
+    initializer = list_field(0)
+    condition = list_field(1)
+    increment = list_field(2)
+    body = list_field(3)
+
+
+class FlatFunction(FlatNode, Function):
+    __slots__ = ("program", "index")
+    name = token_field("a")
+    body = nodes_field("c")
+    storage = storage_field()
+    upvalues = dropped_field()
+    cells = dropped_field()
+
+    @property
+    def params(self):
+        return self.program.tokens(self.program.b[self.index])
+
+
+class FlatReturn(FlatNode, Return):
+    __slots__ = ("program", "index")
+    keyword = token_field("a")
+    value = node_field("b")
+
+
+class FlatClass(FlatNode, Class):
+    __slots__ = ("program", "index")
+    name = token_field("a")
+    superclass = node_field("b")
+    methods = nodes_field("c")
+    storage = storage_field()
+
+
+# The kind of a node is its place here.
+NODES = (
+    FlatAssign,
+    FlatBinary,
+    FlatGrouping,
+    FlatLiteral,
+    FlatLogical,
+    FlatUnary,
+    FlatVariable,
+    FlatCall,
+    FlatGet,
+    FlatSet,
+    FlatSelf,
+    FlatSuper,
+    FlatBlock,
+    FlatExpression,
+    FlatPrint,
+    FlatVar,
+    FlatIf,
+    FlatWhile,
+    FlatFor,
+    FlatFunction,
+    FlatReturn,
+    FlatClass,
+)
+
+for kind, node in enumerate(NODES):
+    node.kind = kind
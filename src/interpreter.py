@@ -5,38 +5,46 @@ from runtime_error import RuntimeError_
 from error_handler import ErrorHandler
 from Expr import *
 from Stmt import *
-from Environment import Environment
+from Environment import Environment, GlobalEnvironment, Cell
+from resolver import LOCAL, LOCAL_CELL, FREE
 from lox_callable import *
 from lox_function import *
 from Return import *
 from lox_class import *
 from lox_instance import *
+from shape import InlineCache
+from lazy_body import CompileError
 
 from time import time
 
 
-class Interpreter(Visitor):
-    def __init__(self, error_handler):
-        self.error_handler = error_handler
-        self.globals = Environment()
-        self.environment = self.globals
-        self.locals = {}
+class Clock(LoxCallable):
+    def __init__(self):
+        super().__init__()
+        self.start_time = time()
 
-        class clock(LoxCallable):
-            def __init__(self):
-                super().__init__()
-                self.start_time = time()
+    def arity(self):
+        return 0
 
-            def arity(self):
-                return 0
+    def call(self, Interpreter, arguments):
+        return time() - self.start_time
 
-            def call(self, Interpreter, arguments):
-                return time() - self.start_time
+    def __str__(self):
+        return f"<Native Function 'clock'>"
 
-            def __str__(self):
-                return f"<Native Function 'clock'>"
 
-        self.globals.define("clock", clock())
+class Interpreter(Visitor):
+    def __init__(self, error_handler):
+        self.error_handler = error_handler
+        self.globals = GlobalEnvironment()
+        self.environment = Environment([], ())
+        self.tiering = None
+        self.current_profile = None
+        # Parses, resolves and optimizes a pre-parsed function body; set
+        # when the parser pre-parses them.
+        self.compile_lazy = None
+
+        self.globals.define("clock", Clock())
 
 
     def visit_literal_expr(self, expr):
@@ -49,7 +57,7 @@ class Interpreter(Visitor):
         return expr.accept(self)
 
     def execute(self, stmt):
-        stmt.accept(self)
+        return stmt.accept(self)
 
     def execute_block(self, statements, environment):
         previous = self.environment
@@ -57,18 +65,20 @@ class Interpreter(Visitor):
             self.environment = environment
 
             for statement in statements:
-                self.execute(statement)
+                completion = statement.accept(self)
+                if completion is not None:
+                    return completion
         finally:
             self.environment = previous
 
     def visit_unary_expr(self, expr):
         right = self.evaluate(expr.right)
 
-        if expr.operator == TokenType.MINUS:
-            self.check_number_operand(expr.operator, right)
+        if expr.operator.tokentype == TokenType.MINUS:
+            self.check_number_operand(expr.operator, right, 0.0)
             return -float(right)
 
-        if expr.operator == TokenType.BANG:
+        if expr.operator.tokentype == TokenType.BANG:
             return not self.is_truthy(right)
 
         return None
@@ -77,11 +87,14 @@ class Interpreter(Visitor):
         return self.lookup_variable(expr.name, expr)
 
     def lookup_variable(self, name, expr):
-        distance = self.locals.get(expr)
-        if distance is not None:
-            return self.environment.get_at(distance, name.lexeme)
+        resolved = expr.resolved
+        if resolved is not None:
+            return self.load(resolved)
         else:
-            return self.globals.get(name)
+            slot = expr.global_slot
+            if slot is None:
+                slot = expr.global_slot = self.globals.slot(name.lexeme)
+            return self.globals.get_slot(slot, name)
 
     def visit_binary_expr(self, expr):
         left = self.evaluate(expr.left)
@@ -94,7 +107,10 @@ class Interpreter(Visitor):
 
         elif _type == TokenType.SLASH:
             self.check_number_operand(expr.operator, left, right)
-            return float(left) / float(right)
+            try:
+                return float(left) / float(right)
+            except ZeroDivisionError:
+                raise RuntimeError_(expr.operator, "Division by zero.")
 
         elif _type == TokenType.STAR:
             self.check_number_operand(expr.operator, left, right)
@@ -142,17 +158,50 @@ class Interpreter(Visitor):
         print(self.stringify(value))
         return None
 
+    def load(self, resolved):
+        kind, index = resolved
+        if kind == LOCAL:
+            return self.environment.values[index]
+        if kind == FREE:
+            return self.environment.upvalues[index]
+        if kind == LOCAL_CELL:
+            return self.environment.values[index].value
+        return self.environment.upvalues[index].value
+
+    def declare(self, stmt, value):
+        # Globals are defined by name; locals go in the next frame slot.
+        if stmt.storage is None:
+            self.globals.define(stmt.name.lexeme, value)
+        elif stmt.storage == LOCAL:
+            self.environment.values.append(value)
+        else:
+            self.environment.values.append(Cell(value))
+
+    def capture(self, declaration):
+        environment = self.environment
+        return tuple(
+            environment.values[index] if is_local else environment.upvalues[index]
+            for is_local, index in declaration.upvalues
+        )
+
     def visit_var_stmt(self, stmt):
         value = None
         if stmt.initializer != None:
             value = self.evaluate(stmt.initializer)
 
-        self.environment.define(stmt.name.lexeme, value)
+        self.declare(stmt, value)
         return None
 
     def visit_function_stmt(self, stmt):
-        function = LoxFunction(stmt, self.environment, False)
-        self.environment.define(stmt.name.lexeme, function)
+        # A function that refers to itself captures its own Cell, so the
+        # Cell has to be in the frame before the closure is made.
+        if stmt.storage == LOCAL_CELL:
+            cell = Cell(None)
+            self.environment.values.append(cell)
+            cell.value = LoxFunction(stmt, self.capture(stmt), False)
+            return None
+
+        self.declare(stmt, LoxFunction(stmt, self.capture(stmt), False))
         return None
 
     def visit_return_stmt(self, stmt):
@@ -160,7 +209,7 @@ class Interpreter(Visitor):
         if stmt.value is not None:
             value = self.evaluate(stmt.value)
 
-        raise Return_(value)
+        return Return_(value)
 
     def visit_class_stmt(self, stmt):
         superclass = None
@@ -169,32 +218,53 @@ class Interpreter(Visitor):
             if not isinstance(superclass, LoxClass):
                 raise RuntimeError_(stmt.superclass.name, "Superclass must be a class.")
 
-        self.environment.define(stmt.name.lexeme, None)
+        # The class's own slot comes first, then `super` for the methods to
+        # capture while they are made.
+        values = self.environment.values
+        if stmt.storage == LOCAL_CELL:
+            cell = Cell(None)
+            values.append(cell)
+        elif stmt.storage == LOCAL:
+            slot = len(values)
+            values.append(None)
 
-        if stmt.superclass is not None:
-            environment = Environment(self.environment)
-            environment.define("super", superclass)
+        if superclass is not None:
+            values.append(superclass)
 
         methods = {}
         for method in stmt.methods:
-            function = LoxFunction(method, self.environment, method.name.lexeme=="init")
+            function = LoxFunction(method, self.capture(method), method.name.lexeme=="init")
             methods[method.name.lexeme] = function
 
         klass = LoxClass(stmt.name.lexeme, superclass, methods)
         
         if superclass is not None:
-            environment.assign(stmt.name, klass)
+            values.pop()
 
-        self.environment.assign(stmt.name, klass)
+        if stmt.storage is None:
+            self.globals.define(stmt.name.lexeme, klass)
+        elif stmt.storage == LOCAL:
+            values[slot] = klass
+        else:
+            cell.value = klass
 
     def visit_assign_expr(self, expr):
         value = self.evaluate(expr.value)
-        distance = self.locals.get(expr)
-
-        if distance is not None:
-            self.environment.assign_at(distance, expr.name, value)
+        resolved = expr.resolved
+
+        if resolved is not None:
+            kind, index = resolved
+            if kind == LOCAL:
+                self.environment.values[index] = value
+            elif kind == LOCAL_CELL:
+                self.environment.values[index].value = value
+            else:
+                self.environment.upvalues[index].value = value
         else:
-            self.globals.assign(expr.name, value)
+            slot = expr.global_slot
+            if slot is None:
+                slot = expr.global_slot = self.globals.slot(expr.name.lexeme)
+            self.globals.assign_slot(slot, expr.name, value)
         return value
 
     def visit_logical_expr(self, expr):
@@ -210,11 +280,57 @@ class Interpreter(Visitor):
         return self.evaluate(expr.right)
 
     def visit_call_expr(self, expr):
+        if isinstance(expr.callee, Get):
+            return self.invoke(expr)
+
+        # Inlines call(), and runs plain Lox functions without going through
+        # LoxFunction.call: every Python frame a Lox call takes is one level
+        # less of Lox recursion.
         callee = self.evaluate(expr.callee)
+        if not isinstance(callee, LoxCallable):
+            raise RuntimeError_(expr.paren_loc, "Can only call functions and classes.")
+
+        arguments = []
+        for argument in expr.arguments:
+            arguments.append(self.evaluate(argument))
+
+        if callee.arity() != len(arguments):
+            raise RuntimeError_(expr.paren_loc, f"Expected {callee.arity()} arguments but got {len(arguments)}")
+
+        if type(callee) is LoxFunction and callee.receiver is None:
+            return callee.run(self, arguments)
+        return callee.call(self, arguments)
+
+    def invoke(self, expr):
+        # obj.method(args): call the method with the receiver directly and
+        # only bind it when the property turns out to be a field.
+        get = expr.callee
+        object = self.evaluate(get.object)
+        if not isinstance(object, LoxInstance):
+            raise RuntimeError_(get.name, "Only instances have properties.")
+
+        cache = get.cache
+        if cache is None:
+            cache = get.cache = InlineCache()
+
+        method = object.find_method(get.name, cache)
+        if method is None:
+            return self.call(expr, object.get(get.name, cache))
+
+        arguments = []
+        for argument in expr.arguments:
+            arguments.append(self.evaluate(argument))
+
+        if method.arity() != len(arguments):
+            raise RuntimeError_(expr.paren_loc, f"Expected {method.arity()} arguments but got {len(arguments)}")
+
+        return method.run(self, [object, *arguments])
+
+    def call(self, expr, callee):
         arguments = []
 
         if not isinstance(callee, LoxCallable):
-            raise RuntimeError_(expr.paren, "Can only call functions and classes.")
+            raise RuntimeError_(expr.paren_loc, "Can only call functions and classes.")
 
         for argument in expr.arguments:
             arguments.append(self.evaluate(argument))
@@ -227,7 +343,10 @@ class Interpreter(Visitor):
     def visit_get_expr(self, expr):
         object = self.evaluate(expr.object)
         if isinstance(object, LoxInstance):
-            return object.get(expr.name)
+            cache = expr.cache
+            if cache is None:
+                cache = expr.cache = InlineCache()
+            return object.get(expr.name, cache)
 
         raise RuntimeError_(expr.name, "Only instances have properties.")
 
@@ -238,7 +357,10 @@ class Interpreter(Visitor):
             raise RuntimeError_(expr.name, "Only instances have fields.")
 
         value = self.evaluate(expr.value)
-        object.set(expr.name, value)
+        cache = expr.cache
+        if cache is None:
+            cache = expr.cache = InlineCache()
+        object.set(expr.name, value, cache)
 
         return value
 
@@ -246,10 +368,17 @@ class Interpreter(Visitor):
         return self.lookup_variable(expr.keyword, expr)
 
     def visit_super_expr(self, expr):
-        distance = self.locals[expr]
-        superclass = self.environment.get_at(distance, "super")
-        object = self.environment.get_at(distance - 1, "self")
-        method = superclass.find_method(expr.method.lexeme)
+        superclass = self.load(expr.resolved)
+        object = self.load(expr.receiver)
+
+        # A class declaration may run more than once, so the cache holds
+        # the superclass the method was looked up in.
+        cache = expr.cache
+        if cache is not None and cache[0] is superclass:
+            method = cache[1]
+        else:
+            method = superclass.find_method(expr.method.lexeme)
+            expr.cache = (superclass, method)
 
         if method is None:
             raise RuntimeError_(expr.method, f"Undefined property '{expr.method.lexeme}' .")
@@ -257,20 +386,58 @@ class Interpreter(Visitor):
         return method.bind(object)
 
     def visit_block_stmt(self, stmt):
-        self.execute_block(stmt.statements, Environment(self.environment))
+        # The block's locals go at the end of the frame and are dropped
+        # again when it is done, so the next block can reuse the slots.
+        values = self.environment.values
+        base = len(values)
+        for statement in stmt.statements:
+            completion = statement.accept(self)
+            if completion is not None:
+                return completion
+        del values[base:]
         return None
 
     def visit_if_stmt(self, stmt):
         if self.is_truthy(self.evaluate(stmt.condition)):
-            self.execute(stmt.then_branch)
+            return self.execute(stmt.then_branch)
         elif stmt.else_branch is not None:
-            self.execute(stmt.else_branch)
+            return self.execute(stmt.else_branch)
         else:
             return None
 
     def visit_while_stmt(self, stmt):
+        profile = self.current_profile
         while self.is_truthy(self.evaluate(stmt.condition)):
-            self.execute(stmt.body)
+            completion = self.execute(stmt.body)
+            if completion is not None:
+                return completion
+            if profile is not None:
+                profile.back_edges += 1
+        return None
+
+    def visit_for_stmt(self, stmt):
+        values = self.environment.values
+        base = len(values)
+        completion = self.execute_for(stmt)
+        del values[base:]
+        return completion
+
+    def execute_for(self, stmt):
+        if stmt.initializer is not None:
+            self.execute(stmt.initializer)
+
+        body = stmt.body
+        condition = stmt.condition
+        increment = stmt.increment
+        profile = self.current_profile
+        while condition is None or self.is_truthy(self.evaluate(condition)):
+            completion = body.accept(self)
+            if completion is not None:
+                return completion
+            if increment is not None:
+                self.evaluate(increment)
+            if profile is not None:
+                profile.back_edges += 1
         return None
 
     def is_truthy(self, object):
@@ -286,14 +453,16 @@ class Interpreter(Visitor):
         raise RuntimeError_(operator, "Operand must be a number.")
 
     def interpret(self, statements):
+        # Locals of top-level blocks live in a frame of their own, which a
+        # runtime error may have left half full.
+        self.environment = Environment([], ())
         try:
             for statement in statements:
                 self.execute(statement)
         except RuntimeError_ as e:
             self.error_handler.runtime_error(e)
-
-    def resolve(self, expr, depth):
-        self.locals[expr] = depth
+        except CompileError:
+            pass
 
     def stringify(self, object):
         if object is None:
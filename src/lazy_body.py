@@ -0,0 +1,20 @@
+class LazyBody:
+    # The body of a function that has only been pre-parsed: where it is in
+    # the source, from just after the opening brace, on `line`, to just
+    # after the closing one. Only functions and methods declared at the top
+    # level are pre-parsed, so nothing in the body can refer to a local
+    # outside it, and it can be scanned, parsed and resolved on its own
+    # when the function is first called.
+
+    def __init__(self, source, start, end, line, kind):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.line = line
+        self.kind = kind
+
+
+class CompileError(Exception):
+    # A lazily parsed body turned out to have static errors, which have
+    # been reported; the program stops there.
+    pass
@@ -1,4 +1,4 @@
-import sys, os
+import sys, os, gc
 from scanner import Scanner
 from Token import *
 from tokentype import TokenType
@@ -8,18 +8,75 @@ from runtime_error import RuntimeError_
 from interpreter import Interpreter
 from error_handler import ErrorHandler
 from resolver import *
+from compiler import Compiler
+from vm import VM, FRAMES_MAX
+from closure_compiler import ClosureCompiler
+from lox_to_python import LoxToPython
+from tiering import Tiering, DEFAULT_THRESHOLD
+from optimizer import Optimizer
+from program_cache import ProgramCache
+from lazy_body import CompileError
+from flat_ast import FlatBuilder
+
+BACKENDS = ("tree", "vm", "closure", "python")
+
+
+def read_chunks(file, size=1 << 16):
+    # Whole lines, about `size` characters at a time.
+    while True:
+        lines = file.readlines(size)
+        if not lines:
+            return
+        yield "".join(lines)
 
 
 class Lox:
-    def __init__(self):
+    def __init__(self, backend="tree", tier_threshold=None, tier_stats=False,
+                 optimize=True, optimizer_report=False, stack_size=FRAMES_MAX,
+                 stream=False, cache=True, lazy=False, flat=False):
         self.error_handler = ErrorHandler()
+        self.backend = backend
+        self.stream = stream
+        self.cache = cache
+        self.lazy = lazy
+        self.flat = flat
+        self.optimize = optimize
+        self.optimizer_report = optimizer_report
         self.interpreter = Interpreter(self.error_handler)
+        if lazy:
+            self.interpreter.compile_lazy = self.compile_lazy
+
+        if tier_threshold is not None:
+            hook = self.report_tier_event if tier_stats else None
+            self.interpreter.tiering = Tiering(self.interpreter, tier_threshold, hook)
+
+        if backend == "vm":
+            self.compiler = Compiler(self.error_handler)
+            self.vm = VM(self.error_handler, stack_size)
+        elif backend == "closure":
+            self.closure_compiler = ClosureCompiler(self.error_handler)
+        elif backend == "python":
+            self.transpiler = LoxToPython(self.error_handler)
+
+    def report_tier_event(self, event):
+        print(event, file=sys.stderr)
 
     def run_file(self, path):
         with open(path, "r") as f:
-            data = "".join(f.readlines())
+            if self.stream:
+                self.run_stream(read_chunks(f))
+            else:
+                data = "".join(f.readlines())
 
-            self.run(data)
+                if self.flat:
+                    cache = None
+                    if self.cache:
+                        cache = ProgramCache(path, data, self.optimize, self.lazy, True)
+                    self.run_flat(data, cache)
+                elif self.cache and not self.optimizer_report:
+                    self.run_cached(path, data)
+                else:
+                    self.run(data)
 
         if self.error_handler.had_error:
             sys.exit(65)
@@ -37,31 +94,232 @@ class Lox:
         except KeyboardInterrupt:
             print("\nKeyboardInterrupt")
 
-    def run(self, source):
+    def parse(self, source):
+        # The parser pulls tokens as it goes, so they are never all held at
+        # once. What it builds lives as long as the program, so the
+        # collector, which would go over it again and again as it grows, is
+        # kept out of the way until it is done.
         scanner = Scanner(source, self.error_handler)
-        tokens = scanner.scan_tokens()
+        parser = Parser(scanner.stream(), self.error_handler, self.lazy)
+        gc.disable()
+        try:
+            return parser.parse()
+        finally:
+            gc.enable()
+
+    def run(self, source):
+        if self.flat:
+            self.run_flat(source)
+            return
 
-        parser = Parser(tokens, self.error_handler)
-        statements = parser.parse()
+        statements = self.parse(source)
 
         if self.error_handler.had_error or self.error_handler.had_runtime_error:
             return
 
-        resolver = Resolver(self.interpreter)
+        self.execute(Resolver(self.error_handler), statements)
+
+    def run_cached(self, path, source):
+        # An unchanged script skips scanning, parsing, resolving and
+        # optimizing: the Resolver's results are cached on the nodes. The
+        # optimizer report needs the optimizer to run, so run_file() does
+        # not come here for it.
+        cache = ProgramCache(path, source, self.optimize, self.lazy)
+        statements = cache.load()
+
+        if statements is not None:
+            self.interpret(statements)
+            return
+
+        statements = self.parse(source)
+        if self.error_handler.had_error:
+            return
+
+        # Stored before it runs, while the nodes' inline caches are empty.
+        statements = self.prepare(Resolver(self.error_handler), statements)
+        if statements is None:
+            return
+        cache.store(statements)
+        self.interpret(statements)
+
+    def run_flat(self, source, cache=None):
+        # The program is parsed into a FlatProgram and compiled to bytecode
+        # from that, one top-level statement at a time, so the whole tree is
+        # never made of objects. The optimizer only works on trees, so it
+        # is skipped.
+        program = cache.load() if cache is not None else None
+        if program is None:
+            scanner = Scanner(source, self.error_handler)
+            builder = FlatBuilder()
+            parser = Parser(scanner.stream(), self.error_handler, nodes=builder)
+            for statement in parser.declarations():
+                builder.add_statement(statement)
+            if self.error_handler.had_error:
+                return
+
+            program = builder.program
+            resolver = Resolver(self.error_handler)
+            for statement in program.top_level():
+                resolver.resolve(statement)
+            if self.error_handler.had_error:
+                return
+
+            if cache is not None:
+                cache.store(program)
+
+        self.interpret(program.top_level())
+
+    def run_stream(self, chunks):
+        # Runs each top-level declaration as soon as it is parsed and lets
+        # go of it afterwards, so memory does not grow with the length of
+        # the script. Unlike run(), everything before the first static
+        # error has already run when it is found; after it the rest is only
+        # parsed, to report its errors too.
+        scanner = Scanner(chunks, self.error_handler)
+        parser = Parser(scanner.stream(), self.error_handler, self.lazy)
+        resolver = Resolver(self.error_handler)
+
+        for statement in parser.declarations():
+            if self.error_handler.had_error:
+                continue
+
+            self.execute(resolver, [statement])
+            if self.error_handler.had_runtime_error:
+                return
+
+    def execute(self, resolver, statements):
+        statements = self.prepare(resolver, statements)
+        if statements is not None:
+            self.interpret(statements)
+
+    def prepare(self, resolver, statements):
+        # Resolves and optimizes the statements, returning what is left to
+        # run, or None after a static error.
         resolver.resolve(statements)
+        if self.error_handler.had_error:
+            return None
 
+        # Optimizing after resolution keeps every static error, including
+        # those in code the optimizer would drop, and leaves the resolved
+        # slots alone: a statement it removes never declares a variable in
+        # a scope that keeps running.
+        if self.optimize:
+            statements = self.optimized(statements)
+        return statements
 
-        self.interpreter.interpret(statements)
+    def optimized(self, statements):
+        optimizer = Optimizer()
+        statements = optimizer.optimize(statements)
+        if self.optimizer_report:
+            for change in optimizer.changes:
+                print("[optimizer] " + change, file=sys.stderr)
+        return statements
 
-        # print(AstPrinter().print(statements))
+    def compile_lazy(self, declaration):
+        # The first call of a function whose body was only pre-parsed.
+        # Static errors found in it now stop the program; the body stays
+        # unparsed, so every later call reports them again.
+        lazy = declaration.body
+        scanner = Scanner(lazy.source, self.error_handler, lazy.start, lazy.end, lazy.line)
+        declaration.body = Parser(scanner.stream(), self.error_handler).lazy_body()
+
+        if not self.error_handler.had_error:
+            Resolver(self.error_handler).resolve_lazy(declaration, lazy.kind)
+        if self.error_handler.had_error:
+            declaration.body = lazy
+            raise CompileError()
+
+        if self.optimize:
+            self.optimized([declaration])
+
+    def interpret(self, statements):
+        if self.backend == "vm":
+            self.vm.interpret(self.compiler.compile(statements))
+        elif self.backend == "closure":
+            self.closure_compiler.interpret(statements)
+        elif self.backend == "python":
+            self.transpiler.interpret(statements)
+        else:
+            self.interpreter.interpret(statements)
+
+    # print(AstPrinter().print(statements))
+
+
+def usage():
+    print(
+        "Usage: pylox [--backend=" + "|".join(BACKENDS) + "]"
+        " [--tier-threshold=N] [--tier-stats]"
+        " [--no-optimize] [--optimizer-report] [--stack-size=N] [--stream]"
+        " [--no-cache] [--lazy] [--flat] [script]"
+    )
+    sys.exit(64)
 
 
 if __name__ == "__main__":
-    lox = Lox()
-    if len(sys.argv[1:]) > 1:
-        print("Usage: pylox [script]")
-        sys.exit(64)
-    elif len(sys.argv[1:]) == 1:
-        lox.run_file(sys.argv[1])
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+
+    backend = "tree"
+    tier_threshold = None
+    tier_stats = False
+    optimize = True
+    optimizer_report = False
+    stack_size = None
+    stream = False
+    cache = True
+    lazy = False
+    flat = False
+    for option in options:
+        if option.startswith("--backend="):
+            backend = option[len("--backend="):]
+        elif option.startswith("--tier-threshold="):
+            value = option[len("--tier-threshold="):]
+            if not value.isdigit():
+                usage()
+            tier_threshold = int(value)
+        elif option == "--tier-stats":
+            tier_stats = True
+        elif option == "--no-optimize":
+            optimize = False
+        elif option == "--optimizer-report":
+            optimizer_report = True
+        elif option.startswith("--stack-size="):
+            value = option[len("--stack-size="):]
+            if not value.isdigit() or int(value) == 0:
+                usage()
+            stack_size = int(value)
+        elif option == "--stream":
+            stream = True
+        elif option == "--no-cache":
+            cache = False
+        elif option == "--lazy":
+            lazy = True
+        elif option == "--flat":
+            flat = True
+        else:
+            usage()
+
+    if backend not in BACKENDS or len(args) > 1:
+        usage()
+    # Only the tree-walker tiers functions up.
+    if (tier_threshold is not None or tier_stats) and backend != "tree":
+        usage()
+    # Only the VM keeps its call stack off the Python stack.
+    if stack_size is not None and backend != "vm":
+        usage()
+    # The other backends compile every body before running anything.
+    if lazy and backend != "tree":
+        usage()
+    # Flat programs are only compiled to bytecode, as a whole and without
+    # the optimizer.
+    if flat and (backend != "vm" or lazy or stream or optimizer_report):
+        usage()
+    if tier_stats and tier_threshold is None:
+        tier_threshold = DEFAULT_THRESHOLD
+
+    lox = Lox(backend, tier_threshold, tier_stats, optimize, optimizer_report,
+              FRAMES_MAX if stack_size is None else stack_size, stream, cache, lazy, flat)
+    if len(args) == 1:
+        lox.run_file(args[0])
     else:
         lox.run_prompt()
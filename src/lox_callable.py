@@ -2,6 +2,8 @@ from interpreter import *
 from abc import ABC, abstractmethod 
 
 class LoxCallable:
+    __slots__ = ()
+
     @abstractmethod
     def call(self, interpreter, arguments):
         pass
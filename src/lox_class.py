@@ -2,32 +2,40 @@ from lox_callable import *
 from lox_instance import *
 
 class LoxClass(LoxCallable):
+    __slots__ = ("name", "superclass", "methods", "initializer")
+
     def __init__(self, name, superclass, methods):
         self.name = name 
-        self.methods = methods
         self.superclass = superclass
 
+        # Inherited methods are copied down once here, so lookups never walk
+        # the superclass chain.
+        self.methods = {}
+        if superclass is not None:
+            self.methods.update(superclass.methods)
+        self.methods.update(methods)
+        self.initializer = self.methods.get("init")
+
     def to_string(self):
         return self.name
+
+    def __str__(self):
+        return self.to_string()
     
     def call(self, interpreter, arguments):
         instance = LoxInstance(self)
 
-        initializer = self.find_method("init")
+        initializer = self.initializer
         if initializer is not None:
-            initializer.bind(instance).call(interpreter, arguments)
+            initializer.invoke(interpreter, instance, arguments)
 
         return instance
 
     def arity(self):
-        initializer = self.find_method("init")
+        initializer = self.initializer
         if initializer is None:
             return 0
         return initializer.arity()
 
     def find_method(self, name):
-        if name in self.methods.keys():
-            return self.methods[name]
-
-        if self.superclass is not None:
-            return self.superclass.find_method(name)
+        return self.methods.get(name)
@@ -4,37 +4,72 @@ from interpreter import *
 from Return import *
 from Environment import *
 from lox_function import *
+from lazy_body import LazyBody
 
 class LoxFunction(LoxCallable):
-    def __init__(self, declaration, closure, is_initializer):
+    __slots__ = ("declaration", "upvalues", "is_initializer", "receiver")
+
+    def __init__(self, declaration, upvalues, is_initializer, receiver=None):
         self.declaration = declaration
-        self.closure = closure
+        self.upvalues = upvalues
         self.is_initializer = is_initializer
+        self.receiver = receiver
 
     def arity(self):
         return len(self.declaration.params)
 
     def call(self, interpreter, arguments):
-        environment = Environment(self.closure)
+        if self.receiver is not None:
+            return self.run(interpreter, [self.receiver, *arguments])
+        return self.run(interpreter, arguments)
+
+    def invoke(self, interpreter, instance, arguments):
+        # Calls this method on `instance` without materializing the bound
+        # LoxFunction that bind() would create.
+        return self.run(interpreter, [instance, *arguments])
+
+    def run(self, interpreter, frame):
+        # The whole call is this one method: each Python frame a Lox call
+        # takes is one level less of Lox recursion before Python's limit.
+        declaration = self.declaration
+        if type(declaration.body) is LazyBody:
+            interpreter.compile_lazy(declaration)
+
+        tiering = interpreter.tiering
+        if tiering is not None:
+            profile = tiering.profile(declaration)
+            if profile.code is None:
+                profile.calls += 1
+                if profile.calls + profile.back_edges >= tiering.threshold and not profile.failed:
+                    # Methods are called with their receiver ahead of the arguments.
+                    is_method = len(frame) > len(declaration.params)
+                    tiering.tier_up(profile, self.is_initializer, is_method)
+
+            if profile.code is not None:
+                return profile.code(self.upvalues, interpreter, frame)
+
+            enclosing_profile = interpreter.current_profile
+            interpreter.current_profile = profile
 
-        for i in range(len(self.declaration.params)):
-            environment.define(self.declaration.params[i].lexeme, arguments[i])
+        for slot in declaration.cells:
+            frame[slot] = Cell(frame[slot])
 
+        environment = acquire_environment(frame, self.upvalues)
         try:
-            interpreter.execute_block(self.declaration.body, environment)
-        except Return_ as return_value:
-            if self.is_initializer: return self.closure.get_at(0, "self")
+            completion = interpreter.execute_block(declaration.body, environment)
+        finally:
+            if tiering is not None:
+                interpreter.current_profile = enclosing_profile
+        release_environment(environment)
 
-            return return_value.value
-        
         if self.is_initializer:
-            return self.closure.get_at(0, "self")
+            return frame[0]
+        if completion is not None:
+            return completion.value
         return None
 
     def __str__(self):
         return f"<Function '{self.declaration.name.lexeme}'>"
 
     def bind(self, instance):
-        environment = Environment(self.closure)
-        environment.define("self", instance)
-        return LoxFunction(self.declaration, environment, self.is_initializer)
+        return LoxFunction(self.declaration, self.upvalues, self.is_initializer, instance)
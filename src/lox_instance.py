@@ -1,16 +1,31 @@
 from lox_class import *
+from shape import ROOT_SHAPE
 
 class LoxInstance:
+    __slots__ = ("klass", "shape", "values")
+
     def __init__(self, klass):
         self.klass = klass
-        self.fields = {}
+        self.shape = ROOT_SHAPE
+        self.values = []
 
     def to_string(self):
         return f"{self.klass.name} instance."
 
-    def get(self, name):
-        if name.lexeme in self.fields.keys():
-            return self.fields[name.lexeme]
+    def __str__(self):
+        return self.to_string()
+
+    def get(self, name, cache=None):
+        shape = self.shape
+        if cache is None:
+            slot = shape.slots.get(name.lexeme)
+        elif cache.shape is shape:
+            slot = cache.result
+        else:
+            slot = cache.field(shape, name.lexeme)
+
+        if slot is not None:
+            return self.values[slot]
 
         method = self.klass.find_method(name.lexeme)
         if method is not None:
@@ -18,5 +33,32 @@ class LoxInstance:
 
         raise RuntimeError_(name, f"Undefined property '{name.lexeme}'.")
 
-    def set(self, name, value):
-        self.fields[name.lexeme] = value
+    def find_method(self, name, cache=None):
+        # The unbound method `name` refers to, or None when there is no such
+        # method or a field shadows it.
+        shape = self.shape
+        if cache is None:
+            slot = shape.slots.get(name.lexeme)
+        elif cache.shape is shape:
+            slot = cache.result
+        else:
+            slot = cache.field(shape, name.lexeme)
+
+        if slot is not None:
+            return None
+        return self.klass.find_method(name.lexeme)
+
+    def set(self, name, value, cache=None):
+        shape = self.shape
+        if cache is None:
+            slot, next_shape = shape.store(name.lexeme)
+        elif cache.shape is shape:
+            slot, next_shape = cache.result
+        else:
+            slot, next_shape = cache.store(shape, name.lexeme)
+
+        if next_shape is shape:
+            self.values[slot] = value
+        else:
+            self.values.append(value)
+            self.shape = next_shape
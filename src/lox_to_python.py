@@ -0,0 +1,941 @@
+import builtins
+from sys import intern
+from types import FunctionType as PyFunction, MethodType as PyMethod
+
+from visitor import *
+from Expr import *
+from Stmt import *
+from Token import Token
+from tokentype import TokenType
+from runtime_error import RuntimeError_
+from lox_callable import LoxCallable
+from interpreter import Clock
+
+
+# ----------------------------------------------------------------------
+# Runtime support for translated programs
+#
+# Lox functions become plain Python functions named `F_<name>`, Lox
+# instances are instances of a Python class generated per Lox class, and
+# properties live in the instance __dict__ as `p_<name>` so Python's own
+# attribute lookup gives fields-before-methods and method binding for free.
+
+
+class TranspiledInstance:
+    lox_name = None
+
+
+class TranspiledClass:
+    def __init__(self, name, instance_type, superclass):
+        self.name = name
+        self.instance_type = instance_type
+        self.superclass = superclass
+        self.initializer = getattr(instance_type, "p_init", None)
+
+    def __str__(self):
+        return self.name
+
+
+def _error(line, message):
+    return RuntimeError_(Token(TokenType.EOF, "", 0, 0, None, line), message)
+
+
+def _number_error(line):
+    raise _error(line, "Operand must be a number.")
+
+
+def _divide_error(a, b, line):
+    if a.__class__ is b.__class__ is float:
+        raise _error(line, "Division by zero.")
+    raise _error(line, "Operand must be a number.")
+
+
+def _add_error(line):
+    raise _error(line, "Operands must be two numbers or two strings.")
+
+
+def _fields_error(line):
+    raise _error(line, "Only instances have fields.")
+
+
+def _stringify(value):
+    if value is None:
+        return "nil"
+
+    kind = type(value)
+    if kind is PyFunction:
+        return f"<Function '{value.__name__[2:]}'>"
+    if kind is PyMethod:
+        return f"<Function '{value.__func__.__name__[2:]}'>"
+    if isinstance(value, TranspiledInstance):
+        return f"{value.lox_name} instance."
+    return str(value)
+
+
+def _call(callee, line, *args):
+    kind = type(callee)
+
+    if kind is PyFunction:
+        arity = callee.__code__.co_argcount
+    elif kind is PyMethod:
+        arity = callee.__func__.__code__.co_argcount - 1
+    elif kind is TranspiledClass:
+        initializer = callee.initializer
+        arity = 0 if initializer is None else initializer.__code__.co_argcount - 1
+        if arity != len(args):
+            raise _error(line, f"Expected {arity} arguments but got {len(args)}")
+
+        instance = callee.instance_type()
+        if initializer is not None:
+            initializer(instance, *args)
+        return instance
+    elif isinstance(callee, LoxCallable):
+        arity = callee.arity()
+        if arity != len(args):
+            raise _error(line, f"Expected {arity} arguments but got {len(args)}")
+        return callee.call(None, list(args))
+    else:
+        raise _error(line, "Can only call functions and classes.")
+
+    if arity != len(args):
+        raise _error(line, f"Expected {arity} arguments but got {len(args)}")
+    return callee(*args)
+
+
+def _check_callable(callee, line):
+    # Lox rejects a callee before it evaluates any of the arguments.
+    kind = type(callee)
+    if kind is PyFunction or kind is PyMethod or kind is TranspiledClass or isinstance(callee, LoxCallable):
+        return callee
+    raise _error(line, "Can only call functions and classes.")
+
+
+def _set_property(instance, name, value):
+    setattr(instance, name, value)
+    return value
+
+
+def _store(box, value):
+    box[0] = value
+    return value
+
+
+def _check_superclass(superclass, line):
+    if type(superclass) is not TranspiledClass:
+        raise _error(line, "Superclass must be a class.")
+    return superclass
+
+
+def _make_class(name, superclass, methods):
+    base = TranspiledInstance if superclass is None else superclass.instance_type
+    methods["lox_name"] = name
+    return TranspiledClass(name, type(name, (base,), methods), superclass)
+
+
+def _super_get(superclass, instance, name, line):
+    method = getattr(superclass.instance_type, name, None)
+    if method is None:
+        raise _error(line, f"Undefined property '{name[2:]}' .")
+    return PyMethod(method, instance)
+
+
+# ----------------------------------------------------------------------
+# Scope analysis
+
+
+class Binding:
+    def __init__(self, name, pyname, depth, kind):
+        self.name = name
+        self.pyname = pyname
+        self.depth = depth
+        self.kind = kind
+        self.captured = False
+        self.assigned = False
+
+    def boxed(self):
+        # Captured variables that never change after their declaration are
+        # handed to closures by value; everything else lives in a
+        # one-element list shared between the frames.
+        return self.captured and (self.assigned or self.kind in ("fun", "class"))
+
+
+class CaptureAnalyzer(Visitor):
+    def __init__(self):
+        self.scopes = []
+        self.functions = []
+        self.references = {}
+        self.declarations = {}
+        self.free = {}
+        self.counter = 0
+
+    def analyze(self, statements):
+        for statement in statements:
+            statement.accept(self)
+
+    def begin_scope(self):
+        self.scopes.append({})
+
+    def end_scope(self):
+        self.scopes.pop()
+
+    def declare(self, name, kind, key):
+        if not self.scopes:
+            return None
+
+        self.counter += 1
+        binding = Binding(name, f"l_{name}_{self.counter}", len(self.functions), kind)
+        self.scopes[-1][name] = binding
+        self.declarations[key] = binding
+        return binding
+
+    def reference(self, expr, name, key=None):
+        if expr.resolved is None:
+            return None
+
+        for scope in reversed(self.scopes):
+            if name in scope:
+                binding = scope[name]
+                self.references[expr if key is None else key] = binding
+
+                # Every function between the declaration and this use has
+                # to pass the variable down to its nested definitions.
+                for function in self.functions[binding.depth:]:
+                    binding.captured = True
+                    self.free[function][binding.pyname] = binding
+                return binding
+        return None
+
+    def function(self, stmt, is_method):
+        self.functions.append(stmt)
+        self.free[stmt] = {}
+        self.begin_scope()
+
+        if is_method:
+            self.declare("self", "self", (stmt, "self"))
+        for param in stmt.params:
+            self.declare(param.lexeme, "param", param)
+        for statement in stmt.body:
+            statement.accept(self)
+
+        self.end_scope()
+        self.functions.pop()
+
+    def visit_block_stmt(self, stmt):
+        self.begin_scope()
+        for statement in stmt.statements:
+            statement.accept(self)
+        self.end_scope()
+
+    def visit_expression_stmt(self, stmt):
+        stmt.expression.accept(self)
+
+    def visit_print_stmt(self, stmt):
+        stmt.expression.accept(self)
+
+    def visit_var_stmt(self, stmt):
+        if stmt.initializer is not None:
+            stmt.initializer.accept(self)
+        self.declare(stmt.name.lexeme, "var", stmt)
+
+    def visit_if_stmt(self, stmt):
+        stmt.condition.accept(self)
+        stmt.then_branch.accept(self)
+        if stmt.else_branch is not None:
+            stmt.else_branch.accept(self)
+
+    def visit_while_stmt(self, stmt):
+        stmt.condition.accept(self)
+        stmt.body.accept(self)
+
+    def visit_for_stmt(self, stmt):
+        self.begin_scope()
+        if stmt.initializer is not None:
+            stmt.initializer.accept(self)
+        if stmt.condition is not None:
+            stmt.condition.accept(self)
+        stmt.body.accept(self)
+        if stmt.increment is not None:
+            stmt.increment.accept(self)
+        self.end_scope()
+
+    def visit_function_stmt(self, stmt):
+        self.declare(stmt.name.lexeme, "fun", stmt)
+        self.function(stmt, False)
+
+    def visit_return_stmt(self, stmt):
+        if stmt.value is not None:
+            stmt.value.accept(self)
+
+    def visit_class_stmt(self, stmt):
+        self.declare(stmt.name.lexeme, "class", stmt)
+
+        if stmt.superclass is not None:
+            stmt.superclass.accept(self)
+            self.begin_scope()
+            self.declare("super", "super", (stmt, "super"))
+
+        for method in stmt.methods:
+            self.function(method, True)
+
+        if stmt.superclass is not None:
+            self.end_scope()
+
+    def visit_assign_expr(self, expr):
+        expr.value.accept(self)
+        binding = self.reference(expr, expr.name.lexeme)
+        if binding is not None:
+            binding.assigned = True
+
+    def visit_binary_expr(self, expr):
+        expr.left.accept(self)
+        expr.right.accept(self)
+
+    def visit_logical_expr(self, expr):
+        expr.left.accept(self)
+        expr.right.accept(self)
+
+    def visit_grouping_expr(self, expr):
+        expr.expression.accept(self)
+
+    def visit_literal_expr(self, expr):
+        pass
+
+    def visit_unary_expr(self, expr):
+        expr.right.accept(self)
+
+    def visit_variable_expr(self, expr):
+        self.reference(expr, expr.name.lexeme)
+
+    def visit_call_expr(self, expr):
+        expr.callee.accept(self)
+        for argument in expr.arguments:
+            argument.accept(self)
+
+    def visit_get_expr(self, expr):
+        expr.object.accept(self)
+
+    def visit_set_expr(self, expr):
+        expr.object.accept(self)
+        expr.value.accept(self)
+
+    def visit_self_expr(self, expr):
+        self.reference(expr, "self")
+
+    def visit_super_expr(self, expr):
+        self.reference(expr, "super")
+        self.reference(expr, "self", (expr, "self"))
+
+
+# ----------------------------------------------------------------------
+# Code generation
+
+
+def intern_constants(code):
+    # CPython only interns the constants that look like identifiers, so
+    # string literals compiled from one run would be copies of the ones the
+    # scanner interned and of those from every other run. Swapping in the
+    # interned strings keeps equal Lox strings one object everywhere.
+    consts = tuple(
+        intern(const) if type(const) is str
+        else intern_constants(const) if type(const) is type(code)
+        else const
+        for const in code.co_consts
+    )
+    return code.replace(co_consts=consts)
+
+
+class PythonFunction:
+    def __init__(self, enclosing):
+        self.enclosing = enclosing
+        self.lines = []
+        self.assigned_globals = set()
+        self.temps = 0
+
+
+class LoxToPython(Visitor):
+    comparison_ops = {
+        TokenType.GREATER: ">",
+        TokenType.GREATER_EQUAL: ">=",
+        TokenType.LESS: "<",
+        TokenType.LESS_EQUAL: "<=",
+    }
+    arithmetic_ops = {
+        TokenType.MINUS: "-",
+        TokenType.STAR: "*",
+        TokenType.SLASH: "/",
+    }
+
+    def __init__(self, error_handler):
+        self.error_handler = error_handler
+        self.runs = 0
+        # Line tables of every run so far, by generated filename: functions
+        # defined by one run can fail when called from a later one.
+        self.line_tables = {}
+
+        self.namespace = {
+            "__builtins__": builtins,
+            "_float": float,
+            "_str": str,
+            "_function": PyFunction,
+            "_method": PyMethod,
+            "_Instance": TranspiledInstance,
+            "_call": _call,
+            "_stringify": _stringify,
+            "_number_error": _number_error,
+            "_divide_error": _divide_error,
+            "_add_error": _add_error,
+            "_fields_error": _fields_error,
+            "_set_property": _set_property,
+            "_check_callable": _check_callable,
+            "_store": _store,
+            "_check_superclass": _check_superclass,
+            "_make_class": _make_class,
+            "_super_get": _super_get,
+            "_assign_global": self.assign_global,
+            "g_clock": Clock(),
+        }
+        self.defined_globals = {"clock"}
+
+    def assign_global(self, name, value, line):
+        if name not in self.namespace:
+            raise _error(line, f"Undefined variable '{name[2:]}'.")
+        self.namespace[name] = value
+        return value
+
+    # ------------------------------------------------------------------
+    # Driver
+
+    def interpret(self, statements):
+        source, line_names = self.translate(statements)
+
+        self.runs += 1
+        filename = f"<lox-{self.runs}>"
+        self.line_tables[filename] = line_names
+        try:
+            code = compile(source, filename, "exec")
+        except (SyntaxError, RecursionError, MemoryError, ValueError) as e:
+            # CPython limits how deeply code can nest, and Lox does not: a
+            # long chain of operators or loops inside twenty others cannot be
+            # compiled, and the program is turned away before it runs.
+            py_line = getattr(e, "lineno", None)
+            line = line_names[py_line][1] if py_line in line_names else self.line
+            reason = e.msg if isinstance(e, SyntaxError) else type(e).__name__
+            self.error_handler.error(line, f"Too deeply nested for the python backend ({reason}).")
+            return
+        exec(intern_constants(code), self.namespace)
+
+        try:
+            try:
+                self.namespace["_main"]()
+            except NameError as e:
+                raise self.translate_error(e, f"Undefined variable '{e.name[2:]}'.")
+            except AttributeError as e:
+                if isinstance(e.obj, TranspiledInstance):
+                    message = f"Undefined property '{e.name[2:]}'."
+                else:
+                    message = "Only instances have properties."
+                raise self.translate_error(e, message)
+        except RuntimeError_ as e:
+            self.error_handler.runtime_error(e)
+
+            # Globals declared after the failing statement never ran.
+            self.defined_globals = {
+                name[2:] for name in self.namespace if name.startswith("g_")
+            }
+
+    def translate_error(self, error, message):
+        # The innermost frame in generated code is where the error happened.
+        line_names = None
+        traceback = error.__traceback__
+        while traceback is not None:
+            table = self.line_tables.get(traceback.tb_frame.f_code.co_filename)
+            if table is not None:
+                line_names = table
+                py_line = traceback.tb_lineno
+            traceback = traceback.tb_next
+
+        if line_names is None:
+            raise error
+
+        names, default_line = line_names[py_line]
+        return _error(names.get(error.name, default_line), message)
+
+    def translate(self, statements):
+        self.analyzer = CaptureAnalyzer()
+        self.analyzer.analyze(statements)
+
+        self.function = PythonFunction(None)
+        self.indent = 1
+        self.pending_names = {}
+        self.line = 0
+
+        for statement in statements:
+            self.emit_stmt(statement)
+
+        body = self.function.lines
+        header = [(0, "def _main():", {})]
+        if self.function.assigned_globals:
+            header.append((1, "global " + ", ".join(sorted(self.function.assigned_globals)), {}))
+        if not body:
+            body = [(1, "pass", {})]
+
+        source = []
+        line_names = {}
+        for indent, text, names, *line in header + body:
+            source.append("    " * indent + text)
+            line_names[len(source)] = (names, line[0] if line else 0)
+
+        return "\n".join(source) + "\n", line_names
+
+    # ------------------------------------------------------------------
+    # Emission helpers
+
+    def write(self, text):
+        self.function.lines.append((self.indent, text, self.pending_names, self.line))
+        self.pending_names = {}
+
+    def temp(self):
+        self.function.temps += 1
+        return f"_t{self.function.temps}"
+
+    def emit_stmt(self, stmt):
+        stmt.accept(self)
+
+    def emit_body(self, stmt):
+        self.indent += 1
+        count = len(self.function.lines)
+        self.emit_stmt(stmt)
+        if len(self.function.lines) == count:
+            self.write("pass")
+        self.indent -= 1
+
+    def expr(self, expr):
+        return expr.accept(self)
+
+    def is_number(self, expr):
+        if isinstance(expr, Grouping):
+            return self.is_number(expr.expression)
+        if isinstance(expr, Literal):
+            return type(expr.value) is float
+        if isinstance(expr, Unary):
+            return expr.operator.tokentype == TokenType.MINUS
+        if isinstance(expr, Binary):
+            if expr.operator.tokentype in self.arithmetic_ops:
+                return True
+            if expr.operator.tokentype == TokenType.PLUS:
+                return self.is_number(expr.left) or self.is_number(expr.right)
+        return False
+
+    def is_bool(self, expr):
+        if isinstance(expr, Grouping):
+            return self.is_bool(expr.expression)
+        if isinstance(expr, Literal):
+            return type(expr.value) is bool
+        if isinstance(expr, Unary):
+            return expr.operator.tokentype == TokenType.BANG
+        if isinstance(expr, Binary):
+            return expr.operator.tokentype not in self.arithmetic_ops and expr.operator.tokentype != TokenType.PLUS
+        if isinstance(expr, Logical):
+            return self.is_bool(expr.left) and self.is_bool(expr.right)
+        return False
+
+    def condition(self, expr):
+        text = self.expr(expr)
+        if self.is_bool(expr):
+            return text
+        t = self.temp()
+        return f"(({t} := {text}) is not None and {t} is not False)"
+
+    def binding(self, key):
+        return self.analyzer.references.get(key)
+
+    def global_name(self, name):
+        pyname = "g_" + name.lexeme
+        self.pending_names.setdefault(pyname, name.line)
+        return pyname
+
+    def read(self, binding, name):
+        if binding is None:
+            return self.global_name(name)
+        if binding.boxed():
+            return f"{binding.pyname}[0]"
+        return binding.pyname
+
+    def declare(self, binding, name, value):
+        if binding is None:
+            pyname = "g_" + name.lexeme
+            self.function.assigned_globals.add(pyname)
+            self.write(f"{pyname} = {value}")
+            self.defined_globals.add(name.lexeme)
+        elif binding.boxed():
+            self.write(f"{binding.pyname} = [{value}]")
+        else:
+            self.write(f"{binding.pyname} = {value}")
+
+    # ------------------------------------------------------------------
+    # Statements
+
+    def visit_expression_stmt(self, stmt):
+        self.expression_stmt(stmt.expression)
+
+    def expression_stmt(self, expression):
+        if isinstance(expression, Assign):
+            self.assignment_stmt(expression)
+        elif isinstance(expression, Set):
+            self.set_stmt(expression)
+        else:
+            self.write(self.expr(expression))
+
+    def assignment_stmt(self, expr):
+        value = self.expr(expr.value)
+        binding = self.binding(expr)
+        self.line = expr.name.line
+
+        if binding is None:
+            pyname = "g_" + expr.name.lexeme
+            if expr.name.lexeme in self.defined_globals:
+                self.function.assigned_globals.add(pyname)
+                self.write(f"{pyname} = {value}")
+            else:
+                self.write(f"_assign_global({pyname!r}, {value}, {expr.name.line})")
+        elif binding.boxed():
+            self.write(f"{binding.pyname}[0] = {value}")
+        else:
+            self.write(f"{binding.pyname} = {value}")
+
+    def set_stmt(self, expr):
+        t = self.temp()
+        line = expr.name.line
+        self.write(f"if isinstance({t} := {self.expr(expr.object)}, _Instance):")
+        self.indent += 1
+        self.write(f"{t}.p_{expr.name.lexeme} = {self.expr(expr.value)}")
+        self.indent -= 1
+        self.write("else:")
+        self.indent += 1
+        self.write(f"_fields_error({line})")
+        self.indent -= 1
+
+    def visit_print_stmt(self, stmt):
+        self.write(f"print(_stringify({self.expr(stmt.expression)}))")
+
+    def visit_var_stmt(self, stmt):
+        value = "None" if stmt.initializer is None else self.expr(stmt.initializer)
+        self.line = stmt.name.line
+        self.declare(self.analyzer.declarations.get(stmt), stmt.name, value)
+
+    def visit_block_stmt(self, stmt):
+        for statement in stmt.statements:
+            self.emit_stmt(statement)
+
+    def visit_if_stmt(self, stmt):
+        self.write(f"if {self.condition(stmt.condition)}:")
+        self.emit_body(stmt.then_branch)
+
+        if stmt.else_branch is not None:
+            self.write("else:")
+            self.emit_body(stmt.else_branch)
+
+    def visit_while_stmt(self, stmt):
+        self.write(f"while {self.condition(stmt.condition)}:")
+        self.emit_body(stmt.body)
+
+    def visit_for_stmt(self, stmt):
+        if stmt.initializer is not None:
+            self.emit_stmt(stmt.initializer)
+
+        condition = "True" if stmt.condition is None else self.condition(stmt.condition)
+        self.write(f"while {condition}:")
+        self.indent += 1
+        count = len(self.function.lines)
+        self.emit_stmt(stmt.body)
+        if stmt.increment is not None:
+            self.expression_stmt(stmt.increment)
+        if len(self.function.lines) == count:
+            self.write("pass")
+        self.indent -= 1
+
+    def visit_return_stmt(self, stmt):
+        self.line = stmt.keyword.line
+        if self.current_initializer is not None:
+            if stmt.value is not None:
+                self.write(self.expr(stmt.value))
+            self.write(f"return {self.current_initializer}")
+        elif stmt.value is None:
+            self.write("return None")
+        else:
+            self.write(f"return {self.expr(stmt.value)}")
+
+    current_initializer = None
+
+    def emit_function(self, stmt, self_binding=None, is_initializer=False):
+        free = self.analyzer.free[stmt]
+        params = []
+        boxed_params = []
+
+        if self_binding is not None:
+            params.append(self_binding.pyname)
+        for param in stmt.params:
+            binding = self.analyzer.declarations[param]
+            if binding.boxed():
+                params.append(binding.pyname + "_arg")
+                boxed_params.append(binding.pyname)
+            else:
+                params.append(binding.pyname)
+
+        signature = ", ".join(params)
+        if free:
+            captured = ", ".join(f"{pyname}={pyname}" for pyname in free)
+            signature = f"{signature}, *, {captured}" if signature else f"*, {captured}"
+
+        self.line = stmt.name.line
+        self.write(f"def F_{stmt.name.lexeme}({signature}):")
+
+        enclosing_initializer = self.current_initializer
+        self.current_initializer = self_binding.pyname if is_initializer else None
+        outer_indent = self.indent
+        self.function = PythonFunction(self.function)
+        self.indent = 1
+
+        for pyname in boxed_params:
+            self.write(f"{pyname} = [{pyname}_arg]")
+        for statement in stmt.body:
+            self.emit_stmt(statement)
+        if is_initializer:
+            self.write(f"return {self_binding.pyname}")
+
+        function = self.function
+        self.function = function.enclosing
+        self.indent = outer_indent
+        self.current_initializer = enclosing_initializer
+
+        if function.assigned_globals:
+            self.indent += 1
+            self.write("global " + ", ".join(sorted(function.assigned_globals)))
+            self.indent -= 1
+        if not function.lines:
+            self.indent += 1
+            self.write("pass")
+            self.indent -= 1
+
+        for indent, text, names, line in function.lines:
+            self.function.lines.append((indent + outer_indent, text, names, line))
+
+        return f"F_{stmt.name.lexeme}"
+
+    def visit_function_stmt(self, stmt):
+        binding = self.analyzer.declarations.get(stmt)
+        if binding is not None and binding.boxed():
+            self.write(f"{binding.pyname} = [None]")
+            function = self.emit_function(stmt)
+            self.write(f"{binding.pyname}[0] = {function}")
+            return
+
+        function = self.emit_function(stmt)
+        self.declare(binding, stmt.name, function)
+
+    def visit_class_stmt(self, stmt):
+        binding = self.analyzer.declarations.get(stmt)
+        self.line = stmt.name.line
+
+        superclass = "None"
+        if stmt.superclass is not None:
+            line = stmt.superclass.name.line
+            value = f"_check_superclass({self.expr(stmt.superclass)}, {line})"
+            super_binding = self.analyzer.declarations[(stmt, "super")]
+            self.write(f"{super_binding.pyname} = {value}")
+            superclass = super_binding.pyname
+
+        if binding is not None and binding.boxed():
+            self.write(f"{binding.pyname} = [None]")
+
+        methods = []
+        for method in stmt.methods:
+            self_binding = self.analyzer.declarations[(method, "self")]
+            is_initializer = method.name.lexeme == "init"
+            function = self.emit_function(method, self_binding, is_initializer)
+            methods.append(f"'p_{method.name.lexeme}': {function}")
+
+        self.line = stmt.name.line
+        value = f"_make_class({stmt.name.lexeme!r}, {superclass}, {{{', '.join(methods)}}})"
+        if binding is not None and binding.boxed():
+            self.write(f"{binding.pyname}[0] = {value}")
+        else:
+            self.declare(binding, stmt.name, value)
+
+    # ------------------------------------------------------------------
+    # Expressions
+
+    def visit_literal_expr(self, expr):
+        return repr(expr.value)
+
+    def visit_grouping_expr(self, expr):
+        return f"({self.expr(expr.expression)})"
+
+    def visit_unary_expr(self, expr):
+        right = self.expr(expr.right)
+        t = self.temp()
+
+        if expr.operator.tokentype == TokenType.BANG:
+            if self.is_bool(expr.right):
+                return f"(not {right})"
+            return f"(({t} := {right}) is None or {t} is False)"
+
+        if self.is_number(expr.right):
+            return f"(-{right})"
+        return f"(-{t} if ({t} := {right}).__class__ is _float else _number_error({expr.operator.line}))"
+
+    def visit_binary_expr(self, expr):
+        left = self.expr(expr.left)
+        right = self.expr(expr.right)
+        _type = expr.operator.tokentype
+        line = expr.operator.line
+
+        if _type == TokenType.EQUAL_EQUAL:
+            return self.equal(expr, left, right)
+        if _type == TokenType.BANG_EQUAL:
+            return f"(not {self.equal(expr, left, right)})"
+
+        if _type == TokenType.PLUS:
+            return self.add(expr, left, right, line)
+        if _type == TokenType.SLASH:
+            return self.divide(expr, left, right, line)
+
+        op = self.arithmetic_ops.get(_type) or self.comparison_ops[_type]
+        left_number = self.is_number(expr.left)
+        right_number = self.is_number(expr.right)
+        a = self.temp()
+        b = self.temp()
+
+        if left_number and right_number:
+            return f"({left} {op} {right})"
+        if right_number and isinstance(expr.right, Literal):
+            return f"({a} {op} {right} if ({a} := {left}).__class__ is _float else _number_error({line}))"
+        if left_number and isinstance(expr.left, Literal):
+            return f"({left} {op} {b} if ({b} := {right}).__class__ is _float else _number_error({line}))"
+        return (
+            f"({a} {op} {b} if ({a} := {left}).__class__ is ({b} := {right}).__class__ is _float"
+            f" else _number_error({line}))"
+        )
+
+    def divide(self, expr, left, right, line):
+        # Python raises where Lox reports dividing by zero, so the divisor
+        # is checked unless it is a constant other than zero.
+        a = self.temp()
+        b = self.temp()
+
+        divisor = expr.right.value if isinstance(expr.right, Literal) else None
+        if type(divisor) is float and divisor != 0.0:
+            if self.is_number(expr.left):
+                return f"({left} / {right})"
+            return f"({a} / {right} if ({a} := {left}).__class__ is _float else _number_error({line}))"
+        if self.is_number(expr.left) and isinstance(expr.left, Literal):
+            return f"({left} / {b} if ({b} := {right}).__class__ is _float and {b} else _divide_error({left}, {b}, {line}))"
+        return (
+            f"({a} / {b} if ({a} := {left}).__class__ is ({b} := {right}).__class__ is _float and {b}"
+            f" else _divide_error({a}, {b}, {line}))"
+        )
+
+    def equal(self, expr, left, right):
+        # Python's bound methods are equal when they bind the same function
+        # to the same instance, but every Lox property access makes a new
+        # bound method, which is only equal to itself.
+        for operand in (expr.left, expr.right):
+            if isinstance(operand, Literal) or self.is_number(operand) or self.is_bool(operand):
+                return f"({left} == {right})"
+
+        a = self.temp()
+        b = self.temp()
+        return f"(({a} := {left}) == ({b} := {right}) and ({a}.__class__ is not _method or {a} is {b}))"
+
+    def add(self, expr, left, right, line):
+        if self.is_number(expr.left) and self.is_number(expr.right):
+            return f"({left} + {right})"
+
+        a = self.temp()
+        b = self.temp()
+
+        for literal, other, other_text, operand in (
+            (expr.right, expr.left, left, a),
+            (expr.left, expr.right, right, b),
+        ):
+            if isinstance(literal, Literal) and type(literal.value) in (float, str):
+                kind = "_float" if type(literal.value) is float else "_str"
+                sum_ = f"{operand} + {right}" if operand == a else f"{left} + {operand}"
+                return f"({sum_} if ({operand} := {other_text}).__class__ is {kind} else _add_error({line}))"
+
+        k = self.temp()
+        return (
+            f"({a} + {b} if ({k} := ({a} := {left}).__class__) is ({b} := {right}).__class__"
+            f" and ({k} is _float or {k} is _str) else _add_error({line}))"
+        )
+
+    def visit_logical_expr(self, expr):
+        left = self.expr(expr.left)
+        right = self.expr(expr.right)
+
+        if self.is_bool(expr):
+            keyword = "or" if expr.operator.tokentype == TokenType.OR else "and"
+            return f"({left} {keyword} {right})"
+
+        t = self.temp()
+        if expr.operator.tokentype == TokenType.OR:
+            return f"({t} if ({t} := {left}) is not None and {t} is not False else {right})"
+        return f"({t} if ({t} := {left}) is None or {t} is False else {right})"
+
+    def visit_variable_expr(self, expr):
+        return self.read(self.binding(expr), expr.name)
+
+    def visit_assign_expr(self, expr):
+        value = self.expr(expr.value)
+        binding = self.binding(expr)
+
+        if binding is None:
+            pyname = "g_" + expr.name.lexeme
+            if expr.name.lexeme in self.defined_globals:
+                self.function.assigned_globals.add(pyname)
+                return f"({pyname} := {value})"
+            return f"_assign_global({pyname!r}, {value}, {expr.name.line})"
+        if binding.boxed():
+            return f"_store({binding.pyname}, {value})"
+        return f"({binding.pyname} := {value})"
+
+    def visit_call_expr(self, expr):
+        callee = self.expr(expr.callee)
+        arguments = ", ".join(self.expr(argument) for argument in expr.arguments)
+        argc = len(expr.arguments)
+        line = expr.paren_loc.line
+        t = self.temp()
+        if arguments:
+            slow = f"_call(_check_callable({t}, {line}), {line}, {arguments})"
+        else:
+            slow = f"_call({t}, {line})"
+
+        if isinstance(expr.callee, Get):
+            fast = f"({t} := {callee}).__class__ is _method and {t}.__func__.__code__.co_argcount == {argc + 1}"
+        else:
+            fast = f"({t} := {callee}).__class__ is _function and {t}.__code__.co_argcount == {argc}"
+
+        return f"({t}({arguments}) if {fast} else {slow})"
+
+    def visit_get_expr(self, expr):
+        attribute = "p_" + expr.name.lexeme
+        self.pending_names.setdefault(attribute, expr.name.line)
+        return f"{self.expr(expr.object)}.{attribute}"
+
+    def visit_set_expr(self, expr):
+        # The instance is checked before the value is evaluated.
+        t = self.temp()
+        instance = self.expr(expr.object)
+        value = self.expr(expr.value)
+        return (
+            f"(_set_property({t}, 'p_{expr.name.lexeme}', {value}) if isinstance({t} := {instance}, _Instance)"
+            f" else _fields_error({expr.name.line}))"
+        )
+
+    def visit_self_expr(self, expr):
+        return self.binding(expr).pyname
+
+    def visit_super_expr(self, expr):
+        superclass = self.binding(expr).pyname
+        instance = self.binding((expr, "self")).pyname
+        return f"_super_get({superclass}, {instance}, 'p_{expr.method.lexeme}', {expr.method.line})"
@@ -0,0 +1,405 @@
+from visitor import *
+from Expr import *
+from Stmt import *
+from tokentype import TokenType
+from lazy_body import LazyBody
+
+
+class ScopeAnalyzer(Visitor):
+    # Binds every Variable and Assign to the declaration it refers to,
+    # following the same scoping rules as the Resolver, and records which
+    # declarations are ever assigned. Only local declarations are tracked:
+    # globals can be redefined or assigned by code that is not parsed yet.
+
+    def __init__(self):
+        self.scopes = []
+        self.references = {}
+        self.assigned = set()
+
+    def analyze(self, statements):
+        for statement in statements:
+            statement.accept(self)
+
+    def declare(self, name, declaration):
+        if self.scopes:
+            self.scopes[-1][name.lexeme] = declaration
+
+    def reference(self, expr, name):
+        for scope in reversed(self.scopes):
+            if name.lexeme in scope:
+                self.references[expr] = scope[name.lexeme]
+                return scope[name.lexeme]
+        return None
+
+    def function(self, stmt):
+        if isinstance(stmt.body, LazyBody):
+            return
+
+        self.scopes.append({})
+        for param in stmt.params:
+            self.declare(param, param)
+        for statement in stmt.body:
+            statement.accept(self)
+        self.scopes.pop()
+
+    def visit_block_stmt(self, stmt):
+        self.scopes.append({})
+        for statement in stmt.statements:
+            statement.accept(self)
+        self.scopes.pop()
+
+    def visit_expression_stmt(self, stmt):
+        stmt.expression.accept(self)
+
+    def visit_print_stmt(self, stmt):
+        stmt.expression.accept(self)
+
+    def visit_var_stmt(self, stmt):
+        # Declared before the initializer runs, like the Resolver does, so
+        # `var a = a;` binds to the new variable.
+        self.declare(stmt.name, stmt)
+        if stmt.initializer is not None:
+            stmt.initializer.accept(self)
+
+    def visit_if_stmt(self, stmt):
+        stmt.condition.accept(self)
+        stmt.then_branch.accept(self)
+        if stmt.else_branch is not None:
+            stmt.else_branch.accept(self)
+
+    def visit_while_stmt(self, stmt):
+        stmt.condition.accept(self)
+        stmt.body.accept(self)
+
+    def visit_for_stmt(self, stmt):
+        self.scopes.append({})
+        if stmt.initializer is not None:
+            stmt.initializer.accept(self)
+        if stmt.condition is not None:
+            stmt.condition.accept(self)
+        if stmt.increment is not None:
+            stmt.increment.accept(self)
+        stmt.body.accept(self)
+        self.scopes.pop()
+
+    def visit_function_stmt(self, stmt):
+        self.declare(stmt.name, stmt)
+        self.function(stmt)
+
+    def visit_return_stmt(self, stmt):
+        if stmt.value is not None:
+            stmt.value.accept(self)
+
+    def visit_class_stmt(self, stmt):
+        self.declare(stmt.name, stmt)
+        if stmt.superclass is not None:
+            stmt.superclass.accept(self)
+        for method in stmt.methods:
+            self.function(method)
+
+    def visit_assign_expr(self, expr):
+        expr.value.accept(self)
+        declaration = self.reference(expr, expr.name)
+        if declaration is not None:
+            self.assigned.add(declaration)
+
+    def visit_binary_expr(self, expr):
+        expr.left.accept(self)
+        expr.right.accept(self)
+
+    def visit_logical_expr(self, expr):
+        expr.left.accept(self)
+        expr.right.accept(self)
+
+    def visit_grouping_expr(self, expr):
+        expr.expression.accept(self)
+
+    def visit_literal_expr(self, expr):
+        pass
+
+    def visit_unary_expr(self, expr):
+        expr.right.accept(self)
+
+    def visit_variable_expr(self, expr):
+        self.reference(expr, expr.name)
+
+    def visit_call_expr(self, expr):
+        expr.callee.accept(self)
+        for argument in expr.arguments:
+            argument.accept(self)
+
+    def visit_get_expr(self, expr):
+        expr.object.accept(self)
+
+    def visit_set_expr(self, expr):
+        expr.object.accept(self)
+        expr.value.accept(self)
+
+    def visit_self_expr(self, expr):
+        pass
+
+    def visit_super_expr(self, expr):
+        pass
+
+
+class Optimizer(Visitor):
+    # Rewrites the resolved tree before it runs: folds constant
+    # expressions, replaces reads of never-assigned local constants with
+    # their value, and drops branches and statements that cannot run.
+    # Folding stops short of anything that would raise at run time, so
+    # errors are still reported by the backend, on the original line.
+    #
+    # Statement visitors return the replacement statement, or None when the
+    # statement is removed; expression visitors return the replacement
+    # expression.
+
+    arithmetic = {
+        TokenType.MINUS: lambda a, b: a - b,
+        TokenType.STAR: lambda a, b: a * b,
+        TokenType.SLASH: lambda a, b: a / b,
+        TokenType.GREATER: lambda a, b: a > b,
+        TokenType.GREATER_EQUAL: lambda a, b: a >= b,
+        TokenType.LESS: lambda a, b: a < b,
+        TokenType.LESS_EQUAL: lambda a, b: a <= b,
+    }
+
+    def __init__(self):
+        self.changes = []
+
+    def optimize(self, statements):
+        self.analyzer = ScopeAnalyzer()
+        self.analyzer.analyze(statements)
+        self.referenced = set(self.analyzer.references.values())
+        self.constants = {}
+
+        return self.optimize_statements(statements)
+
+    def report(self, line, message):
+        self.changes.append(f"[Line {line}] {message}")
+
+    def optimize_statements(self, statements):
+        optimized = []
+        for i, statement in enumerate(statements):
+            statement = statement.accept(self)
+            if statement is not None:
+                optimized.append(statement)
+
+            if isinstance(statement, Return):
+                if i + 1 < len(statements):
+                    count = len(statements) - i - 1
+                    self.report(statement.keyword.line, f"removed {count} unreachable statement(s) after return")
+                break
+        return optimized
+
+    def optimize_branch(self, stmt):
+        # A statement in a position that needs one, such as a loop body.
+        optimized = stmt.accept(self)
+        return Block([]) if optimized is None else optimized
+
+    def expr(self, expr):
+        return expr.accept(self)
+
+    def is_truthy(self, value):
+        return value is not None and value is not False
+
+    # ------------------------------------------------------------------
+    # Statements
+
+    def visit_expression_stmt(self, stmt):
+        stmt.expression = self.expr(stmt.expression)
+        return stmt
+
+    def visit_print_stmt(self, stmt):
+        stmt.expression = self.expr(stmt.expression)
+        return stmt
+
+    def visit_var_stmt(self, stmt):
+        if stmt.initializer is not None:
+            stmt.initializer = self.expr(stmt.initializer)
+
+        # The analyzer only binds references to local declarations, so a
+        # global never shows up among the referenced ones.
+        if stmt in self.analyzer.assigned or stmt not in self.referenced:
+            return stmt
+        if stmt.initializer is None:
+            self.constants[stmt] = None
+        elif isinstance(stmt.initializer, Literal):
+            self.constants[stmt] = stmt.initializer.value
+        return stmt
+
+    def visit_block_stmt(self, stmt):
+        stmt.statements = self.optimize_statements(stmt.statements)
+        return stmt
+
+    def visit_if_stmt(self, stmt):
+        stmt.condition = self.expr(stmt.condition)
+
+        if isinstance(stmt.condition, Literal):
+            if self.is_truthy(stmt.condition.value):
+                self.report(stmt.keyword.line, "kept only the then branch of an if with a constant true condition")
+                return stmt.then_branch.accept(self)
+
+            if stmt.else_branch is None:
+                self.report(stmt.keyword.line, "removed an if with a constant false condition")
+                return None
+            self.report(stmt.keyword.line, "kept only the else branch of an if with a constant false condition")
+            return stmt.else_branch.accept(self)
+
+        stmt.then_branch = self.optimize_branch(stmt.then_branch)
+        if stmt.else_branch is not None:
+            stmt.else_branch = stmt.else_branch.accept(self)
+        return stmt
+
+    def visit_while_stmt(self, stmt):
+        stmt.condition = self.expr(stmt.condition)
+
+        if isinstance(stmt.condition, Literal) and not self.is_truthy(stmt.condition.value):
+            self.report(stmt.keyword.line, "removed a while loop with a constant false condition")
+            return None
+
+        stmt.body = self.optimize_branch(stmt.body)
+        return stmt
+
+    def visit_for_stmt(self, stmt):
+        if stmt.initializer is not None:
+            stmt.initializer = stmt.initializer.accept(self)
+        if stmt.condition is not None:
+            stmt.condition = self.expr(stmt.condition)
+
+        if isinstance(stmt.condition, Literal) and not self.is_truthy(stmt.condition.value):
+            # Only the initializer runs. A Block gives it the same scope the
+            # loop would have.
+            self.report(stmt.keyword.line, "removed the body of a for loop with a constant false condition")
+            if stmt.initializer is None:
+                return None
+            return Block([stmt.initializer])
+
+        if stmt.increment is not None:
+            stmt.increment = self.expr(stmt.increment)
+        stmt.body = self.optimize_branch(stmt.body)
+        return stmt
+
+    def visit_function_stmt(self, stmt):
+        # A pre-parsed body is optimized once it has been parsed.
+        if not isinstance(stmt.body, LazyBody):
+            stmt.body = self.optimize_statements(stmt.body)
+        return stmt
+
+    def visit_return_stmt(self, stmt):
+        if stmt.value is not None:
+            stmt.value = self.expr(stmt.value)
+        return stmt
+
+    def visit_class_stmt(self, stmt):
+        # The superclass stays a Variable: the backends report its token
+        # when it is not a class.
+        for method in stmt.methods:
+            self.visit_function_stmt(method)
+        return stmt
+
+    # ------------------------------------------------------------------
+    # Expressions
+
+    def visit_literal_expr(self, expr):
+        return expr
+
+    def visit_grouping_expr(self, expr):
+        expr.expression = self.expr(expr.expression)
+        if isinstance(expr.expression, Literal):
+            return expr.expression
+        return expr
+
+    def visit_unary_expr(self, expr):
+        expr.right = self.expr(expr.right)
+        if not isinstance(expr.right, Literal):
+            return expr
+
+        value = expr.right.value
+        if expr.operator.tokentype == TokenType.BANG:
+            return self.folded(expr.operator, not self.is_truthy(value))
+        if type(value) is float:
+            return self.folded(expr.operator, -value)
+        return expr
+
+    def visit_binary_expr(self, expr):
+        expr.left = self.expr(expr.left)
+        expr.right = self.expr(expr.right)
+        if not (isinstance(expr.left, Literal) and isinstance(expr.right, Literal)):
+            return expr
+
+        a = expr.left.value
+        b = expr.right.value
+        _type = expr.operator.tokentype
+
+        if _type == TokenType.EQUAL_EQUAL:
+            return self.folded(expr.operator, a == b)
+        if _type == TokenType.BANG_EQUAL:
+            return self.folded(expr.operator, not (a == b))
+        if _type == TokenType.PLUS:
+            if type(a) is type(b) and type(a) in (float, str):
+                return self.folded(expr.operator, a + b)
+            return expr
+
+        if type(a) is not float or type(b) is not float:
+            return expr
+        if _type == TokenType.SLASH and b == 0.0:
+            return expr
+        return self.folded(expr.operator, self.arithmetic[_type](a, b))
+
+    def folded(self, operator, value):
+        self.report(operator.line, f"folded '{operator.lexeme}' into {self.describe(value)}")
+        return Literal(value)
+
+    def describe(self, value):
+        if value is None:
+            return "nil"
+        if type(value) is str:
+            return '"' + value + '"'
+        return str(value)
+
+    def visit_logical_expr(self, expr):
+        expr.left = self.expr(expr.left)
+        expr.right = self.expr(expr.right)
+        if not isinstance(expr.left, Literal):
+            return expr
+
+        truthy = self.is_truthy(expr.left.value)
+        if expr.operator.tokentype == TokenType.OR:
+            result = expr.left if truthy else expr.right
+        else:
+            result = expr.right if truthy else expr.left
+
+        self.report(expr.operator.line, f"short-circuited '{expr.operator.lexeme}' on a constant")
+        return result
+
+    def visit_variable_expr(self, expr):
+        declaration = self.analyzer.references.get(expr)
+        if declaration in self.constants:
+            value = self.constants[declaration]
+            self.report(expr.name.line, f"propagated constant '{expr.name.lexeme}' = {self.describe(value)}")
+            return Literal(value)
+        return expr
+
+    def visit_assign_expr(self, expr):
+        expr.value = self.expr(expr.value)
+        return expr
+
+    def visit_call_expr(self, expr):
+        expr.callee = self.expr(expr.callee)
+        expr.arguments = [self.expr(argument) for argument in expr.arguments]
+        return expr
+
+    def visit_get_expr(self, expr):
+        expr.object = self.expr(expr.object)
+        return expr
+
+    def visit_set_expr(self, expr):
+        expr.object = self.expr(expr.object)
+        expr.value = self.expr(expr.value)
+        return expr
+
+    def visit_self_expr(self, expr):
+        return expr
+
+    def visit_super_expr(self, expr):
+        return expr
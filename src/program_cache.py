@@ -0,0 +1,133 @@
+import gc
+import hashlib
+import mmap
+import os
+import pickle
+import sys
+import zlib
+
+from flat_ast import FlatProgram
+
+# Everything that decides what a cached program looks like. A change to any
+# of these files, or another Python, makes every cached program stale.
+FRONT_END = (
+    "Token.py",
+    "tokentype.py",
+    "scanner.py",
+    "Parser.py",
+    "Expr.py",
+    "Stmt.py",
+    "resolver.py",
+    "optimizer.py",
+    "lazy_body.py",
+    "flat_ast.py",
+    "program_cache.py",
+)
+
+MAGIC = b"LOXC"
+
+
+def interpreter_version():
+    digest = hashlib.sha256(sys.version.encode())
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in FRONT_END:
+        with open(os.path.join(directory, name), "rb") as f:
+            digest.update(f.read())
+    return digest.digest()
+
+
+class ProgramCache:
+    # The parsed, resolved and optimized program of a script, kept in
+    # __loxcache__/<script>c next to it, like __pycache__. A cache file
+    # starts with MAGIC, the interpreter version, the optimize and lazy
+    # flags and a hash of the source, followed by the compressed pickle of
+    # the resolved statements. Anything that does not match is ignored and
+    # rewritten.
+    #
+    # A flat program is stored as it is instead, uncompressed, in
+    # __loxcache__/<script>f, and mapped back into memory rather than read,
+    # so every process running the script shares one copy of it.
+
+    def __init__(self, path, source, optimize, lazy, flat=False):
+        directory, name = os.path.split(os.path.abspath(path))
+        self.directory = os.path.join(directory, "__loxcache__")
+        # The two formats have files of their own, so running a script
+        # both ways does not rewrite its cache every time.
+        self.path = os.path.join(self.directory, name + ("f" if flat else "c"))
+        self.header = (
+            MAGIC
+            + interpreter_version()
+            + (b"O" if optimize else b"-")
+            + (b"L" if lazy else b"-")
+            + (b"F" if flat else b"-")
+            + hashlib.sha256(source.encode()).digest()
+        )
+        self.flat = flat
+
+    def load(self):
+        # Returns the statements, or the FlatProgram, or None on a miss.
+        if self.flat:
+            return self.load_flat()
+
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        if not data.startswith(self.header):
+            return None
+
+        # Unpickling makes every node at once, and the collector would go
+        # over them again and again while it does. They live as long as the
+        # program, so they are frozen out of its way afterwards.
+        gc.disable()
+        try:
+            program = pickle.loads(zlib.decompress(data[len(self.header):]))
+        except Exception:
+            return None
+        finally:
+            gc.enable()
+        gc.freeze()
+        return program
+
+    def load_flat(self):
+        try:
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        if mapped[:len(self.header)] != self.header:
+            mapped.close()
+            return None
+
+        try:
+            return FlatProgram.from_buffer(memoryview(mapped)[len(self.header):])
+        except ValueError:
+            return None
+
+    def store(self, program):
+        # Best effort: a program too deeply nested to pickle, or a directory
+        # that cannot be written, just goes uncached.
+        if self.flat:
+            payload = program.to_bytes()
+        else:
+            try:
+                payload = zlib.compress(
+                    pickle.dumps(program, pickle.HIGHEST_PROTOCOL), 1
+                )
+            except (RecursionError, pickle.PicklingError):
+                return
+
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temporary, "wb") as f:
+                f.write(self.header + payload)
+            os.replace(temporary, self.path)
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
@@ -1,7 +1,7 @@
 from visitor import *
 from Expr import *
 from Stmt import *
-from lox import Lox
+from lazy_body import LazyBody
 
 import enum
 from typing import List
@@ -17,16 +17,71 @@ class ClassType(enum.Enum):
     CLASS = enum.auto()
     SUBCLASS = enum.auto()
 
+# How a resolved local is reached: through a slot in the running
+# function's frame, or through the upvalues its closure captured. The _CELL
+# kinds hold a Cell whose value is the variable.
+LOCAL = 0
+LOCAL_CELL = 1
+FREE = 2
+FREE_CELL = 3
+
+class LocalVariable:
+    def __init__(self, function, slot, declaration):
+        self.function = function
+        self.slot = slot
+        self.declaration = declaration
+        self.captured = False
+        self.assigned = False
+
+    def is_cell(self):
+        # A captured variable is copied into the closure unless it can
+        # change afterwards. Functions and classes are captured by their own
+        # bodies before they are defined, so they always get a Cell.
+        if not self.captured:
+            return False
+        return self.assigned or isinstance(self.declaration, (Function, Class))
+
+class FunctionScope:
+    # One per function, plus one for top-level code. Every block inside it
+    # keeps its locals in the function's frame; `upvalues` lists what the
+    # function captures, as (is_local, index) into the enclosing function's
+    # frame or upvalues.
+
+    def __init__(self, enclosing, declaration):
+        self.enclosing = enclosing
+        self.declaration = declaration
+        self.upvalues = []
+        self.indices = {}
+        self.params = []
+
 class Resolver(Visitor):
-    def __init__(self, interpreter):
-        self.interpreter = interpreter
+    # Writes what it finds on the nodes themselves: a `(kind, index)` pair
+    # in the `resolved` field of every local variable reference (and in
+    # `receiver`, for the `self` a `super` expression binds to), which stays
+    # None for globals, and the storage, upvalues and cells of every local
+    # declaration. Equal pairs are shared between nodes.
+
+    def __init__(self, error_handler):
+        self.error_handler = error_handler
         self.scopes = []
+        self.variables = []
+        self.bases = []
+        self.owners = []
         self.current_function = FunctionType.NONE
         self.current_class = ClassType.NONE
 
+        # Whether a variable needs a Cell is only known once every use has
+        # been seen, so references are only resolved when the outermost
+        # local scope ends.
+        self.function = FunctionScope(None, None)
+        self.functions = []
+        self.declared = []
+        self.pending = []
+        self.resolutions = {}
+
     def visit_block_stmt(self, stmt):
         self.begin_scope()
-        self.reolve(stmt.statements)
+        self.resolve(stmt.statements)
         self.end_scope()
         return None
 
@@ -34,11 +89,11 @@ class Resolver(Visitor):
         enclosing_class = self.current_class
         self.current_class = ClassType.CLASS
 
-        self.declare(stmt.name)
+        self.declare(stmt.name, stmt)
         self.define(stmt.name)
 
         if (stmt.superclass is not None) and (stmt.name.lexeme == stmt.superclass.name.lexeme):
-            Lox.error(stmt.superclass.name, "A class can't inherit from itself.")
+            self.error_handler.error(stmt.superclass.name, "A class can't inherit from itself.")
 
         if stmt.superclass is not None:
             self.current_class = ClassType.SUBCLASS
@@ -46,10 +101,7 @@ class Resolver(Visitor):
 
         if stmt.superclass is not None:
             self.begin_scope()
-            self.scopes[-1]["super"] = True
-
-        self.begin_scope()
-        self.scopes[-1]["self"] = True
+            self.add_variable("super", None)
         
         for method in stmt.methods:
             declaration = FunctionType.METHOD
@@ -59,8 +111,6 @@ class Resolver(Visitor):
 
             self.resolve_function(method, declaration)
 
-        self.end_scope()
-
         if stmt.superclass is not None: self.end_scope()
 
         self.current_class = enclosing_class
@@ -79,28 +129,91 @@ class Resolver(Visitor):
         expr.accept(self)
 
     def begin_scope(self):
+        # A scope's slots follow those of the enclosing scope in the same
+        # function; a function's own scope starts its frame at slot 0.
+        base = 0
+        if self.scopes and self.owners[-1] is self.function:
+            base = self.bases[-1] + len(self.variables[-1])
+
         self.scopes.append({})
+        self.variables.append({})
+        self.bases.append(base)
+        self.owners.append(self.function)
 
     def end_scope(self):
         self.scopes.pop()
+        self.variables.pop()
+        self.bases.pop()
+        self.owners.pop()
+
+        if not self.scopes:
+            self.resolve_pending()
+
+    def resolve_pending(self):
+        resolutions = self.resolutions
+        for expr, field, variable, kind, index in self.pending:
+            if variable.is_cell():
+                kind += 1
+            resolved = resolutions.get((kind, index))
+            if resolved is None:
+                resolved = resolutions[(kind, index)] = (kind, index)
+            setattr(expr, field, resolved)
+
+        for variable in self.declared:
+            if variable.declaration is not None:
+                variable.declaration.storage = LOCAL_CELL if variable.is_cell() else LOCAL
+
+        for function in self.functions:
+            declaration = function.declaration
+            declaration.upvalues = tuple(function.upvalues)
+            declaration.cells = tuple(param.slot for param in function.params if param.is_cell())
+
+        self.pending = []
+        self.declared = []
+        self.functions = []
+
+    def add_variable(self, lexeme, declaration):
+        variables = self.variables[-1]
+        variable = variables.get(lexeme)
+        if variable is None:
+            slot = self.bases[-1] + len(variables)
+            variable = variables[lexeme] = LocalVariable(self.function, slot, declaration)
+            self.declared.append(variable)
+
+        self.scopes[-1][lexeme] = True
+        return variable
+
+    def upvalue(self, function, variable):
+        index = function.indices.get(variable)
+        if index is None:
+            if variable.function is function.enclosing:
+                source = (True, variable.slot)
+            else:
+                source = (False, self.upvalue(function.enclosing, variable))
+
+            index = function.indices[variable] = len(function.upvalues)
+            function.upvalues.append(source)
+        return index
 
     def visit_var_stmt(self, stmt):
-        self.declare(stmt.name)
+        self.declare(stmt.name, stmt)
         if stmt.initializer is not None:
             self.resolve(stmt.initializer)
 
         self.define(stmt.name) 
 
-    def declare(self, name):
+    def declare(self, name, declaration=None):
         if not self.scopes:
-            return 
+            return None
 
         scope = self.scopes[-1]
         
         if name.lexeme in scope.keys():
-            Lox.error(name, "Already a variable with this name in this scope.")
+            self.error_handler.error(name, "Already a variable with this name in this scope.")
 
+        variable = self.add_variable(name.lexeme, declaration)
         scope[name.lexeme] = False 
+        return variable
 
     def define(self, name):
         if not self.scopes:
@@ -110,42 +223,78 @@ class Resolver(Visitor):
 
     def visit_variable_expr(self, expr):
         if (self.scopes and self.scopes[-1].get(expr.name.lexeme) is False):
-            Lox.error(expr.name, "Can't read local variable is its own initializer.")
-
-        self.resolve_local(expr, expr.name)
-
-    def resolve_local(self, expr, name):
-        for i, scope in enumerate(reversed(self.scopes)):
-            if name.lexeme in scope:
-                self.interpreter.resolve(expr, i)
-                return 
+            self.error_handler.error(expr.name, "Can't read local variable is its own initializer.")
+
+        self.resolve_local(expr, expr.name.lexeme)
+
+    def resolve_local(self, expr, lexeme, field="resolved"):
+        for variables in reversed(self.variables):
+            variable = variables.get(lexeme)
+            if variable is None:
+                continue
+
+            if variable.function is self.function:
+                self.pending.append((expr, field, variable, LOCAL, variable.slot))
+            else:
+                variable.captured = True
+                self.pending.append((expr, field, variable, FREE, self.upvalue(self.function, variable)))
+            return variable
+        return None
 
     def visit_assign_expr(self, expr):
         self.resolve(expr.value)
-        self.resolve_local(expr, expr.name)
+        variable = self.resolve_local(expr, expr.name.lexeme)
+        if variable is not None:
+            variable.assigned = True
         return None 
 
     def visit_function_stmt(self, stmt):
-        self.declare(stmt.name)
+        self.declare(stmt.name, stmt)
         self.define(stmt.name)
 
         self.resolve_function(stmt, FunctionType.FUNCTION)
         return None
 
     def resolve_function(self, function, type_):
+        # A pre-parsed function only refers to globals outside itself; its
+        # body is resolved by resolve_lazy() when it is first called.
+        if isinstance(function.body, LazyBody):
+            function.upvalues = ()
+            return
+
         enclosing_function = self.current_function
         self.current_function = type_ 
 
+        enclosing_scope = self.function
+        self.function = FunctionScope(enclosing_scope, function)
+        self.functions.append(self.function)
+
         self.begin_scope()
 
+        # Methods find their receiver in slot 0.
+        if type_ in (FunctionType.METHOD, FunctionType.INITIALIZER):
+            self.add_variable("self", None)
+
         for param in function.params:
-            self.declare(param)
+            self.function.params.append(self.declare(param))
             self.define(param)
 
         self.resolve(function.body)
         self.end_scope()
+
+        self.function = enclosing_scope
         self.current_function = enclosing_function
 
+    def resolve_lazy(self, function, kind):
+        # `function` has just had its pre-parsed body parsed.
+        if kind == "method":
+            self.current_class = ClassType.CLASS
+            type_ = FunctionType.INITIALIZER if function.name.lexeme == "init" else FunctionType.METHOD
+        else:
+            type_ = FunctionType.FUNCTION
+
+        self.resolve_function(function, type_)
+
     def visit_expression_stmt(self, stmt):
         self.resolve_(stmt.expression)
         return None
@@ -165,11 +314,11 @@ class Resolver(Visitor):
 
     def visit_return_stmt(self, stmt):
         if self.current_function == FunctionType.NONE:
-            Lox.error(stmt.keyword, "Can't return from top-level code.")
+            self.error_handler.error(stmt.keyword, "Can't return from top-level code.")
 
         if stmt.value is not None:
             if self.current_function == FunctionType.INITIALIZER:
-                Lox.error(stmt.keyword, "Can't return a value from an initializer.")
+                self.error_handler.error(stmt.keyword, "Can't return a value from an initializer.")
 
             self.resolve_(stmt.value)
 
@@ -180,6 +329,20 @@ class Resolver(Visitor):
         self.resolve_(stmt.body)
         return None 
 
+    def visit_for_stmt(self, stmt):
+        # The loop scope holds the initializer's variable; a block body gets
+        # a scope of its own inside it.
+        self.begin_scope()
+        if stmt.initializer is not None:
+            self.resolve_(stmt.initializer)
+        if stmt.condition is not None:
+            self.resolve_(stmt.condition)
+        if stmt.increment is not None:
+            self.resolve_(stmt.increment)
+        self.resolve_(stmt.body)
+        self.end_scope()
+        return None
+
     def visit_binary_expr(self, expr):
         self.resolve_(expr.left)
         self.resolve_(expr.right)
@@ -220,16 +383,17 @@ class Resolver(Visitor):
 
     def visit_self_expr(self, expr):
         if self.current_class == ClassType.NONE:
-            Lox.error(expr.keyword, "Can't use 'self' outside of a class.")
+            self.error_handler.error(expr.keyword, "Can't use 'self' outside of a class.")
             return 
 
-        self.resolve_local(expr, expr.keyword)
+        self.resolve_local(expr, "self")
         return 
 
     def visit_super_expr(self, expr):
         if self.current_class == ClassType.NONE:
-            Lox.error(expr.keyword, "Can't use 'super' outside of a class.")
+            self.error_handler.error(expr.keyword, "Can't use 'super' outside of a class.")
         elif self.current_class != ClassType.SUBCLASS:
-            Lox.error(expr.keyword, "Can't use 'super' in a class with no superclass.")
+            self.error_handler.error(expr.keyword, "Can't use 'super' in a class with no superclass.")
 
-        self.resolve_local(expr, expr.keyword)
+        self.resolve_local(expr, "super")
+        self.resolve_local(expr, "self", "receiver")
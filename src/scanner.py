@@ -1,197 +1,199 @@
+import re
+from sys import intern
+
 from tokentype import TokenType
 from Token import Token
 from error_handler import ErrorHandler
 
 
+KEYWORDS = {
+    "and": TokenType.AND,
+    "class": TokenType.CLASS,
+    "else": TokenType.ELSE,
+    "false": TokenType.FALSE,
+    "for": TokenType.FOR,
+    "fun": TokenType.FUN,
+    "if": TokenType.IF,
+    "nil": TokenType.NIL,
+    "or": TokenType.OR,
+    "print": TokenType.PRINT,
+    "return": TokenType.RETURN,
+    "self": TokenType.SELF,
+    "super": TokenType.SUPER,
+    "true": TokenType.TRUE,
+    "var": TokenType.VAR,
+    "while": TokenType.WHILE,
+}
+
+OPERATORS = {
+    "(": TokenType.LEFT_PAREN,
+    ")": TokenType.RIGHT_PAREN,
+    "{": TokenType.LEFT_BRACE,
+    "}": TokenType.RIGHT_BRACE,
+    ",": TokenType.COMMA,
+    ".": TokenType.DOT,
+    "-": TokenType.MINUS,
+    "+": TokenType.PLUS,
+    ";": TokenType.SEMICOLON,
+    "*": TokenType.STAR,
+    "/": TokenType.SLASH,
+    "!": TokenType.BANG,
+    "!=": TokenType.BANG_EQUAL,
+    "=": TokenType.EQUAL,
+    "==": TokenType.EQUAL_EQUAL,
+    "<": TokenType.LESS,
+    "<=": TokenType.LESS_EQUAL,
+    ">": TokenType.GREATER,
+    ">=": TokenType.GREATER_EQUAL,
+}
+
+# One token, or a run of whitespace and comments, at a time, or else any
+# other single character. `//` is tried before the `/` operator.
+LEXEME = re.compile(
+    r"""(?:[ \t\r\n]|//[^\n]*)+|[A-Za-z_]\w*|[!=<>]=?|[(){},.\-+;*/]|\d+(?:\.\d+)?|"[^"]*"|."""
+)
+
+NUMBER_LEXEME = re.compile(r"\d+(?:\.\d+)?")
+WORD = re.compile(r"\w+")
+
+# What a LEXEME is, by its first character. Anything else (an unterminated
+# string, a non-ASCII letter or digit, a stray character) is irregular and
+# goes through Scanner.scan_irregular.
+IDENTIFIER, OPERATOR, SKIP, SLASH, NUMBER, STRING = range(6)
+LEADING = {"/": SLASH, '"': STRING}
+for c in "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_":
+    LEADING[c] = IDENTIFIER
+for c in "(){},.-+;*!=<>":
+    LEADING[c] = OPERATOR
+for c in " \t\r\n":
+    LEADING[c] = SKIP
+for c in "0123456789":
+    LEADING[c] = NUMBER
+
+
 class Scanner:
-    def __init__(self, source, error_handler):
+    def __init__(self, source, error_handler, start=0, end=None, line=1):
         self.error_handler = error_handler
 
+        # A string source can also be scanned from `start` to `end` only,
+        # `start` being on line `line`.
         self.source = source
+        self.start = start
+        self.end = end
         self.tokens = []
 
-        self._start = 0
-        self._current = 0
-        self._line = 1
-
-        self.keywords = {
-            "add": TokenType.AND,
-            "class": TokenType.CLASS,
-            "else": TokenType.ELSE,
-            "false": TokenType.FALSE,
-            "for": TokenType.FOR,
-            "fun": TokenType.FUN,
-            "if": TokenType.IF,
-            "nil": TokenType.NIL,
-            "or": TokenType.OR,
-            "print": TokenType.PRINT,
-            "return": TokenType.RETURN,
-            "super": TokenType.SUPER,
-            "true": TokenType.TRUE,
-            "var": TokenType.VAR,
-            "while": TokenType.WHILE,
-        }
-
-    def _isAtEnd(self):
-        return self._current >= len(self.source)
+        self._line = line
 
-    def scan_tokens(self):
-        while not self._isAtEnd():
-            self._start = self._current
-            self.scan_token()
+        self.keywords = KEYWORDS
 
-        self.tokens.append(Token(TokenType.EOF, "", None, self._line))
+    def scan_tokens(self):
+        self.tokens = list(self.stream())
         return self.tokens
 
-    def scan_token(self):
-        c = self.advance()
-
-        if c == "(":
-            self.add_token(TokenType.LEFT_PAREN)
-        elif c == ")":
-            self.add_token(TokenType.RIGHT_PAREN)
-        elif c == "{":
-            self.add_token(TokenType.LEFT_BRACE)
-        elif c == "}":
-            self.add_token(TokenType.RIGHT_BRACE)
-        elif c == ",":
-            self.add_token(TokenType.COMMA)
-        elif c == ".":
-            self.add_token(TokenType.DOT)
-        elif c == "-":
-            self.add_token(TokenType.MINUS)
-        elif c == "+":
-            self.add_token(TokenType.PLUS)
-        elif c == ";":
-            self.add_token(TokenType.SEMICOLON)
-        elif c == "*":
-            self.add_token(TokenType.STAR)
-
-        elif c == "!":
-            if self._match("="):
-                self.add_token(TokenType.BANG_EQUAL)
-            else:
-                self.add_token(TokenType.BANG)
-            return
-
-        elif c == "=":
-            if self._match("="):
-                self.add_token(TokenType.EQUAL_EQUAL)
-            else:
-                self.add_token(TokenType.EQUAL)
-            return
-
-        elif c == "<":
-            if self._match("="):
-                self.add_token(TokenType.LESS_EQUAL)
-            else:
-                self.add_token(TokenType.LESS)
-            return
-
-        elif c == ">":
-            if self._match("="):
-                self.add_token(TokenType.GREATER_EQUAL)
-            else:
-                self.add_token(TokenType.GREATER)
-            return
-
-        elif c == "/":
-            if self._match("/"):
-                while self.peek() != "\n" and not self._isAtEnd():
-                    self.advance()
-            else:
-                self.add_token(TokenType.SLASH)
-            return
-
-        elif c == " ":
-            pass
-        elif c == "\r":
-            pass
-        elif c == "\t":
-            return
-        elif c == "\n":
-            self._line += 1
-            return
-
-        elif c == '"':
-            self._string()
-            return
-
-        else:
-            if c.isdigit():
-                self.number()
-            elif c.isalpha():
-                self.identifier()
-            else:
-                self.error_handler.error(self._line, "Unexpected character.")
-            return
-
-    def identifier(self):
-        while self.peek().isalnum() and not self._isAtEnd():
-            self.advance()
-
-        text = self.source[self._start : self._current]
-        if text in self.keywords:
-            _type = self.keywords[text]
+    def stream(self):
+        # Yields the tokens one at a time as they are scanned, ending with
+        # EOF, without keeping them. Errors are reported when the bad
+        # input is reached.
+        #
+        # `source` may also be an iterable of chunks that each end on a line
+        # boundary, such as a file read a few lines at a time. Only a string
+        # can run on past the end of a chunk; its start is carried over to
+        # the next one. Tokens point into the chunk they were scanned from.
+        if isinstance(self.source, str):
+            chunks = (self.source,)
+            current = self.start
         else:
-            _type = TokenType.IDENTIFIER
-
-        self.add_token(_type)
-
-    def _string(self):
-        while self.peek() != '"' and not self._isAtEnd():
-            if self.peek() == "\n":
-                self._line += 1
-            self.advance()
-
-        if self._isAtEnd():
+            chunks = self.source
+            current = 0
+        keywords = self.keywords
+        operators = OPERATORS
+        leading = LEADING
+        identifier = TokenType.IDENTIFIER
+        number = TokenType.NUMBER
+
+        line = self._line
+        pending = ""
+        for chunk in chunks:
+            text = pending + chunk
+            pending = ""
+            end = len(text) if self.end is None else self.end
+            while True:
+                # Every character is part of some match, so each one starts
+                # where the one before it ended.
+                for m in LEXEME.finditer(text, current, end):
+                    lexeme = m.group()
+                    kind = leading.get(lexeme[0])
+                    start = current
+                    length = len(lexeme)
+                    current += length
+
+                    if kind == IDENTIFIER:
+                        yield Token(keywords.get(lexeme, identifier), text, start, length, None, line)
+                    elif kind == OPERATOR:
+                        yield Token(operators[lexeme], text, start, length, None, line)
+                    elif kind == SKIP:
+                        # Adding 0 would still make a new int for every
+                        # token past line 256.
+                        if "\n" in lexeme:
+                            line += lexeme.count("\n")
+                    elif kind == NUMBER:
+                        yield Token(number, text, start, length, float(lexeme), line)
+                    elif kind == SLASH:
+                        if lexeme == "/":
+                            yield Token(TokenType.SLASH, text, start, length, None, line)
+                        else:
+                            line += lexeme.count("\n")
+                    elif kind == STRING and len(lexeme) > 1:
+                        # A string carries the line it ends on. Its value is
+                        # interned, so equal literals are one object and
+                        # comparing them is an identity check.
+                        line += lexeme.count("\n")
+                        yield Token(TokenType.STRING, text, start, length, intern(lexeme[1:-1]), line)
+                    else:
+                        current = start
+                        break
+                else:
+                    break
+
+                if text[current] == '"':
+                    pending = text[current:end]
+                    break
+
+                self._line = line
+                token, current = self.scan_irregular(text, current, end)
+                line = self._line
+                if token is not None:
+                    yield token
+            current = 0
+
+        if pending:
+            self._line = line
+            self.scan_irregular(pending, 0, len(pending))
+            line = self._line
+
+        self._line = line
+        yield Token(TokenType.EOF, "", 0, 0, None, line)
+
+    def scan_irregular(self, text, start, end):
+        # Returns the token found at `start`, if any, and where scanning
+        # resumes.
+        c = text[start]
+
+        if c == '"':
+            self._line += text.count("\n", start, end)
             self.error_handler.error(self._line, "Unterminated string.")
-            return
-
-        # Closing "
-        self.advance()
-
-        value = self.source[self._start + 1 : self._current - 1]
-        self.add_token(TokenType.STRING, value)
-
-    def advance(self):
-        self._current += 1
-        return self.source[self._current - 1]
-
-    def add_token(self, tokentype, literal=None):
-        text = self.source[self._start : self._current]
-        self.tokens.append(Token(tokentype, text, literal, self._line))
-
-    def _match(self, expected):
-        if self._isAtEnd():
-            return False
-        if self.source[self._current] != expected:
-            return False
-
-        self._current += 1
-        return True
-
-    def peek(self):
-        if self._isAtEnd():
-            return "\0"
-        return self.source[self._current]
-
-    def peek_next(self):
-        if self._current + 1 >= len(self.source):
-            return "\0"
-        return self.source[self._current + 1]
-
-    def number(self):
-        while self.peek().isdigit():
-            self.advance()
+            return None, end
 
-        if self.peek() == "." and self.peek_next().isdigit():
-            # Consume the "."
-            self.advance()
+        if c.isdecimal():
+            stop = NUMBER_LEXEME.match(text, start, end).end()
+            lexeme = text[start:stop]
+            return Token(TokenType.NUMBER, text, start, stop - start, float(lexeme), self._line), stop
 
-            while self.isDigit(self.peek()):
-                self.advance()
+        if c.isalpha():
+            stop = WORD.match(text, start, end).end()
+            lexeme = text[start:stop]
+            token = Token(self.keywords.get(lexeme, TokenType.IDENTIFIER), text, start, stop - start, None, self._line)
+            return token, stop
 
-        self.add_token(
-            TokenType.NUMBER, float(self.source[self._start : self._current])
-        )
+        self.error_handler.error(self._line, "Unexpected character.")
+        return None, start + 1
@@ -0,0 +1,64 @@
+POLYMORPHIC_LIMIT = 4
+
+_missing = object()
+
+
+class Shape:
+    # Maps field names to slots in LoxInstance.values. Instances that gained
+    # the same fields in the same order share one Shape, found by following
+    # the transitions from ROOT_SHAPE.
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.transitions = {}
+
+    def with_field(self, name):
+        shape = self.transitions.get(name)
+        if shape is None:
+            slots = dict(self.slots)
+            slots[name] = len(slots)
+            shape = self.transitions[name] = Shape(slots)
+        return shape
+
+    def store(self, name):
+        # Returns (slot, shape after the store).
+        slot = self.slots.get(name)
+        if slot is not None:
+            return slot, self
+        return len(self.slots), self.with_field(name)
+
+
+ROOT_SHAPE = Shape({})
+
+
+class InlineCache:
+    # Remembers the lookup result per Shape at one Get or Set site. The
+    # first shape seen gets the single identity check in `shape`/`result`;
+    # up to POLYMORPHIC_LIMIT more are kept in `entries`, and sites that
+    # see even more shapes go back to asking the shape every time.
+
+    def __init__(self):
+        self.shape = None
+        self.result = None
+        self.entries = {}
+
+    def field(self, shape, name):
+        result = self.entries.get(shape, _missing)
+        if result is _missing:
+            result = shape.slots.get(name)
+            self.record(shape, result)
+        return result
+
+    def store(self, shape, name):
+        result = self.entries.get(shape, _missing)
+        if result is _missing:
+            result = shape.store(name)
+            self.record(shape, result)
+        return result
+
+    def record(self, shape, result):
+        if self.shape is None:
+            self.shape = shape
+            self.result = result
+        elif len(self.entries) < POLYMORPHIC_LIMIT:
+            self.entries[shape] = result
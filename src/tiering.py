@@ -0,0 +1,415 @@
+import builtins
+from time import perf_counter
+
+from Expr import *
+from Stmt import *
+from runtime_error import RuntimeError_
+from lox_callable import LoxCallable
+from lox_function import LoxFunction
+from lox_instance import LoxInstance
+from Environment import _undefined
+from resolver import LOCAL, FREE, FREE_CELL
+from shape import InlineCache
+from lox_to_python import (
+    LoxToPython,
+    PythonFunction,
+    _number_error,
+    _divide_error,
+    _add_error,
+    _fields_error,
+    intern_constants,
+)
+
+DEFAULT_THRESHOLD = 1000
+
+class Unsupported(Exception):
+    pass
+
+
+class FunctionProfile:
+    def __init__(self, declaration):
+        self.declaration = declaration
+        self.calls = 0
+        self.back_edges = 0
+        self.code = None
+        self.failed = False
+
+
+class TierEvent:
+    def __init__(self, kind, name, calls, back_edges, seconds, reason=None):
+        self.kind = kind
+        self.name = name
+        self.calls = calls
+        self.back_edges = back_edges
+        self.seconds = seconds
+        self.reason = reason
+
+    def __str__(self):
+        text = (
+            f"[tier] {self.kind} '{self.name}' after {self.calls} calls, "
+            f"{self.back_edges} back-edges ({self.seconds * 1000:.2f} ms)"
+        )
+        if self.reason is not None:
+            text += f": {self.reason}"
+        return text
+
+
+class Tiering:
+    # Counts calls and loop back-edges per function declaration and swaps
+    # in a compiled Python body once a function gets hot. `hook`, when set,
+    # receives a TierEvent for every compilation and every fallback.
+
+    def __init__(self, interpreter, threshold=DEFAULT_THRESHOLD, hook=None):
+        self.interpreter = interpreter
+        self.threshold = threshold
+        self.hook = hook
+        self.profiles = {}
+
+    def profile(self, declaration):
+        profile = self.profiles.get(declaration)
+        if profile is None:
+            profile = FunctionProfile(declaration)
+            self.profiles[declaration] = profile
+        return profile
+
+    def tier_up(self, profile, is_initializer, is_method):
+        declaration = profile.declaration
+        start = perf_counter()
+
+        try:
+            compiler = TierCompiler(self.interpreter)
+            profile.code = compiler.compile_function(declaration, is_initializer, is_method)
+            kind, reason = "compiled", None
+        except Unsupported as e:
+            profile.failed = True
+            kind, reason = "fallback", str(e)
+        except (SyntaxError, RecursionError, MemoryError, ValueError) as e:
+            # Python can refuse code the tree-walker runs fine, such as
+            # expressions nested deeper than its parser allows.
+            profile.failed = True
+            kind, reason = "fallback", f"Python could not compile it ({type(e).__name__}: {e})"
+
+        if self.hook is not None:
+            self.hook(
+                TierEvent(
+                    kind,
+                    declaration.name.lexeme,
+                    profile.calls,
+                    profile.back_edges,
+                    perf_counter() - start,
+                    reason,
+                )
+            )
+
+
+# ----------------------------------------------------------------------
+# Runtime support for compiled bodies
+
+
+def _call(interpreter, callee, paren, arguments):
+    if not isinstance(callee, LoxCallable):
+        raise RuntimeError_(paren, "Can only call functions and classes.")
+    if callee.arity() != len(arguments):
+        raise RuntimeError_(paren, f"Expected {callee.arity()} arguments but got {len(arguments)}")
+    return callee.call(interpreter, arguments)
+
+
+def _check_callable(callee, paren):
+    # Lox rejects a callee before it evaluates any of the arguments.
+    if not isinstance(callee, LoxCallable):
+        raise RuntimeError_(paren, "Can only call functions and classes.")
+    return callee
+
+
+def _find_method(instance, name, cache):
+    if not isinstance(instance, LoxInstance):
+        raise RuntimeError_(name, "Only instances have properties.")
+    return instance.find_method(name, cache)
+
+
+def _invoke(interpreter, method, instance, paren, arguments):
+    if method.arity() != len(arguments):
+        raise RuntimeError_(paren, f"Expected {method.arity()} arguments but got {len(arguments)}")
+    return method.invoke(interpreter, instance, arguments)
+
+
+def _undefined_variable(name):
+    raise RuntimeError_(name, "Undefined variable '" + name.lexeme + "'.")
+
+
+def _store_cell(cell, value):
+    cell.value = value
+    return value
+
+
+def _property_error(name):
+    raise RuntimeError_(name, "Only instances have properties.")
+
+
+def _set_property(instance, name, value, cache):
+    instance.set(name, value, cache)
+    return value
+
+
+def _super_get(superclass, instance, expr):
+    method = expr.method
+
+    cache = expr.cache
+    if cache is not None and cache[0] is superclass:
+        function = cache[1]
+    else:
+        function = superclass.find_method(method.lexeme)
+        expr.cache = (superclass, function)
+
+    if function is None:
+        raise RuntimeError_(method, f"Undefined property '{method.lexeme}' .")
+    return function.bind(instance)
+
+
+class TierCompiler(LoxToPython):
+    # Reuses the transpiler's expression lowering, but reads captured
+    # variables from the closure's upvalues like the tree-walker and calls
+    # through LoxCallable, so compiled and interpreted code can mix freely.
+    # Locals of the compiled function itself become Python locals, which is
+    # only sound while nothing can capture them: nested functions and
+    # classes are rejected with Unsupported.
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.constants = {}
+        self.counter = 0
+
+        self.namespace = {
+            "__builtins__": builtins,
+            "_float": float,
+            "_str": str,
+            "_undefined": _undefined,
+            "_LoxFunction": LoxFunction,
+            "_LoxInstance": LoxInstance,
+            "_number_error": _number_error,
+            "_divide_error": _divide_error,
+            "_add_error": _add_error,
+            "_fields_error": _fields_error,
+            "_call": _call,
+            "_check_callable": _check_callable,
+            "_find_method": _find_method,
+            "_invoke": _invoke,
+            "_undefined_variable": _undefined_variable,
+            "_store_cell": _store_cell,
+            "_assign_global": self.assign_global,
+            "_property_error": _property_error,
+            "_set_property": _set_property,
+            "_super_get": _super_get,
+            "_G": interpreter.globals.values,
+        }
+
+    def assign_global(self, slot, name, value):
+        self.interpreter.globals.assign_slot(slot, name, value)
+        return value
+
+    def constant(self, value):
+        name = self.constants.get(id(value))
+        if name is None:
+            name = f"K{len(self.constants)}"
+            self.constants[id(value)] = name
+            self.namespace[name] = value
+        return name
+
+    def compile_function(self, declaration, is_initializer, is_method):
+        self.function = PythonFunction(None)
+        self.indent = 1
+        self.pending_names = {}
+        self.line = declaration.name.line
+        self.frame = []
+
+        # A method's frame starts with its receiver.
+        params = []
+        if is_method:
+            params.append(self.declare_local("self"))
+        self.current_initializer = params[0] if is_initializer else None
+
+        for param in declaration.params:
+            params.append(self.declare_local(param.lexeme))
+
+        if params:
+            self.write(f"{', '.join(params)}, = _args")
+        for statement in declaration.body:
+            self.emit_stmt(statement)
+        if is_initializer:
+            self.write(f"return {self.current_initializer}")
+        if not self.function.lines:
+            self.write("pass")
+
+        name = f"T_{declaration.name.lexeme}"
+        source = [f"def {name}(_up, _interp, _args):"]
+        for indent, text, names, line in self.function.lines:
+            source.append("    " * indent + text)
+
+        code = intern_constants(
+            compile("\n".join(source) + "\n", f"<tier {declaration.name.lexeme}>", "exec")
+        )
+        exec(code, self.namespace)
+        return self.namespace[name]
+
+    # ------------------------------------------------------------------
+    # Variables
+
+    def declare_local(self, name):
+        # Mirrors the frame the tree-walker would build: every local gets
+        # the next slot, and blocks give theirs back when they end.
+        self.counter += 1
+        pyname = f"l_{name}_{self.counter}"
+        self.frame.append(pyname)
+        return pyname
+
+    def variable(self, resolved):
+        # Returns ("local", pyname), ("free", upvalue), ("cell", upvalue) or
+        # ("global", None) for a reference. Nothing in a compiled function
+        # is captured, so none of its own locals is a Cell.
+        if resolved is None:
+            return "global", None
+
+        kind, index = resolved
+        if kind == LOCAL:
+            return "local", self.frame[index]
+        if kind == FREE:
+            return "free", f"_up[{index}]"
+        if kind == FREE_CELL:
+            return "cell", f"_up[{index}]"
+        raise Unsupported("captured local")
+
+    def read_variable(self, resolved, name):
+        kind, target = self.variable(resolved)
+        if kind == "local" or kind == "free":
+            return target
+        if kind == "cell":
+            return f"{target}.value"
+
+        t = self.temp()
+        slot = self.interpreter.globals.slot(name.lexeme)
+        return f"({t} if ({t} := _G[{slot}]) is not _undefined else _undefined_variable({self.constant(name)}))"
+
+    def write_variable(self, expr, value, statement):
+        kind, target = self.variable(expr.resolved)
+        if kind == "local":
+            return f"{target} = {value}" if statement else f"({target} := {value})"
+        if kind == "cell":
+            if statement:
+                return f"{target}.value = {value}"
+            return f"_store_cell({target}, {value})"
+        slot = self.interpreter.globals.slot(expr.name.lexeme)
+        return f"_assign_global({slot}, {self.constant(expr.name)}, {value})"
+
+    # ------------------------------------------------------------------
+    # Statements
+
+    def assignment_stmt(self, expr):
+        self.write(self.write_variable(expr, self.expr(expr.value), True))
+
+    def set_stmt(self, expr):
+        t = self.temp()
+        self.write(f"if ({t} := {self.expr(expr.object)}).__class__ is _LoxInstance:")
+        self.indent += 1
+        cache = self.constant(InlineCache())
+        self.write(f"{t}.set({self.constant(expr.name)}, {self.expr(expr.value)}, {cache})")
+        self.indent -= 1
+        self.write("else:")
+        self.indent += 1
+        self.write(f"_fields_error({expr.name.line})")
+        self.indent -= 1
+
+    def visit_print_stmt(self, stmt):
+        self.write(f"print(_interp.stringify({self.expr(stmt.expression)}))")
+
+    def visit_var_stmt(self, stmt):
+        value = "None" if stmt.initializer is None else self.expr(stmt.initializer)
+        self.write(f"{self.declare_local(stmt.name.lexeme)} = {value}")
+
+    def visit_block_stmt(self, stmt):
+        base = len(self.frame)
+        for statement in stmt.statements:
+            self.emit_stmt(statement)
+        del self.frame[base:]
+
+    def visit_for_stmt(self, stmt):
+        base = len(self.frame)
+        super().visit_for_stmt(stmt)
+        del self.frame[base:]
+
+    def visit_function_stmt(self, stmt):
+        raise Unsupported(f"nested function '{stmt.name.lexeme}'")
+
+    def visit_class_stmt(self, stmt):
+        raise Unsupported(f"nested class '{stmt.name.lexeme}'")
+
+    # ------------------------------------------------------------------
+    # Expressions
+
+    def visit_variable_expr(self, expr):
+        return self.read_variable(expr.resolved, expr.name)
+
+    def visit_assign_expr(self, expr):
+        return self.write_variable(expr, self.expr(expr.value), False)
+
+    def equal(self, expr, left, right):
+        # Binding makes a new LoxFunction, and those compare by identity.
+        return f"({left} == {right})"
+
+    def visit_call_expr(self, expr):
+        arguments = ", ".join(self.expr(argument) for argument in expr.arguments)
+        if isinstance(expr.callee, Get):
+            return self.invoke(expr, arguments)
+
+        callee = self.expr(expr.callee)
+        t = self.temp()
+
+        return (
+            f"({t}.call(_interp, [{arguments}]) if ({t} := {callee}).__class__ is _LoxFunction"
+            f" and len({t}.declaration.params) == {len(expr.arguments)}"
+            f" else {self.slow_call(expr, t, arguments)})"
+        )
+
+    def slow_call(self, expr, callee, arguments):
+        paren = self.constant(expr.paren_loc)
+        if arguments:
+            callee = f"_check_callable({callee}, {paren})"
+        return f"_call(_interp, {callee}, {paren}, [{arguments}])"
+
+    def invoke(self, expr, arguments):
+        get = expr.callee
+        instance = self.temp()
+        method = self.temp()
+        name = self.constant(get.name)
+        cache = self.constant(InlineCache())
+        paren = self.constant(expr.paren_loc)
+
+        return (
+            f"(_invoke(_interp, {method}, {instance}, {paren}, [{arguments}])"
+            f" if ({method} := _find_method({instance} := {self.expr(get.object)}, {name}, {cache})) is not None"
+            f" else {self.slow_call(expr, f'{instance}.get({name}, {cache})', arguments)})"
+        )
+
+    def visit_get_expr(self, expr):
+        t = self.temp()
+        name = self.constant(expr.name)
+        cache = self.constant(InlineCache())
+        return f"({t}.get({name}, {cache}) if ({t} := {self.expr(expr.object)}).__class__ is _LoxInstance else _property_error({name}))"
+
+    def visit_set_expr(self, expr):
+        # Like set_stmt, the instance is checked before the value runs.
+        t = self.temp()
+        instance = self.expr(expr.object)
+        value = self.expr(expr.value)
+        cache = self.constant(InlineCache())
+        return (
+            f"(_set_property({t}, {self.constant(expr.name)}, {value}, {cache})"
+            f" if ({t} := {instance}).__class__ is _LoxInstance else _fields_error({expr.name.line}))"
+        )
+
+    def visit_self_expr(self, expr):
+        return self.read_variable(expr.resolved, expr.keyword)
+
+    def visit_super_expr(self, expr):
+        superclass = self.read_variable(expr.resolved, expr.keyword)
+        instance = self.read_variable(expr.receiver, expr.keyword)
+        return f"_super_get({superclass}, {instance}, {self.constant(expr)})"
@@ -28,6 +28,10 @@ class Visitor(ABC):
     def visit_while_stmt(self, stmt:  While):
         pass
 
+    @abstractmethod
+    def visit_for_stmt(self, stmt:  For):
+        pass
+
     @abstractmethod
     def visit_function_stmt(self, stmt:  Function):
         pass
@@ -0,0 +1,672 @@
+from time import time
+
+from Token import Token
+from tokentype import TokenType
+from runtime_error import RuntimeError_
+from chunk import OpCode
+
+CONSTANT = OpCode.CONSTANT.value
+NIL = OpCode.NIL.value
+TRUE = OpCode.TRUE.value
+FALSE = OpCode.FALSE.value
+POP = OpCode.POP.value
+POPN = OpCode.POPN.value
+GET_LOCAL = OpCode.GET_LOCAL.value
+SET_LOCAL = OpCode.SET_LOCAL.value
+GET_GLOBAL = OpCode.GET_GLOBAL.value
+DEFINE_GLOBAL = OpCode.DEFINE_GLOBAL.value
+SET_GLOBAL = OpCode.SET_GLOBAL.value
+GET_UPVALUE = OpCode.GET_UPVALUE.value
+SET_UPVALUE = OpCode.SET_UPVALUE.value
+GET_PROPERTY = OpCode.GET_PROPERTY.value
+SET_PROPERTY = OpCode.SET_PROPERTY.value
+GET_SUPER = OpCode.GET_SUPER.value
+EQUAL = OpCode.EQUAL.value
+NOT_EQUAL = OpCode.NOT_EQUAL.value
+GREATER = OpCode.GREATER.value
+GREATER_EQUAL = OpCode.GREATER_EQUAL.value
+LESS = OpCode.LESS.value
+LESS_EQUAL = OpCode.LESS_EQUAL.value
+ADD = OpCode.ADD.value
+SUBTRACT = OpCode.SUBTRACT.value
+MULTIPLY = OpCode.MULTIPLY.value
+DIVIDE = OpCode.DIVIDE.value
+NOT = OpCode.NOT.value
+NEGATE = OpCode.NEGATE.value
+PRINT = OpCode.PRINT.value
+JUMP = OpCode.JUMP.value
+POP_JUMP_IF_FALSE = OpCode.POP_JUMP_IF_FALSE.value
+JUMP_IF_FALSE_OR_POP = OpCode.JUMP_IF_FALSE_OR_POP.value
+JUMP_IF_TRUE_OR_POP = OpCode.JUMP_IF_TRUE_OR_POP.value
+CALL = OpCode.CALL.value
+TAIL_CALL = OpCode.TAIL_CALL.value
+INVOKE = OpCode.INVOKE.value
+TAIL_INVOKE = OpCode.TAIL_INVOKE.value
+SUPER_INVOKE = OpCode.SUPER_INVOKE.value
+CLOSURE = OpCode.CLOSURE.value
+CLOSE_UPVALUE = OpCode.CLOSE_UPVALUE.value
+RETURN = OpCode.RETURN.value
+CLASS = OpCode.CLASS.value
+INHERIT = OpCode.INHERIT.value
+METHOD = OpCode.METHOD.value
+CHECK_CALLABLE = OpCode.CHECK_CALLABLE.value
+CHECK_INVOKE = OpCode.CHECK_INVOKE.value
+CHECK_INSTANCE = OpCode.CHECK_INSTANCE.value
+
+# Default for the deepest Lox call chain. Frames live on the heap, so
+# this is a limit on Lox programs, not on the Python stack.
+FRAMES_MAX = 10000
+
+# Marks a missing dict entry; unlike None it can never be a Lox value.
+_missing = object()
+
+
+class Closure:
+    __slots__ = ("function", "upvalues")
+
+    def __init__(self, function, upvalues):
+        self.function = function
+        self.upvalues = upvalues
+
+    def __str__(self):
+        return str(self.function)
+
+
+class Upvalue:
+    # While open, `cells` is the VM stack and `index` the captured slot.
+    # Closing moves the value into a private one-element list.
+    __slots__ = ("cells", "index")
+
+    def __init__(self, cells, index):
+        self.cells = cells
+        self.index = index
+
+    def close(self):
+        self.cells = [self.cells[self.index]]
+        self.index = 0
+
+
+class NativeFunction:
+    def __init__(self, name, arity, function):
+        self.name = name
+        self.arity = arity
+        self.function = function
+
+    def __str__(self):
+        return f"<Native Function '{self.name}'>"
+
+
+class VMClass:
+    def __init__(self, name):
+        self.name = name
+        self.methods = {}
+
+    def __str__(self):
+        return self.name
+
+
+class VMInstance:
+    __slots__ = ("klass", "fields")
+
+    def __init__(self, klass):
+        self.klass = klass
+        self.fields = {}
+
+    def __str__(self):
+        return f"{self.klass.name} instance."
+
+
+class BoundMethod:
+    __slots__ = ("receiver", "method")
+
+    def __init__(self, receiver, method):
+        self.receiver = receiver
+        self.method = method
+
+    def __str__(self):
+        return str(self.method)
+
+
+CALLABLE_TYPES = (Closure, BoundMethod, VMClass, NativeFunction)
+
+
+class CallFrame:
+    __slots__ = ("closure", "ip", "base")
+
+    def __init__(self, closure, ip, base):
+        self.closure = closure
+        self.ip = ip
+        self.base = base
+
+
+class VM:
+    def __init__(self, error_handler, frames_max=FRAMES_MAX):
+        self.error_handler = error_handler
+        self.frames_max = frames_max
+        self.globals = {}
+        self.stack = []
+        self.frames = []
+        self.open_upvalues = []
+
+        start_time = time()
+        self.globals["clock"] = NativeFunction("clock", 0, lambda: time() - start_time)
+
+    def interpret(self, function):
+        closure = Closure(function, [])
+        self.stack.append(closure)
+        self.frames.append(CallFrame(closure, 0, 0))
+
+        try:
+            self.run()
+        except RuntimeError_ as e:
+            self.error_handler.runtime_error(e)
+            self.reset_stack()
+
+    def reset_stack(self):
+        self.stack.clear()
+        self.frames.clear()
+        self.open_upvalues.clear()
+
+    def error(self, message):
+        frame = self.frames[-1]
+        line = frame.closure.function.chunk.lines[frame.ip - 1]
+        return RuntimeError_(Token(TokenType.EOF, "", 0, 0, None, line), message)
+
+    def stringify(self, value):
+        if value is None:
+            return "nil"
+        return str(value)
+
+    def capture_upvalue(self, index):
+        # Open upvalues are kept in order of their slots, as in clox, so
+        # closing the ones of a returning frame only looks at the top.
+        # Captures are nearly always of the highest slot yet.
+        open_upvalues = self.open_upvalues
+        i = len(open_upvalues)
+        while i and open_upvalues[i - 1].index > index:
+            i -= 1
+        if i and open_upvalues[i - 1].index == index:
+            return open_upvalues[i - 1]
+
+        upvalue = Upvalue(self.stack, index)
+        open_upvalues.insert(i, upvalue)
+        return upvalue
+
+    def close_upvalues(self, last):
+        open_upvalues = self.open_upvalues
+        while open_upvalues and open_upvalues[-1].index >= last:
+            open_upvalues.pop().close()
+
+    def call_closure(self, closure, argc):
+        if closure.function.arity != argc:
+            raise self.error(f"Expected {closure.function.arity} arguments but got {argc}")
+        if len(self.frames) == self.frames_max:
+            raise self.error("Stack overflow.")
+
+        self.frames.append(CallFrame(closure, 0, len(self.stack) - argc - 1))
+
+    def tail_call(self, frame, callee, argc):
+        # Replaces `frame` with a call to `callee`, whose arguments are on
+        # top of the stack, so tail calls run in constant space. Anything
+        # but a Lox function or method gets an ordinary call.
+        stack = self.stack
+        if type(callee) is BoundMethod:
+            stack[-1 - argc] = callee.receiver
+            callee = callee.method
+        if type(callee) is not Closure:
+            self.call_value(callee, argc)
+            return
+
+        if callee.function.arity != argc:
+            raise self.error(f"Expected {callee.function.arity} arguments but got {argc}")
+        if self.open_upvalues:
+            self.close_upvalues(frame.base)
+        stack[frame.base:] = stack[len(stack) - argc - 1:]
+        frame.closure = callee
+        frame.ip = 0
+
+    def call_value(self, callee, argc):
+        stack = self.stack
+
+        if type(callee) is Closure:
+            self.call_closure(callee, argc)
+        elif type(callee) is BoundMethod:
+            stack[-1 - argc] = callee.receiver
+            self.call_closure(callee.method, argc)
+        elif type(callee) is VMClass:
+            stack[-1 - argc] = VMInstance(callee)
+            initializer = callee.methods.get("init")
+            if initializer is not None:
+                self.call_closure(initializer, argc)
+            elif argc != 0:
+                raise self.error(f"Expected 0 arguments but got {argc}")
+        elif type(callee) is NativeFunction:
+            if callee.arity != argc:
+                raise self.error(f"Expected {callee.arity} arguments but got {argc}")
+            result = callee.function(*stack[len(stack) - argc:])
+            del stack[len(stack) - argc - 1:]
+            stack.append(result)
+        else:
+            raise self.error("Can only call functions and classes.")
+
+    def invoke(self, name, argc):
+        method = self.find_invoked(name, argc)
+        if type(method) is Closure:
+            self.call_closure(method, argc)
+        else:
+            self.call_value(method, argc)
+
+    def find_invoked(self, name, argc):
+        # The method `name` of the receiver under the arguments, or the field
+        # of that name, which then replaces the receiver as the callee.
+        receiver = self.stack[-1 - argc]
+        if type(receiver) is not VMInstance:
+            raise self.error("Only instances have properties.")
+
+        value = receiver.fields.get(name, _missing)
+        if value is not _missing:
+            self.stack[-1 - argc] = value
+            return value
+
+        method = receiver.klass.methods.get(name)
+        if method is None:
+            raise self.error(f"Undefined property '{name}'.")
+        return method
+
+    def run(self):
+        stack = self.stack
+        frames = self.frames
+        globals_ = self.globals
+        push = stack.append
+        pop = stack.pop
+        missing = _missing
+
+        frame = frames[-1]
+        closure = frame.closure
+        code = closure.function.chunk.code
+        constants = closure.function.chunk.constants
+        upvalues = closure.upvalues
+        base = frame.base
+        ip = frame.ip
+
+        while True:
+            op = code[ip]
+            ip += 1
+
+            if op == GET_LOCAL:
+                push(stack[base + code[ip]])
+                ip += 1
+
+            elif op == CONSTANT:
+                push(constants[code[ip]])
+                ip += 1
+
+            elif op == SET_LOCAL:
+                stack[base + code[ip]] = stack[-1]
+                ip += 1
+
+            elif op == GET_GLOBAL:
+                name = constants[code[ip]]
+                ip += 1
+                value = globals_.get(name, missing)
+                if value is missing:
+                    frame.ip = ip
+                    raise self.error(f"Undefined variable '{name}'.")
+                push(value)
+
+            elif op == POP_JUMP_IF_FALSE:
+                value = pop()
+                if value is None or value is False:
+                    ip = code[ip]
+                else:
+                    ip += 1
+
+            elif op == JUMP:
+                ip = code[ip]
+
+            elif op == POP:
+                pop()
+
+            elif op == ADD:
+                b = pop()
+                a = stack[-1]
+                kind = type(a)
+                if kind is type(b) and (kind is float or kind is str):
+                    stack[-1] = a + b
+                else:
+                    frame.ip = ip
+                    raise self.error("Operands must be two numbers or two strings.")
+
+            elif op == SUBTRACT:
+                b = pop()
+                a = stack[-1]
+                if type(a) is float and type(b) is float:
+                    stack[-1] = a - b
+                else:
+                    frame.ip = ip
+                    raise self.error("Operand must be a number.")
+
+            elif op == LESS:
+                b = pop()
+                a = stack[-1]
+                if type(a) is float and type(b) is float:
+                    stack[-1] = a < b
+                else:
+                    frame.ip = ip
+                    raise self.error("Operand must be a number.")
+
+            elif op == CALL:
+                argc = code[ip]
+                ip += 1
+                frame.ip = ip
+                callee = stack[-1 - argc]
+
+                if type(callee) is Closure:
+                    function = callee.function
+                    if function.arity != argc:
+                        raise self.error(f"Expected {function.arity} arguments but got {argc}")
+                    if len(frames) == self.frames_max:
+                        raise self.error("Stack overflow.")
+                    frame = CallFrame(callee, 0, len(stack) - argc - 1)
+                    frames.append(frame)
+                else:
+                    self.call_value(callee, argc)
+                    if frames[-1] is frame:
+                        continue
+                    frame = frames[-1]
+
+                closure = frame.closure
+                code = closure.function.chunk.code
+                constants = closure.function.chunk.constants
+                upvalues = closure.upvalues
+                base = frame.base
+                ip = 0
+
+            elif op == TAIL_CALL or op == TAIL_INVOKE:
+                if op == TAIL_CALL:
+                    argc = code[ip]
+                    ip += 1
+                    frame.ip = ip
+                    callee = stack[-1 - argc]
+                else:
+                    argc = code[ip + 1]
+                    ip += 2
+                    frame.ip = ip
+                    callee = self.find_invoked(constants[code[ip - 2]], argc)
+                self.tail_call(frame, callee, argc)
+
+                frame = frames[-1]
+                closure = frame.closure
+                code = closure.function.chunk.code
+                constants = closure.function.chunk.constants
+                upvalues = closure.upvalues
+                base = frame.base
+                ip = frame.ip
+
+            elif op == RETURN:
+                result = pop()
+                if self.open_upvalues:
+                    self.close_upvalues(base)
+                frames.pop()
+                del stack[base:]
+
+                if not frames:
+                    return
+
+                push(result)
+                frame = frames[-1]
+                closure = frame.closure
+                code = closure.function.chunk.code
+                constants = closure.function.chunk.constants
+                upvalues = closure.upvalues
+                base = frame.base
+                ip = frame.ip
+
+            elif op == GET_UPVALUE:
+                upvalue = upvalues[code[ip]]
+                push(upvalue.cells[upvalue.index])
+                ip += 1
+
+            elif op == SET_UPVALUE:
+                upvalue = upvalues[code[ip]]
+                upvalue.cells[upvalue.index] = stack[-1]
+                ip += 1
+
+            elif op == GREATER:
+                b = pop()
+                a = stack[-1]
+                if type(a) is float and type(b) is float:
+                    stack[-1] = a > b
+                else:
+                    frame.ip = ip
+                    raise self.error("Operand must be a number.")
+
+            elif op == LESS_EQUAL:
+                b = pop()
+                a = stack[-1]
+                if type(a) is float and type(b) is float:
+                    stack[-1] = a <= b
+                else:
+                    frame.ip = ip
+                    raise self.error("Operand must be a number.")
+
+            elif op == GREATER_EQUAL:
+                b = pop()
+                a = stack[-1]
+                if type(a) is float and type(b) is float:
+                    stack[-1] = a >= b
+                else:
+                    frame.ip = ip
+                    raise self.error("Operand must be a number.")
+
+            elif op == MULTIPLY:
+                b = pop()
+                a = stack[-1]
+                if type(a) is float and type(b) is float:
+                    stack[-1] = a * b
+                else:
+                    frame.ip = ip
+                    raise self.error("Operand must be a number.")
+
+            elif op == DIVIDE:
+                b = pop()
+                a = stack[-1]
+                if type(a) is float and type(b) is float:
+                    try:
+                        stack[-1] = a / b
+                    except ZeroDivisionError:
+                        frame.ip = ip
+                        raise self.error("Division by zero.")
+                else:
+                    frame.ip = ip
+                    raise self.error("Operand must be a number.")
+
+            elif op == EQUAL:
+                b = pop()
+                stack[-1] = stack[-1] == b
+
+            elif op == NOT_EQUAL:
+                b = pop()
+                stack[-1] = not (stack[-1] == b)
+
+            elif op == GET_PROPERTY:
+                instance = stack[-1]
+                name = constants[code[ip]]
+                ip += 1
+                if type(instance) is not VMInstance:
+                    frame.ip = ip
+                    raise self.error("Only instances have properties.")
+
+                value = instance.fields.get(name, missing)
+                if value is not missing:
+                    stack[-1] = value
+                    continue
+
+                method = instance.klass.methods.get(name)
+                if method is None:
+                    frame.ip = ip
+                    raise self.error(f"Undefined property '{name}'.")
+                stack[-1] = BoundMethod(instance, method)
+
+            elif op == SET_PROPERTY:
+                value = pop()
+                instance = stack[-1]
+                if type(instance) is not VMInstance:
+                    frame.ip = ip + 1
+                    raise self.error("Only instances have fields.")
+                instance.fields[constants[code[ip]]] = value
+                stack[-1] = value
+                ip += 1
+
+            elif op == INVOKE or op == SUPER_INVOKE:
+                name = constants[code[ip]]
+                argc = code[ip + 1]
+                ip += 2
+                frame.ip = ip
+
+                if op == INVOKE:
+                    self.invoke(name, argc)
+                else:
+                    superclass = pop()
+                    method = superclass.methods.get(name)
+                    if method is None:
+                        raise self.error(f"Undefined property '{name}' .")
+                    self.call_closure(method, argc)
+
+                if frames[-1] is frame:
+                    continue
+                frame = frames[-1]
+                closure = frame.closure
+                code = closure.function.chunk.code
+                constants = closure.function.chunk.constants
+                upvalues = closure.upvalues
+                base = frame.base
+                ip = 0
+
+            elif op == CHECK_CALLABLE:
+                if type(stack[-1]) not in CALLABLE_TYPES:
+                    frame.ip = ip
+                    raise self.error("Can only call functions and classes.")
+
+            elif op == CHECK_INVOKE:
+                # The checks INVOKE would make, made before the arguments run.
+                receiver = stack[-1]
+                name = constants[code[ip]]
+                ip += 1
+                if type(receiver) is not VMInstance:
+                    frame.ip = ip
+                    raise self.error("Only instances have properties.")
+                value = receiver.fields.get(name, missing)
+                if value is missing:
+                    if name not in receiver.klass.methods:
+                        frame.ip = ip
+                        raise self.error(f"Undefined property '{name}'.")
+                elif type(value) not in CALLABLE_TYPES:
+                    frame.ip = ip
+                    raise self.error("Can only call functions and classes.")
+
+            elif op == CHECK_INSTANCE:
+                if type(stack[-1]) is not VMInstance:
+                    frame.ip = ip
+                    raise self.error("Only instances have fields.")
+
+            elif op == NIL:
+                push(None)
+
+            elif op == TRUE:
+                push(True)
+
+            elif op == FALSE:
+                push(False)
+
+            elif op == NOT:
+                value = stack[-1]
+                stack[-1] = value is None or value is False
+
+            elif op == NEGATE:
+                value = stack[-1]
+                if type(value) is not float:
+                    frame.ip = ip
+                    raise self.error("Operand must be a number.")
+                stack[-1] = -value
+
+            elif op == JUMP_IF_FALSE_OR_POP:
+                value = stack[-1]
+                if value is None or value is False:
+                    ip = code[ip]
+                else:
+                    pop()
+                    ip += 1
+
+            elif op == JUMP_IF_TRUE_OR_POP:
+                value = stack[-1]
+                if value is None or value is False:
+                    pop()
+                    ip += 1
+                else:
+                    ip = code[ip]
+
+            elif op == POPN:
+                del stack[len(stack) - code[ip]:]
+                ip += 1
+
+            elif op == PRINT:
+                print(self.stringify(pop()))
+
+            elif op == DEFINE_GLOBAL:
+                globals_[constants[code[ip]]] = pop()
+                ip += 1
+
+            elif op == SET_GLOBAL:
+                name = constants[code[ip]]
+                ip += 1
+                if name not in globals_:
+                    frame.ip = ip
+                    raise self.error(f"Undefined variable '{name}'.")
+                globals_[name] = stack[-1]
+
+            elif op == CLOSURE:
+                function = constants[code[ip]]
+                ip += 1
+                captured = []
+                for _ in range(function.upvalue_count):
+                    if code[ip]:
+                        captured.append(self.capture_upvalue(base + code[ip + 1]))
+                    else:
+                        captured.append(upvalues[code[ip + 1]])
+                    ip += 2
+                push(Closure(function, captured))
+
+            elif op == CLOSE_UPVALUE:
+                self.close_upvalues(len(stack) - 1)
+                pop()
+
+            elif op == GET_SUPER:
+                name = constants[code[ip]]
+                ip += 1
+                superclass = pop()
+                method = superclass.methods.get(name)
+                if method is None:
+                    frame.ip = ip
+                    raise self.error(f"Undefined property '{name}' .")
+                stack[-1] = BoundMethod(stack[-1], method)
+
+            elif op == CLASS:
+                push(VMClass(constants[code[ip]]))
+                ip += 1
+
+            elif op == INHERIT:
+                superclass = stack[-2]
+                if type(superclass) is not VMClass:
+                    frame.ip = ip
+                    raise self.error("Superclass must be a class.")
+                pop().methods.update(superclass.methods)
+
+            elif op == METHOD:
+                method = pop()
+                stack[-1].methods[constants[code[ip]]] = method
+                ip += 1
+
+            else:
+                frame.ip = ip
+                raise self.error(f"Unknown opcode {op}.")
@@ -0,0 +1,108 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# Runs scripts with and without --lazy and compares how they end. Run it from
+# the repository root:
+#
+#     python -m unittest tests/test_lazy.py
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+LOX = os.path.join(SRC, "lox.py")
+sys.path.insert(0, SRC)
+
+from scanner import Scanner
+from Parser import Parser
+from error_handler import ErrorHandler
+from lazy_body import LazyBody
+
+
+def run(source, *flags):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "script.lox")
+        with open(path, "w") as f:
+            f.write(source)
+        result = subprocess.run(
+            [sys.executable, LOX, "--no-cache", *flags, path],
+            capture_output=True, text=True,
+        )
+    return result.returncode, result.stdout, result.stderr
+
+
+class LazyTest(unittest.TestCase):
+    # Each of these bodies is never called. The pre-parse sees the mistake
+    # in it, so --lazy reports it before the script runs, as a full parse
+    # does.
+    UNCALLED_ERRORS = {
+        "print 1 + ;": "Expect expression.",
+        "print a b;": "Expect ';' after value.",
+        "var x = 1; var x = 2;": "Already a variable with this name in this scope.",
+        "var q = q;": "Can't read local variable is its own initializer.",
+        "print self;": "Can't use 'self' outside of a class.",
+    }
+
+    def assert_same_error(self, source, message):
+        for flags in ((), ("--lazy",), ("--lazy", "--stream"), ("--lazy", "--tier-threshold=0")):
+            with self.subTest(source=source, flags=flags):
+                code, stdout, stderr = run(source, *flags)
+                self.assertEqual(code, 65)
+                self.assertEqual(stdout, "")
+                self.assertIn(message, stderr)
+
+    def test_errors_in_uncalled_functions(self):
+        for body, message in self.UNCALLED_ERRORS.items():
+            self.assert_same_error("fun f() { " + body + " }\nprint \"a\";\n", message)
+
+    def test_errors_in_uncalled_methods(self):
+        self.assert_same_error(
+            "class A { init() { return 1; } }\nprint \"a\";\n",
+            "Can't return a value from an initializer.",
+        )
+        self.assert_same_error(
+            "class A { m() { super.m(); } }\nprint \"a\";\n",
+            "Can't use 'super' in a class with no superclass.",
+        )
+
+    def test_duplicate_parameters(self):
+        self.assert_same_error("fun f(a, a) {}\nprint \"a\";\n", "Already a variable with this name in this scope.")
+
+    def test_correct_bodies_stay_lazy(self):
+        # Two loops declaring the same variable are not a duplicate.
+        source = (
+            "fun f(n) {\n"
+            "  var total = 0;\n"
+            "  for (var i = 0; i < n; i = i + 1) total = total + i;\n"
+            "  for (var i = 0; i < n; i = i + 1) total = total + i;\n"
+            "  return total;\n"
+            "}\n"
+            "print f(4);\n"
+        )
+        self.assertEqual(run(source, "--lazy"), (0, "12.0\n", ""))
+
+        error_handler = ErrorHandler()
+        [function, _] = Parser(Scanner(source, error_handler).stream(), error_handler, True).parse()
+        self.assertIsInstance(function.body, LazyBody)
+
+    def test_unseen_error_is_reported_when_called(self):
+        # A mistake the pre-parse does not look for is only found when the
+        # body is parsed, on the first call; a body never called is never
+        # checked.
+        body = "fun f() { fun g(a) { var a; } }\n"
+        message = "Already a variable with this name in this scope."
+
+        code, stdout, stderr = run(body + "print \"a\";\n")
+        self.assertEqual(code, 65)
+        self.assertIn(message, stderr)
+
+        self.assertEqual(run(body + "print \"a\";\n", "--lazy"), (0, "a\n", ""))
+
+        code, stdout, stderr = run(body + "print \"a\";\nf();\nprint \"b\";\n", "--lazy")
+        self.assertEqual(code, 65)
+        self.assertEqual(stdout, "a\n")
+        self.assertIn(message, stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
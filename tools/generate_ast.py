@@ -12,19 +12,19 @@ def main():
         output_dir,
         "Expr",
         [
-            "Assign | name, value",
+            "Assign | name, value | resolved, global_slot",
             "Binary | left, operator, right",
             "Grouping | expression",
             "Literal | value",
             "Logical | left, operator, right",
             "Unary | operator, right",
-            "Variable | name",
+            "Variable | name | resolved, global_slot",
             "Call | callee, paren_loc, arguments",
             "Grouping | expression",
-            "Get | object, name",
-            "Set | object, name, value",
-            "Self | keyword",
-            "Super | keyword, method"
+            "Get | object, name | cache",
+            "Set | object, name, value | cache",
+            "Self | keyword | resolved",
+            "Super | keyword, method | resolved, receiver, cache"
         ],
     )
 
@@ -35,12 +35,13 @@ def main():
             "Block | statements",
             "Expression | expression",
             "Print | expression",
-            "Var | name, initializer",
-            "If | condition, then_branch, else_branch",
-            "While | condition, body",
-            "Function | name, params, body",
+            "Var | name, initializer | storage",
+            "If | keyword, condition, then_branch, else_branch",
+            "While | keyword, condition, body",
+            "For | keyword, initializer, condition, increment, body",
+            "Function | name, params, body | storage, upvalues, cells",
             "Return | keyword, value",
-            "Class | name, superclass, methods",
+            "Class | name, superclass, methods | storage",
         ],
     )
 
@@ -55,14 +56,20 @@ def define_ast(output_dir, base_name, types):
 
     # the AST classes
     for type in types:
-        class_name = type.split("|")[0].strip()
-        fields = type.split("|")[1].strip()
-        define_type(output_file, base_name, class_name, fields)
+        parts = type.split("|")
+        class_name = parts[0].strip()
+        fields = parts[1].strip()
+        # Optional third part: fields the resolver or the runtime fills in,
+        # starting as None
+        cache_fields = parts[2].strip() if len(parts) > 2 else ""
+        define_type(output_file, base_name, class_name, fields, cache_fields)
 
 
 def define_base_class(output_file, base_name):
+    # Nodes keep their fields in __slots__ rather than a __dict__ each,
+    # which makes large programs much smaller and field reads faster.
     output_file.write(f"class {base_name}:\n")
-    output_file.write(f"    pass\n")
+    output_file.write(f"    __slots__ = ()\n")
 
 
 def define_imports(output_file):
@@ -95,16 +102,25 @@ def define_visitor(output_dir, base_name, types):
     print(f"[written]: {output_dir}/visitor.py")
 
 
-def define_type(output_file, base_name, class_name, field_list):
+def define_type(output_file, base_name, class_name, field_list, cache_field_list=""):
+    fields = field_list.split(", ")
+    cache_fields = cache_field_list.split(", ") if cache_field_list else []
+
     output_file.write(f"\nclass {class_name}({base_name}):\n")
+    slots = ", ".join(f'"{field.strip()}"' for field in fields + cache_fields)
+    if len(fields + cache_fields) == 1:
+        slots += ","
+    output_file.write(f"    __slots__ = ({slots})\n")
+    output_file.write("\n")
     output_file.write(f"    def __init__(self, {field_list}):\n")
 
     # Store parameters in fields
-    fields = field_list.split(", ")
     for field in fields:
         # name = field.split(" ")[1]
         name = field.strip()
         output_file.write(f"        self.{name} = {name}\n")
+    for field in cache_fields:
+        output_file.write(f"        self.{field.strip()} = None\n")
     output_file.write("\n")
 
     # Visitor Pattern
@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import tracemalloc
+
+# Reports what the tree-walker's runtime objects cost, on the binary trees
+# benchmark: the bytes each one takes, how many of them one Lox call
+# allocates, and how long the benchmark takes. Run it from the repository
+# root, or pass the src directory of another checkout to compare against it:
+#
+#     python tools/measure_runtime.py [src directory]
+
+BINARY_TREES = """
+class Tree {
+  init(item, depth) {
+    self.item = item;
+    self.depth = depth;
+    if (depth > 0) {
+      var item2 = item + item;
+      depth = depth - 1;
+      self.left = Tree(item2 - 1, depth);
+      self.right = Tree(item2, depth);
+    } else {
+      self.left = nil;
+      self.right = nil;
+    }
+  }
+
+  check() {
+    if (self.left == nil) {
+      return self.item;
+    }
+
+    return self.item + self.left.check() - self.right.check();
+  }
+}
+
+var minDepth = 4;
+var maxDepth = 10;
+var stretchDepth = maxDepth + 1;
+
+print Tree(0, stretchDepth).check();
+
+var longLivedTree = Tree(0, maxDepth);
+
+var iterations = 1;
+var d = 0;
+while (d < maxDepth) {
+  iterations = iterations * 2;
+  d = d + 1;
+}
+
+var depth = minDepth;
+while (depth < stretchDepth) {
+  var check = 0;
+  var i = 1;
+  while (i <= iterations) {
+    check = check + Tree(i, depth).check() + Tree(-i, depth).check();
+    i = i + 1;
+  }
+
+  print check;
+  iterations = iterations / 4;
+  depth = depth + 2;
+}
+
+print longLivedTree.check();
+"""
+
+# A tree of this depth is kept alive to weigh its instances.
+WEIGHED_DEPTH = 12
+
+
+def main():
+    src = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "..", "src")
+    sys.path.insert(0, os.path.abspath(src))
+
+    from lox import Lox
+    from Environment import Environment, Cell
+    from lox_function import LoxFunction
+    from lox_class import LoxClass
+    from lox_instance import LoxInstance
+
+    runtime_classes = (Environment, Cell, LoxFunction, LoxClass, LoxInstance)
+
+    print("bytes per instance")
+    lox = Lox(cache=False)
+    lox.run(BINARY_TREES.split("var minDepth")[0])
+    tree_class = lox.interpreter.globals.values[lox.interpreter.globals.slot("Tree")]
+    check = tree_class.find_method("check")
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    lox.run(f"var weighed = Tree(0, {WEIGHED_DEPTH});")
+    weighed = tracemalloc.get_traced_memory()[0] - before
+    print(f"  LoxInstance with 4 fields: {weighed / (2 ** (WEIGHED_DEPTH + 1) - 1):.0f}")
+
+    instance = LoxInstance(tree_class)
+    frame = []
+    for name, make in (
+        ("LoxFunction (bound)", lambda: check.bind(instance)),
+        ("LoxClass", lambda: LoxClass("Tree", None, {})),
+        ("Environment", lambda: Environment(frame, ())),
+        ("Cell", lambda: Cell(None)),
+    ):
+        objects = [None] * 10000
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(len(objects)):
+            objects[i] = make()
+        size = (tracemalloc.get_traced_memory()[0] - before) / len(objects)
+        print(f"  {name}: {size:.0f}")
+    tracemalloc.stop()
+
+    # Counts the runtime objects that are made, as calls of their
+    # __init__, and the Lox calls that are run.
+    initializers = {klass.__init__.__code__: klass.__name__ for klass in runtime_classes}
+    run_code = LoxFunction.run.__code__
+    counts = dict.fromkeys(initializers.values(), 0)
+    calls = 0
+
+    def profile(frame, event, arg):
+        nonlocal calls
+        if event == "call":
+            code = frame.f_code
+            if code is run_code:
+                calls += 1
+            else:
+                name = initializers.get(code)
+                if name is not None:
+                    counts[name] += 1
+
+    lox = Lox(cache=False)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    sys.setprofile(profile)
+    try:
+        lox.run(BINARY_TREES)
+    finally:
+        sys.setprofile(None)
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print(f"allocations per call ({calls} calls)")
+    for name, count in counts.items():
+        print(f"  {name}: {count / calls:.2f}")
+    print(f"  total: {sum(counts.values()) / calls:.2f}")
+
+    lox = Lox(cache=False)
+    sys.stdout = open(os.devnull, "w")
+    try:
+        start = time.process_time()
+        lox.run(BINARY_TREES)
+        elapsed = time.process_time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print(f"time: {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()